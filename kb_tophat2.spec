@@ -33,6 +33,16 @@ module kb_tophat2 {
         no_coverage_search: use this option to disable the coverage-based search for junctions
         library_type: library type (fr-unstranded, fr-firststrand, fr-secondstrand)
         preset_options: alignment preset options (b2-very-fast, b2-fast, b2-sensitive, b2-very-sensitive)
+        use_transcriptome_index: align against a transcriptome index built from the Genome
+                                 annotation (ignored for Assembly and ContigSet)
+        preview_fraction: preview mode, align only this fraction of each reads library and
+                          report mapping statistics and full run estimates instead of saving
+                          alignments
+        preview_reads: preview mode, align at most this many reads (pairs) of each library
+        resume_from: result directory (or its name) of an earlier run with the same params to
+                     resume, reusing the reads libraries it downloaded, aligned and saved
+        force: realign reads libraries an earlier run aligned from the same inputs, instead of
+               reusing its Alignments
 
         ref: https://ccb.jhu.edu/software/tophat/manual.shtml
     */
@@ -55,19 +65,50 @@ module kb_tophat2 {
         boolean no_coverage_search;
         string library_type; 
         string preset_options; 
+        boolean use_transcriptome_index;
+        float preview_fraction;
+        int preview_reads;
+        string resume_from;
+        boolean force;
     } TopHatInput;
 
+    /*
+        reads_ref: reads library reference
+        total_reads: number of reads (pairs) in the library
+        sampled_reads: number of reads (pairs) aligned in the preview
+        mapped_reads: number of aligned reads, counting each mate
+        mapping_rate: overall read mapping rate of the preview (percent)
+        junction_count: number of junctions found in the preview
+        preview_seconds: wall time of the preview alignment
+        estimated_run_seconds: extrapolated wall time of aligning the whole library
+        estimated_disk_bytes: extrapolated scratch usage of aligning the whole library
+    */
+    typedef structure {
+        obj_ref reads_ref;
+        int total_reads;
+        int sampled_reads;
+        int mapped_reads;
+        float mapping_rate;
+        int junction_count;
+        float preview_seconds;
+        float estimated_run_seconds;
+        int estimated_disk_bytes;
+    } PreviewResult;
+
     /*
         result_directory: folder path that holds all files generated by run_tophat2_app
         reads_alignment_object_ref: generated Alignment/AlignmentSet object reference
         report_name: report name generated by KBaseReport
         report_ref: report reference generated by KBaseReport
+        preview_results: preview statistics of each reads library (preview mode only, no
+                         alignment is saved then)
     */
     typedef structure{
         string result_directory;
         obj_ref reads_alignment_object_ref;
         string report_name;
         string report_ref;
+        list<PreviewResult> preview_results;
     }TopHatResult;
 
     /*  
@@ -77,4 +118,47 @@ module kb_tophat2 {
     */
     funcdef run_tophat2_app(TopHatInput params)
         returns (TopHatResult returnVal) authentication required;
+
+    /*
+        required params:
+        refs: refs to Assembly, ContigSet, or Genome objects to prefetch indexes for
+
+        optional params:
+        workspace_name: workspace in which kb_Bowtie2 may cache the indexes it generates
+        include_transcriptome_index: also build the transcriptome index for Genome refs
+    */
+    typedef structure {
+        list<obj_ref> refs;
+        string workspace_name;
+        boolean include_transcriptome_index;
+    } PrefetchReferenceInput;
+
+    /*
+        ref: ref as given in refs
+        index_key: key of the index in the node-local index cache
+        bowtie2_index_status: one of 'cached' (already on the node), 'fetched' or 'failed'
+        transcriptome_index_status: as bowtie2_index_status, or 'skipped' when not requested
+                                    or ref is not a Genome
+        error: error message if any index failed
+    */
+    typedef structure {
+        obj_ref ref;
+        string index_key;
+        string bowtie2_index_status;
+        string transcriptome_index_status;
+        string error;
+    } ReferenceCacheStatus;
+
+    /*
+        reference_status: cache status of each ref, in the order given
+    */
+    typedef structure {
+        list<ReferenceCacheStatus> reference_status;
+    } PrefetchReferenceResult;
+
+    /*
+        prefetch_reference: populate the node-local index cache ahead of alignment jobs
+    */
+    funcdef prefetch_reference(PrefetchReferenceInput params)
+        returns (PrefetchReferenceResult returnVal) authentication required;
 };
@@ -32,6 +32,19 @@ function kb_tophat2(url, auth, auth_cb, timeout, async_job_check_time_ms, servic
             [params], 1, _callback, _errorCallback);
     };
   
+     this.prefetch_reference = function (params, _callback, _errorCallback) {
+        if (typeof params === 'function')
+            throw 'Argument params can not be a function';
+        if (_callback && typeof _callback !== 'function')
+            throw 'Argument _callback must be a function if defined';
+        if (_errorCallback && typeof _errorCallback !== 'function')
+            throw 'Argument _errorCallback must be a function if defined';
+        if (typeof arguments === 'function' && arguments.length > 1+2)
+            throw 'Too many arguments ('+arguments.length+' instead of '+(1+2)+')';
+        return json_call_ajax(_url, "kb_tophat2.prefetch_reference",
+            [params], 1, _callback, _errorCallback);
+    };
+  
     this.status = function (_callback, _errorCallback) {
         if (_callback && typeof _callback !== 'function')
             throw 'Argument _callback must be a function if defined';
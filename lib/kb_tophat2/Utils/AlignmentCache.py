@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import time
+
+from kb_tophat2.Utils.Helpers import log, mkdir_p
+
+
+class AlignmentCache:
+    """
+    AlignmentCache: persistent store of the Alignment objects produced by earlier runs,
+                    keyed by a hash of their normalized inputs
+
+    The inputs of an alignment are the versioned reads and reference refs and every option
+    that shapes the TopHat2 run or the saved object. Versioned objects never change, so
+    identical inputs always produce the same alignment.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+        mkdir_p(cache_dir)
+
+    @staticmethod
+    def make_key(alignment_input):
+        """
+        make_key: hash of the normalized alignment_input dict
+        """
+        return hashlib.sha256(json.dumps(alignment_input, sort_keys=True)).hexdigest()
+
+    def _record_path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key):
+        """
+        get: return the record for key, or None if it is not cached
+        """
+        try:
+            with open(self._record_path(key)) as record_file:
+                return json.load(record_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, key, alignment_input, alignment_ref):
+        """
+        put: store alignment_ref as the result of alignment_input
+        """
+        record = {'input': alignment_input,
+                  'alignment_ref': alignment_ref,
+                  'time': time.time()}
+
+        # written aside and renamed so concurrent jobs never read a partial record
+        record_path = self._record_path(key)
+        tmp_record_path = '{}.{}.tmp'.format(record_path, os.getpid())
+        with open(tmp_record_path, 'w') as record_file:
+            json.dump(record, record_file, indent=1)
+        os.rename(tmp_record_path, record_path)
+
+        log('cached Alignment {} under {}'.format(alignment_ref, key))
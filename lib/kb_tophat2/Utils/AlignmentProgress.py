@@ -0,0 +1,323 @@
+import json
+import os
+import re
+import threading
+import time
+
+from kb_tophat2.Utils.FileLock import FileLock
+from kb_tophat2.Utils.Helpers import log, mkdir_p
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return 'unknown'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '{}h{:02d}m'.format(hours, minutes)
+    if minutes:
+        return '{}m{:02d}s'.format(minutes, seconds)
+    return '{}s'.format(seconds)
+
+
+def _write_json(path, data):
+    # written aside and renamed so readers never see a partial file
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as json_file:
+        json.dump(data, json_file)
+    os.rename(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class StageHistory:
+    """
+    StageHistory: wall time of the stages of earlier TopHat2 runs, in a history file shared
+                  by all jobs on the node
+
+    Stage times are kept in thread seconds per read base, so runs of other libraries and
+    thread counts predict each other. A stage is estimated by the median of the runs that
+    went through it, and as taking no time if none of them did.
+    """
+
+    def __init__(self, history_file, history_size=50):
+        self.history_file = history_file
+        self.history_size = history_size
+
+    def _load_history(self):
+        try:
+            with open(self.history_file) as history:
+                return json.load(history)
+        except (IOError, OSError, ValueError):
+            return []
+
+    def estimate(self, stages, bases, threads):
+        """
+        estimate: projected seconds of each of stages for a run over bases read bases
+
+        return dict of stage to seconds, or None without any history
+        """
+        history = self._load_history()
+        if not history or not bases:
+            return None
+
+        estimates = {}
+        for stage in stages:
+            rates = sorted(run['stages'][stage] * run['threads'] / float(run['bases'])
+                           for run in history if stage in run['stages'])
+            estimates[stage] = 0
+            if rates:
+                estimates[stage] = rates[len(rates) // 2] * bases / float(max(1, threads))
+
+        return estimates
+
+    def record(self, stage_seconds, bases, threads):
+        """
+        record: adds the stage times of a completed run to the history
+        """
+        if not bases:
+            return
+
+        mkdir_p(os.path.dirname(self.history_file))
+
+        with FileLock(self.history_file + '.lock'):
+            history = self._load_history()
+            history.append({'stages': stage_seconds, 'bases': bases,
+                            'threads': max(1, threads), 'time': time.time()})
+            _write_json(self.history_file, history[-self.history_size:])
+
+
+class AlignmentProgress:
+    """
+    AlignmentProgress: follows a TopHat2 run through its stages by the banners it logs
+
+    Stages only move forward, TopHat2 maps reads to the genome again while it searches for
+    junctions. Every stage change is logged with the time spent so far and the time left,
+    estimated from the stage history (or from a rough throughput before there is any), and
+    written to progress_file for the run's overall progress report.
+    """
+
+    STAGES = ['checking', 'preparing_reads', 'mapping_transcriptome', 'mapping_genome',
+              'searching_junctions', 'mapping_junctions', 'joining_segments', 'reporting',
+              'complete']
+
+    # most specific first, a banner counts for the first stage it matches
+    STAGE_MARKERS = [(re.compile(r'Beginning TopHat run'), 'checking'),
+                     (re.compile(r'Preparing reads'), 'preparing_reads'),
+                     (re.compile(r'Mapping .* to transcriptome'), 'mapping_transcriptome'),
+                     (re.compile(r'Searching for junctions via segment mapping'),
+                      'searching_junctions'),
+                     (re.compile(r'Retrieving sequences for splices|Indexing splices|'
+                                 r'Mapping .* to genome segment_juncs'), 'mapping_junctions'),
+                     (re.compile(r'Mapping .* to genome'), 'mapping_genome'),
+                     (re.compile(r'Joining segment hits'), 'joining_segments'),
+                     (re.compile(r'Reporting output tracks'), 'reporting'),
+                     (re.compile(r'Run complete'), 'complete')]
+
+    def __init__(self, name, bases, threads, history, fallback_seconds=None,
+                 progress_file=None):
+        self.name = name
+        self.bases = bases
+        self.threads = threads
+        self.history = history
+        self.fallback_seconds = fallback_seconds
+        self.progress_file = progress_file
+        self.stage = None
+        self.stage_seconds = {}
+        self.started = time.time()
+        self._stage_started = self.started
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_progress_file(progress_dir, key):
+        """
+        get_progress_file: progress file of the run of a reads library, keyed by its journal
+                           key (a versioned ref) as library names repeat across workspaces
+        """
+        return os.path.join(progress_dir, key.replace('/', '_') + '.json')
+
+    @staticmethod
+    def read_progress(progress_file):
+        """
+        read_progress: the progress a run last wrote to progress_file, None if there is none
+        """
+        return _read_json(progress_file)
+
+    def _match_stage(self, line):
+        for pattern, stage in self.STAGE_MARKERS:
+            if pattern.search(line):
+                return stage
+        return None
+
+    def remaining(self):
+        """
+        remaining: estimated seconds left, None if there is nothing to estimate from
+        """
+        now = time.time()
+        if self.stage == 'complete':
+            return 0
+
+        stage_index = self.STAGES.index(self.stage) if self.stage else 0
+        stages = self.STAGES[stage_index:-1]
+        estimates = self.history.estimate(stages, self.bases, self.threads)
+        if estimates is None:
+            if self.fallback_seconds is None:
+                return None
+            return max(0, self.fallback_seconds - (now - self.started))
+
+        # the current stage may already run longer than estimated
+        current_left = max(0, estimates[stages[0]] - (now - self._stage_started))
+
+        return current_left + sum(estimates[stage] for stage in stages[1:])
+
+    def to_dict(self):
+        return {'name': self.name,
+                'stage': self.stage,
+                'started': self.started,
+                'stage_started': self._stage_started,
+                'stage_seconds': self.stage_seconds,
+                'remaining': self.remaining(),
+                'updated': time.time()}
+
+    def _write_progress(self):
+        if not self.progress_file:
+            return
+        mkdir_p(os.path.dirname(self.progress_file))
+        _write_json(self.progress_file, self.to_dict())
+
+    def on_line(self, line):
+        """
+        on_line: takes a line of TopHat2 output, moving to the stage its banner marks
+        """
+        stage = self._match_stage(line)
+        if stage is None:
+            return
+
+        with self._lock:
+            if self.stage and self.STAGES.index(stage) <= self.STAGES.index(self.stage):
+                return
+            now = time.time()
+            if self.stage:
+                self.stage_seconds[self.stage] = now - self._stage_started
+            self.stage = stage
+            self._stage_started = now
+
+            self._write_progress()
+            log('[{}] stage {} after {}, about {} left'.format(
+                                    self.name, stage, _format_seconds(now - self.started),
+                                    _format_seconds(self.remaining())))
+
+    def finish(self):
+        """
+        finish: reports where the wall time of the run went and adds a completed run to the
+                stage history
+        """
+        with self._lock:
+            self._write_progress()
+            if self.stage != 'complete':
+                return
+
+            log('[{}] stage times: {}'.format(self.name, ', '.join(
+                                    '{} {}'.format(stage, _format_seconds(self.stage_seconds[
+                                                                                    stage]))
+                                    for stage in self.STAGES if stage in self.stage_seconds)))
+            self.history.record(self.stage_seconds, self.bases, self.threads)
+
+
+class SetProgressReporter:
+    """
+    SetProgressReporter: periodically logs the overall progress of the reads libraries of a
+                         sample set
+
+    Saved and aligned libraries are read from the run journal, running ones from the
+    progress files their AlignmentProgress writes. The time left is that of the slowest
+    running library plus the waiting ones, at the mean alignment time of the libraries
+    aligned so far, spread over the concurrent runs.
+    """
+
+    def __init__(self, libraries, run_journal, progress_dir, concurrency, interval=60):
+        """
+        libraries: list of (journal key, library name)
+        """
+        self.libraries = libraries
+        self.run_journal = run_journal
+        self.progress_dir = progress_dir
+        self.concurrency = max(1, concurrency)
+        self.interval = interval
+        self.started = time.time()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _read_progress(self, journal_key):
+        return AlignmentProgress.read_progress(
+                            AlignmentProgress.get_progress_file(self.progress_dir, journal_key))
+
+    def report(self):
+        now = time.time()
+        counts = {'saved': 0, 'aligned': 0, 'aligning': 0, 'waiting': 0}
+        running = []
+        aligned_seconds = []
+        for journal_key, name in self.libraries:
+            progress = self._read_progress(journal_key)
+            if progress and progress['stage'] == 'complete':
+                aligned_seconds.append(sum(progress['stage_seconds'].values()))
+            if self.run_journal.reached(journal_key, 'uploaded'):
+                counts['saved'] += 1
+            elif self.run_journal.reached(journal_key, 'aligned'):
+                counts['aligned'] += 1
+            elif progress and progress['stage'] != 'complete':
+                counts['aligning'] += 1
+                remaining = progress['remaining']
+                if remaining is not None:
+                    remaining = max(0, remaining - (now - progress['updated']))
+                running.append((name, progress, remaining))
+            else:
+                counts['waiting'] += 1
+
+        remaining = None
+        if all(library[2] is not None for library in running) and (
+                                                    aligned_seconds or not counts['waiting']):
+            remaining = max([library[2] for library in running] or [0])
+            if counts['waiting']:
+                remaining += (counts['waiting'] * sum(aligned_seconds) /
+                              len(aligned_seconds) / self.concurrency)
+
+        report = ('sample set progress: {saved} saved, {aligned} aligned, {aligning} aligning, '
+                  '{waiting} waiting of {total}; ').format(total=len(self.libraries), **counts)
+        report += '{} elapsed, about {} left'.format(_format_seconds(now - self.started),
+                                                     _format_seconds(remaining))
+        for name, progress, library_remaining in running:
+            report += '\n  {}: {} for {} ({} elapsed, about {} left)'.format(
+                                name, progress['stage'] or 'starting',
+                                _format_seconds(now - progress['stage_started']),
+                                _format_seconds(now - progress['started']),
+                                _format_seconds(library_remaining))
+        log(report)
+
+    def _try_report(self):
+        # a broken progress file or journal read must not fail the alignments
+        try:
+            self.report()
+        except Exception as e:
+            log('failed to report sample set progress: {}'.format(e))
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._try_report()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        self._try_report()
@@ -0,0 +1,92 @@
+import collections
+import os
+import pipes
+import subprocess
+import threading
+import time
+import traceback
+
+from kb_tophat2.Utils.Helpers import log
+
+
+class CommandRunner:
+    """
+    CommandRunner: runs a command given as argument list, without a shell, streaming its
+                   stdout and stderr to the job log line by line as they are written
+
+    Each line is logged with a timestamp and the runner's prefix (e.g. the reads library),
+    so concurrent runs can be told apart. Output is not kept, except for the last
+    tail_lines lines reported when the command fails, so memory stays flat however much a
+    command writes.
+    """
+
+    # one log line at a time, for the output of all commands running in this process
+    _log_lock = threading.Lock()
+
+    def __init__(self, prefix=None, tail_lines=100):
+        self.prefix = prefix
+        self.tail_lines = tail_lines
+
+    @staticmethod
+    def format_command(command):
+        return ' '.join(pipes.quote(str(arg)) for arg in command)
+
+    def _log(self, prefix, message):
+        with self._log_lock:
+            log('[{}] {}'.format(prefix, message))
+
+    def _stream(self, stream, prefix, tail, on_line):
+        for line in iter(stream.readline, b''):
+            line = line.rstrip(b'\r\n')
+            tail.append(line)
+            self._log(prefix, line)
+            if on_line:
+                try:
+                    on_line(line)
+                except Exception:
+                    # keep draining the pipe, a blocked writer would never exit
+                    self._log(prefix, 'line callback failed, disabled it:\n{}'.format(
+                                                                    traceback.format_exc()))
+                    on_line = None
+        stream.close()
+
+    def run(self, command, memory_monitor=None, on_line=None):
+        """
+        run: runs command to completion, raising ValueError with its last output lines if it
+             fails
+
+        memory_monitor: PeakMemoryMonitor to sample the command's processes with
+        on_line: called with every output line, from the threads reading them; it is
+                 disabled for the rest of the stream if it raises
+        """
+        prefix = self.prefix or os.path.basename(command[0])
+        log('start executing command:\n{}'.format(self.format_command(command)))
+        start_time = time.time()
+
+        # deque appends are atomic, both streams share one buffer in output order
+        tail = collections.deque(maxlen=self.tail_lines)
+        process = subprocess.Popen([str(arg) for arg in command], stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, close_fds=True)
+        if memory_monitor:
+            memory_monitor.start(process.pid)
+
+        readers = [threading.Thread(target=self._stream, args=(stream, prefix, tail, on_line))
+                   for stream in [process.stdout, process.stderr]]
+        try:
+            for reader in readers:
+                reader.daemon = True
+                reader.start()
+            for reader in readers:
+                reader.join()
+            exit_code = process.wait()
+        finally:
+            if memory_monitor:
+                memory_monitor.stop()
+
+        if exit_code != 0:
+            error_msg = 'Error running command:\n{}\n'.format(self.format_command(command))
+            error_msg += 'Exit Code: {}\nLast {} lines of output:\n{}'.format(
+                                            exit_code, len(tail), '\n'.join(tail))
+            raise ValueError(error_msg)
+
+        log('finished command {} in {:.0f}s'.format(prefix, time.time() - start_time))
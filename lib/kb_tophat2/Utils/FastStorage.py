@@ -0,0 +1,249 @@
+import json
+import os
+import shutil
+import uuid
+
+from kb_tophat2.Utils.FileLock import FileLock
+from kb_tophat2.Utils.Helpers import log, mkdir_p
+
+
+class FastStorage:
+    """
+    FastStorage: optional node-local SSD or tmpfs tier for I/O heavy files
+
+    Files are only placed here while at least reserve bytes stay free afterwards, callers
+    keep using scratch otherwise. Everything is created under one directory per run,
+    removed by cleanup.
+
+    Every placement reserves its projected size under a lock shared by all processes on the
+    node, so concurrent workers never count the same free space twice. A reservation only
+    holds back the part not yet written, and is dropped when its owner releases it or exits
+    (its owner keeps a flock on it for as long as it lives).
+    """
+
+    RESERVATIONS_DIR = 'kb_tophat2_reservations'
+
+    # tmpfs and ramfs hold their files in memory
+    MEMORY_FILESYSTEMS = ['tmpfs', 'ramfs']
+
+    def __init__(self, fast_storage_dir, reserve):
+        self.fast_storage_dir = fast_storage_dir
+        self.reserve = reserve
+        self.run_dir = None
+        self.reservations_dir = None
+        self.in_memory = False
+        self._reservations = {}
+
+        if fast_storage_dir:
+            self.run_dir = os.path.join(fast_storage_dir, 'kb_tophat2_' + str(uuid.uuid4()))
+            self.reservations_dir = os.path.join(fast_storage_dir, self.RESERVATIONS_DIR)
+            self.in_memory = self._get_filesystem_type(
+                                                fast_storage_dir) in self.MEMORY_FILESYSTEMS
+
+    @staticmethod
+    def _get_filesystem_type(path):
+        """
+        _get_filesystem_type: type of the filesystem mounted closest above path
+        """
+        path = os.path.realpath(path)
+        mount_point = ''
+        filesystem_type = None
+        try:
+            with open('/proc/mounts') as mounts:
+                for line in mounts:
+                    fields = line.split()
+                    if len(fields) < 3:
+                        continue
+                    mount_dir = fields[1].decode('string_escape')
+                    if ((path == mount_dir or path.startswith(mount_dir.rstrip('/') + '/')) and
+                            len(mount_dir) > len(mount_point)):
+                        mount_point, filesystem_type = mount_dir, fields[2]
+        except (IOError, OSError):
+            return None
+
+        return filesystem_type
+
+    @staticmethod
+    def _dir_size(path):
+        size = 0
+        for root, dirs, files in os.walk(path):
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                if not os.path.islink(file_path):
+                    try:
+                        size += os.path.getsize(file_path)
+                    except OSError:
+                        pass
+        return size
+
+    def _placement_lock(self):
+        mkdir_p(self.reservations_dir)
+        return FileLock(os.path.join(self.reservations_dir, 'placement.lock'))
+
+    @staticmethod
+    def _remove_reservation(reservation_base):
+        for suffix in ['.json', '.lock']:
+            if os.path.exists(reservation_base + suffix):
+                os.remove(reservation_base + suffix)
+
+    def _reserved_space(self):
+        """
+        _reserved_space: bytes reserved on the fast storage and not yet written
+
+        Called with the placement lock held, drops the reservations of exited processes.
+        """
+        reserved = 0
+        for file_name in os.listdir(self.reservations_dir):
+            if not file_name.endswith('.json'):
+                continue
+            reservation_base = os.path.join(self.reservations_dir, file_name[:-len('.json')])
+            owner_lock = FileLock(reservation_base + '.lock')
+            if owner_lock.try_acquire():
+                # the kernel released the lock of an exited owner
+                owner_lock.release()
+                self._remove_reservation(reservation_base)
+                continue
+            try:
+                with open(reservation_base + '.json') as reservation_file:
+                    reservation = json.load(reservation_file)
+            except (IOError, OSError, ValueError):
+                continue
+            reserved += max(0, reservation['size'] - self._dir_size(reservation['path']))
+
+        return reserved
+
+    def _reserve(self, path, size):
+        """
+        _reserve: reserves size bytes for path if they fit while keeping the reserve free
+
+        return whether path was reserved
+        """
+        if not self.fast_storage_dir or not os.path.isdir(self.fast_storage_dir):
+            return False
+
+        with self._placement_lock():
+            if self.free_space() - self._reserved_space() - size < self.reserve:
+                return False
+
+            # the owner lock is taken before the reservation is visible to anyone
+            reservation_base = os.path.join(self.reservations_dir, str(uuid.uuid4()))
+            owner_lock = FileLock(reservation_base + '.lock')
+            owner_lock.acquire()
+            with open(reservation_base + '.json', 'w') as reservation_file:
+                json.dump({'path': path, 'size': size, 'pid': os.getpid()}, reservation_file)
+            self._reservations[path] = (reservation_base, owner_lock)
+
+        return True
+
+    def release(self, path):
+        """
+        release: drops the reservation of path, leaving its files in place
+        """
+        if path not in self._reservations:
+            return
+
+        reservation_base, owner_lock = self._reservations.pop(path)
+        with self._placement_lock():
+            self._remove_reservation(reservation_base)
+            owner_lock.release()
+
+    def free_space(self):
+        """
+        free_space: bytes available to this process on the fast storage
+        """
+        if not self.fast_storage_dir or not os.path.isdir(self.fast_storage_dir):
+            return 0
+        stat = os.statvfs(self.fast_storage_dir)
+        return stat.f_bavail * stat.f_frsize
+
+    def has_room(self, size):
+        """
+        has_room: whether size bytes fit next to the reservations while keeping the reserve
+                  free
+        """
+        if not self.fast_storage_dir or not os.path.isdir(self.fast_storage_dir):
+            return False
+
+        with self._placement_lock():
+            return self.free_space() - self._reserved_space() - size >= self.reserve
+
+    def is_full(self):
+        """
+        is_full: whether the fast storage ran into its reserve, e.g. after outgrowing a
+                 reservation
+        """
+        return self.free_space() < self.reserve
+
+    def make_dir(self, name, size):
+        """
+        make_dir: creates directory name on the fast storage if size bytes fit there,
+                  reserving them until release or move_outputs
+
+        return directory path, or None to fall back to scratch
+        """
+        if not self.fast_storage_dir:
+            return None
+
+        fast_dir = os.path.join(self.run_dir, name)
+        if not self._reserve(fast_dir, size):
+            log('not enough fast storage for {} ({} bytes), using scratch'.format(name, size))
+            return None
+
+        mkdir_p(fast_dir)
+
+        return fast_dir
+
+    def stage_dir(self, src_dir, name):
+        """
+        stage_dir: copies src_dir onto the fast storage if it fits
+
+        return path of the copy, or src_dir to keep using it in place
+        """
+        size = sum(os.path.getsize(os.path.join(src_dir, file_name))
+                   for file_name in os.listdir(src_dir))
+        if not self.fast_storage_dir:
+            return src_dir
+
+        staged_dir = os.path.join(self.run_dir, name)
+        if not self._reserve(staged_dir, size):
+            log('not enough fast storage to stage {} ({} bytes)'.format(src_dir, size))
+            return src_dir
+
+        mkdir_p(self.run_dir)
+        try:
+            shutil.copytree(src_dir, staged_dir)
+        except (IOError, OSError, shutil.Error) as e:
+            log('failed to stage {} onto fast storage, using it in place: {}'.format(
+                                                                                src_dir, e))
+            shutil.rmtree(staged_dir, ignore_errors=True)
+            self.release(staged_dir)
+            return src_dir
+        log('staged {} onto fast storage at {}'.format(src_dir, staged_dir))
+
+        return staged_dir
+
+    def discard(self, fast_dir):
+        """
+        discard: removes fast_dir and drops its reservation
+        """
+        shutil.rmtree(fast_dir, ignore_errors=True)
+        self.release(fast_dir)
+
+    def move_outputs(self, fast_dir, dest_dir, exclude=()):
+        """
+        move_outputs: moves every entry of fast_dir except those in exclude into dest_dir,
+                      then discards fast_dir
+        """
+        mkdir_p(dest_dir)
+        for file_name in os.listdir(fast_dir):
+            if file_name in exclude:
+                continue
+            shutil.move(os.path.join(fast_dir, file_name), os.path.join(dest_dir, file_name))
+
+        self.discard(fast_dir)
+
+    def cleanup(self):
+        for path in list(self._reservations.keys()):
+            self.release(path)
+        if self.run_dir:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
@@ -0,0 +1,171 @@
+import os
+import stat
+import subprocess
+import zlib
+
+
+class FastqStats:
+    """
+    FastqStats: single pass, constant memory FASTQ statistics
+
+    Counts reads and bases, keeps a read length histogram and the range of quality
+    characters, from which the quality encoding is told apart. It can be fed lines, raw
+    (optionally gzipped) chunks of a download, or scan a file itself.
+    """
+
+    def __init__(self):
+        self.read_count = 0
+        self.base_count = 0
+        self.length_histogram = {}
+        self.min_quality = None
+        self.max_quality = None
+
+        self._line_count = 0
+        self._partial_line = b''
+        self._decompressor = None
+
+    def add_line(self, line):
+        position = self._line_count % 4
+        self._line_count += 1
+
+        if position == 1:
+            length = len(line.rstrip(b'\r\n'))
+            self.read_count += 1
+            self.base_count += length
+            self.length_histogram[length] = self.length_histogram.get(length, 0) + 1
+        elif position == 3:
+            quality = line.rstrip(b'\r\n')
+            if not quality:
+                return
+            min_quality = ord(min(quality))
+            max_quality = ord(max(quality))
+            if self.min_quality is None or min_quality < self.min_quality:
+                self.min_quality = min_quality
+            if self.max_quality is None or max_quality > self.max_quality:
+                self.max_quality = max_quality
+
+    def add_chunk(self, chunk, gzipped=False):
+        """
+        add_chunk: feeds a chunk of raw file content
+        """
+        if gzipped:
+            data = b''
+            while chunk:
+                if self._decompressor is None:
+                    self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data += self._decompressor.decompress(chunk)
+                # concatenated gzip members each need a fresh decompressor
+                chunk = self._decompressor.unused_data
+                if chunk:
+                    self._decompressor = None
+            chunk = data
+
+        lines = (self._partial_line + chunk).split(b'\n')
+        self._partial_line = lines.pop()
+        for line in lines:
+            self.add_line(line)
+
+    def finish(self):
+        """
+        finish: accounts for a last line without line break after add_chunk
+        """
+        if self._partial_line:
+            self.add_line(self._partial_line)
+            self._partial_line = b''
+
+    @staticmethod
+    def is_gzipped(reads_file):
+        """
+        is_gzipped: checks the gzip magic number of reads_file
+
+        A named pipe can not be peeked at without consuming it, ReadsStreamer names pipes
+        .gz by the magic number of their download instead.
+        """
+        if stat.S_ISFIFO(os.stat(reads_file).st_mode):
+            return reads_file.endswith('.gz')
+        with open(reads_file, 'rb') as magic_file:
+            return magic_file.read(2) == b'\x1f\x8b'
+
+    def scan_file(self, reads_file):
+        """
+        scan_file: reads reads_file through, gzipped files are decompressed by gzip
+        """
+        if self.is_gzipped(reads_file):
+            process = subprocess.Popen(['gzip', '-dc', reads_file], stdout=subprocess.PIPE)
+            reads_stream = process.stdout
+        else:
+            process = None
+            reads_stream = open(reads_file, 'rb')
+
+        try:
+            for line in reads_stream:
+                self.add_line(line)
+        finally:
+            reads_stream.close()
+            if process and process.wait() != 0:
+                raise RuntimeError('gzip failed on {} with exit code {}'.format(
+                                                                reads_file, process.returncode))
+
+        return self
+
+    def merge(self, other):
+        """
+        merge: adds the statistics of other, e.g. of the mate file of a library
+        """
+        self.read_count += other.read_count
+        self.base_count += other.base_count
+        for length, count in other.length_histogram.items():
+            self.length_histogram[length] = self.length_histogram.get(length, 0) + count
+        for quality in [other.min_quality, other.max_quality]:
+            if quality is None:
+                continue
+            if self.min_quality is None or quality < self.min_quality:
+                self.min_quality = quality
+            if self.max_quality is None or quality > self.max_quality:
+                self.max_quality = quality
+
+        return self
+
+    def quality_encoding(self):
+        return self.get_quality_encoding(self.min_quality, self.max_quality)
+
+    @staticmethod
+    def get_quality_encoding(min_quality, max_quality):
+        """
+        get_quality_encoding: 'phred33', 'solexa64', 'phred64' or None if there are no
+                              qualities, from the range of quality characters (as ordinals)
+
+        Phred+33 qualities start at '!', Solexa+64 at ';' and Phred+64 at '@'. Only
+        characters beyond 'J' (Phred+33 Q41) set the +64 encodings apart, Phred+33 reads of
+        Q26 and up start at ';' as well. Anything ambiguous is taken as Phred+33, the TopHat2
+        default, since a wrong +64 encoding silently corrupts the alignment.
+        """
+        if min_quality is None or max_quality is None:
+            return None
+        if min_quality < ord(';') or max_quality <= ord('J'):
+            return 'phred33'
+        if min_quality < ord('@'):
+            return 'solexa64'
+        return 'phred64'
+
+    def median_length(self):
+        middle = self.read_count // 2
+        seen = 0
+        for length in sorted(self.length_histogram):
+            seen += self.length_histogram[length]
+            if seen > middle:
+                return length
+        return None
+
+    def to_dict(self):
+        lengths = sorted(self.length_histogram)
+        return {'read_count': self.read_count,
+                'base_count': self.base_count,
+                'min_length': lengths[0] if lengths else None,
+                'max_length': lengths[-1] if lengths else None,
+                'median_length': self.median_length(),
+                'length_histogram': dict((str(length), count) for length, count in
+                                         self.length_histogram.items()),
+                'min_quality': self.min_quality,
+                'max_quality': self.max_quality,
+                'quality_encoding': self.quality_encoding()}
@@ -0,0 +1,88 @@
+import fcntl
+import os
+import time
+
+from kb_tophat2.Utils.Helpers import log
+
+
+class FileLock:
+    """
+    FileLock: advisory inter-process lock backed by flock(2)
+
+    The kernel drops the lock when its owner exits, so a crashed job never leaves a lock
+    behind. Lock files themselves are never removed, deleting them would let two processes
+    lock different inodes under the same path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, exclusive=True, timeout=None, poll_interval=5, description=None):
+        """
+        acquire: block until the lock is held, raising RuntimeError after timeout seconds
+
+        exclusive: take an exclusive lock, otherwise a shared one
+        description: what is being waited for, logged while blocked
+        """
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        start_time = time.time()
+        waiting = False
+
+        while True:
+            try:
+                fcntl.flock(self._fd, operation | fcntl.LOCK_NB)
+                break
+            except IOError:
+                pass
+
+            waited = time.time() - start_time
+            if timeout is not None and waited > timeout:
+                self.release()
+                raise RuntimeError('Timed out after {:.0f}s waiting for lock on {}'.format(
+                                                                        waited, self.path))
+            if not waiting:
+                log('waiting for lock on {}'.format(description or self.path))
+                waiting = True
+            time.sleep(poll_interval)
+
+        if waiting:
+            log('acquired lock on {} after {:.0f}s'.format(description or self.path,
+                                                           time.time() - start_time))
+
+    def try_acquire(self, exclusive=True):
+        """
+        try_acquire: take the lock without blocking, returns False if it is held elsewhere
+        """
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(self._fd, operation | fcntl.LOCK_NB)
+        except IOError:
+            self.release()
+            return False
+
+        return True
+
+    def downgrade(self):
+        """
+        downgrade: convert a held exclusive lock into a shared one
+        """
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.release()
@@ -0,0 +1,275 @@
+import json
+import os
+import shutil
+import socket
+import stat
+import time
+
+from kb_tophat2.Utils.FileLock import FileLock
+from kb_tophat2.Utils.Helpers import log, mkdir_p
+
+
+class IndexCache:
+    """
+    IndexCache: persistent node-local store of genome index directories
+
+    Entries are keyed by a versioned object reference (see TopHatUtil._get_index_key), so an
+    entry never goes stale. Cached files are made read-only and entries are evicted in
+    least-recently-used order once the store grows past its byte quota. With an
+    IndexCatalog, every entry gets a manifest and is verified against it before use.
+
+    Concurrent jobs on the same node coordinate through one lock file per key: an index is
+    fetched under an exclusive lock by a single job while the others wait for it, and jobs
+    using an entry hold a shared lock on it so that it is never evicted from under them.
+    """
+
+    ENTRY_INFO_FILE = 'cache_entry.json'
+
+    def __init__(self, cache_dir, quota, lock_timeout=None, catalog=None):
+        self.cache_dir = cache_dir
+        self.entries_dir = os.path.join(cache_dir, 'entries')
+        self.locks_dir = os.path.join(cache_dir, 'locks')
+        self.quota = quota
+        self.lock_timeout = lock_timeout
+        self.catalog = catalog
+        self.hits = 0
+        self.misses = 0
+        self._held_locks = {}
+
+        mkdir_p(self.entries_dir)
+        mkdir_p(self.locks_dir)
+
+    @staticmethod
+    def _dir_size(path):
+        """
+        _dir_size: total size in bytes of regular files under path
+        """
+        size = 0
+        for root, dirs, files in os.walk(path):
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                if not os.path.islink(file_path):
+                    size += os.path.getsize(file_path)
+        return size
+
+    @staticmethod
+    def _make_read_only(path):
+        """
+        _make_read_only: strip write permission from every file under path
+
+        Directories stay writable so that the cache itself can still evict the entry.
+        """
+        read_only = ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+        for root, dirs, files in os.walk(path):
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                os.chmod(file_path, os.stat(file_path).st_mode & read_only)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.entries_dir, key)
+
+    def _lock_path(self, key):
+        return os.path.join(self.locks_dir, key + '.lock')
+
+    def _marker_path(self, key):
+        return os.path.join(self.locks_dir, key + '.inprogress')
+
+    def _entry_info_path(self, key):
+        return os.path.join(self._entry_dir(key), self.ENTRY_INFO_FILE)
+
+    def _read_entry_info(self, key):
+        try:
+            with open(self._entry_info_path(key)) as info_file:
+                return json.load(info_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _touch(self, key):
+        """
+        _touch: record key as most recently used
+        """
+        os.utime(self._entry_info_path(key), None)
+
+    def _list_entries(self):
+        """
+        _list_entries: list (last_used, key, size) for every complete entry, oldest first
+        """
+        entries = []
+        for key in os.listdir(self.entries_dir):
+            entry_info = self._read_entry_info(key)
+            if entry_info is None:
+                continue
+            last_used = os.path.getmtime(self._entry_info_path(key))
+            entries.append((last_used, key, entry_info['size']))
+
+        return sorted(entries)
+
+    def _remove_entry(self, key):
+        log('evicting {} from index cache'.format(key))
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _evict(self, incoming_size, keep):
+        """
+        _evict: drop least recently used entries until incoming_size fits in the quota
+        """
+        entries = self._list_entries()
+        used = sum(size for _, _, size in entries)
+
+        for _, key, size in entries:
+            if used + incoming_size <= self.quota:
+                break
+            if key == keep:
+                continue
+            if key in self._held_locks:
+                log('skipping eviction of {}, it is in use by this job'.format(key))
+                continue
+            entry_lock = FileLock(self._lock_path(key))
+            if not entry_lock.try_acquire():
+                log('skipping eviction of {}, it is in use by another job'.format(key))
+                continue
+            try:
+                self._remove_entry(key)
+            finally:
+                entry_lock.release()
+            used -= size
+
+        if used + incoming_size > self.quota:
+            log('index cache quota of {} bytes exceeded: {} bytes in use'.format(
+                self.quota, used + incoming_size))
+
+    def lookup(self, key):
+        """
+        lookup: return the cached index directory for key, or None if it is not cached
+        """
+        if self._read_entry_info(key) is None:
+            return None
+
+        entry_dir = self._entry_dir(key)
+        if self.catalog and not self.catalog.verify(entry_dir):
+            log('cached index {} failed verification'.format(key))
+            return None
+
+        self._touch(key)
+        return entry_dir
+
+    def insert(self, key, index_dir):
+        """
+        insert: move index_dir into the cache under key and return the cached directory
+        """
+        size = self._dir_size(index_dir)
+        self._evict(size, key)
+
+        entry_dir = self._entry_dir(key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        shutil.move(index_dir, entry_dir)
+        self._make_read_only(entry_dir)
+        if self.catalog:
+            self.catalog.write_manifest(entry_dir)
+
+        # the info file is written last, it marks the entry as complete
+        with open(self._entry_info_path(key), 'w') as info_file:
+            json.dump({'key': key, 'size': size, 'created': time.time()}, info_file)
+
+        log('cached index {} ({} bytes)'.format(key, size))
+
+        return entry_dir
+
+    def _write_marker(self, key, staging_dir):
+        """
+        _write_marker: record which process is fetching key and where it stages the index
+        """
+        with open(self._marker_path(key), 'w') as marker_file:
+            json.dump({'host': socket.gethostname(),
+                       'pid': os.getpid(),
+                       'staging_dir': staging_dir,
+                       'started': time.time()}, marker_file)
+
+    def _recover_stale_marker(self, key):
+        """
+        _recover_stale_marker: clean up after a job that died while fetching key
+
+        Called with the exclusive lock held, so any marker left at this point belongs to a
+        fetch that failed or to a process that is gone (the kernel released its lock when it
+        exited).
+        """
+        marker_path = self._marker_path(key)
+        try:
+            with open(marker_path) as marker_file:
+                marker = json.load(marker_file)
+        except (IOError, OSError, ValueError):
+            if os.path.exists(marker_path):
+                os.remove(marker_path)
+            return
+
+        log('recovering stale index fetch of {} left by pid {} on {}'.format(
+                                                key, marker.get('pid'), marker.get('host')))
+        staging_dir = marker.get('staging_dir')
+        if staging_dir and os.path.isdir(staging_dir) and not os.path.islink(staging_dir):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        os.remove(marker_path)
+
+    def _hold(self, key, entry_lock, pin):
+        if not pin or key in self._held_locks:
+            # not pinned, or already pinned by this process and one shared lock is enough
+            entry_lock.release()
+        else:
+            self._held_locks[key] = entry_lock
+
+    def get_index(self, key, fetch_index, staging_dir=None, pin=False):
+        """
+        get_index: return the cached index directory for key
+
+        fetch_index: called with no arguments on a cache miss, must return a freshly
+                     generated index directory which is then moved into the cache
+        staging_dir: where fetch_index generates the index, removed if the fetching job dies
+        pin: keep the entry pinned (it will not be evicted by any job) until release is
+             called, otherwise it is free to evict once returned
+        """
+        entry_lock = FileLock(self._lock_path(key))
+
+        if self.lookup(key):
+            # a shared lock only waits for a job currently evicting or rebuilding the entry
+            entry_lock.acquire(exclusive=False, timeout=self.lock_timeout, description=key)
+            entry_dir = self.lookup(key)
+            if entry_dir:
+                self.hits += 1
+                log('index cache hit for {}'.format(key))
+                self._hold(key, entry_lock, pin)
+                return entry_dir
+            entry_lock.release()
+
+        entry_lock.acquire(exclusive=True, timeout=self.lock_timeout, description=key)
+        try:
+            entry_dir = self.lookup(key)
+            if entry_dir:
+                self.hits += 1
+                log('index cache hit for {} fetched by another job'.format(key))
+            else:
+                self.misses += 1
+                log('index cache miss for {}'.format(key))
+                self._recover_stale_marker(key)
+                self._write_marker(key, staging_dir)
+                entry_dir = self.insert(key, fetch_index())
+                os.remove(self._marker_path(key))
+            entry_lock.downgrade()
+        except Exception:
+            entry_lock.release()
+            raise
+
+        self._hold(key, entry_lock, pin)
+
+        return entry_dir
+
+    def release(self, key=None):
+        """
+        release: unpin the entry for key, or every entry held by this process
+        """
+        keys = [key] if key else list(self._held_locks.keys())
+        for held_key in keys:
+            entry_lock = self._held_locks.pop(held_key, None)
+            if entry_lock:
+                entry_lock.release()
+
+    def log_stats(self):
+        log('index cache stats: {} hits, {} misses'.format(self.hits, self.misses))
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+from kb_tophat2.Utils.Helpers import log
+
+
+class IndexCatalog:
+    """
+    IndexCatalog: writes and verifies manifests describing cached Bowtie2 index directories
+
+    A manifest records the index base name, whether it is a large (.bt2l) index, the
+    bowtie2 version it was catalogued with and the size, mtime and md5 of every file.
+    Verification compares sizes and mtimes only, contents are re-hashed just when those
+    no longer match.
+    """
+
+    MANIFEST_FILE = 'index_manifest.json'
+
+    # files bowtie2-build writes for an index, without the .bt2/.bt2l extension
+    INDEX_FILE_SUFFIXES = ['.1', '.2', '.3', '.4', '.rev.1', '.rev.2']
+
+    def __init__(self, bowtie2_version=None):
+        self.bowtie2_version = bowtie2_version
+
+    @staticmethod
+    def _md5(file_path):
+        """
+        _md5: md5 hex digest of file content, read in 1MB chunks
+        """
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as index_file:
+            for chunk in iter(lambda: index_file.read(1024 * 1024), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    @classmethod
+    def find_index_base(cls, index_dir):
+        """
+        find_index_base: finds the base name of the complete Bowtie2 index in index_dir
+
+        return (base_name, large_index)
+        """
+        index_files = os.listdir(index_dir)
+
+        for index_file in index_files:
+            match = re.match(r'(.*)\.(rev\.)?\d\.(bt2l?)$', index_file)
+            # should match Bdistachyon_v3.1.assembly.3.bt2 or Bdistachyon_v3.1.assembly.rev.1.bt2
+            # but not bowtie2_index_153005139683.tar.gz
+            # and return Bdistachyon_v3.1.assembly as group 1
+            if not match:
+                continue
+            base_name = match.group(1)
+            extension = match.group(3)
+            expected_files = [base_name + suffix + '.' + extension
+                              for suffix in cls.INDEX_FILE_SUFFIXES]
+            if all(expected_file in index_files for expected_file in expected_files):
+                return base_name, extension == 'bt2l'
+
+        # the base name is a required TopHat parameter
+        raise RuntimeError("Unable to parse Bowtie index files: {}".format(index_files))
+
+    def _manifest_path(self, index_dir):
+        return os.path.join(index_dir, self.MANIFEST_FILE)
+
+    def _write(self, index_dir, manifest):
+        # written aside and renamed so readers never see a partial manifest
+        manifest_path = self._manifest_path(index_dir)
+        tmp_manifest_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+        with open(tmp_manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        os.rename(tmp_manifest_path, manifest_path)
+
+    def write_manifest(self, index_dir):
+        """
+        write_manifest: catalog every file in index_dir, returns the manifest
+        """
+        base_name, large_index = self.find_index_base(index_dir)
+
+        files = {}
+        for root, dirs, file_names in os.walk(index_dir):
+            for file_name in file_names:
+                if file_name.startswith(self.MANIFEST_FILE):
+                    continue
+                file_path = os.path.join(root, file_name)
+                file_stat = os.stat(file_path)
+                files[os.path.relpath(file_path, index_dir)] = {'size': file_stat.st_size,
+                                                                'mtime': file_stat.st_mtime,
+                                                                'md5': self._md5(file_path)}
+
+        manifest = {'base_name': base_name,
+                    'large_index': large_index,
+                    'bowtie2_version': self.bowtie2_version,
+                    'files': files,
+                    'created': time.time()}
+        self._write(index_dir, manifest)
+
+        log('catalogued index {} with {} files'.format(base_name, len(files)))
+
+        return manifest
+
+    def read_manifest(self, index_dir):
+        """
+        read_manifest: returns the manifest of index_dir, or None if it has none
+        """
+        try:
+            with open(self._manifest_path(index_dir)) as manifest_file:
+                return json.load(manifest_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def verify(self, index_dir, full=False):
+        """
+        verify: checks index_dir against its manifest
+
+        Every file is stat'ed; files whose size or mtime changed (or all files, if full is
+        set) are re-hashed. The manifest is refreshed when the content still matches.
+        """
+        manifest = self.read_manifest(index_dir)
+        if manifest is None:
+            log('index {} has no manifest'.format(index_dir))
+            return False
+
+        refreshed = False
+        for relative_path, file_info in manifest['files'].items():
+            file_path = os.path.join(index_dir, relative_path)
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                log('index file {} is missing'.format(file_path))
+                return False
+
+            if file_stat.st_size != file_info['size']:
+                log('index file {} changed size'.format(file_path))
+                return False
+
+            if not full and file_stat.st_mtime == file_info['mtime']:
+                continue
+
+            if self._md5(file_path) != file_info['md5']:
+                log('index file {} failed checksum verification'.format(file_path))
+                return False
+
+            if file_stat.st_mtime != file_info['mtime']:
+                file_info['mtime'] = file_stat.st_mtime
+                refreshed = True
+
+        if refreshed:
+            self._write(index_dir, manifest)
+
+        return True
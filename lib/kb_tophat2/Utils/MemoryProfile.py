@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+
+from kb_tophat2.Utils.FileLock import FileLock
+from kb_tophat2.Utils.Helpers import log, mkdir_p
+
+
+class PeakMemoryMonitor:
+    """
+    PeakMemoryMonitor: samples the private memory of a process and all its descendants
+
+    Private memory is resident memory not shared with other processes, so the index that
+    concurrent runs map from page cache is not counted against each of them.
+    """
+
+    def __init__(self, poll_interval=1):
+        self.poll_interval = poll_interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _get_process_tree(pid):
+        children = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/{}/stat'.format(entry)) as stat_file:
+                    # the command name may hold spaces, fields after it are fixed
+                    ppid = int(stat_file.read().rsplit(')', 1)[1].split()[1])
+            except (IOError, OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+
+        tree = [pid]
+        for process in tree:
+            tree.extend(children.get(process, []))
+
+        return tree
+
+    @classmethod
+    def get_private_memory(cls, pid):
+        """
+        get_private_memory: resident minus shared memory of pid and its descendants, in bytes
+        """
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        private_memory = 0
+        for process in cls._get_process_tree(pid):
+            try:
+                with open('/proc/{}/statm'.format(process)) as statm_file:
+                    fields = statm_file.read().split()
+            except (IOError, OSError):
+                continue
+            private_memory += (int(fields[1]) - int(fields[2])) * page_size
+
+        return private_memory
+
+    def _sample(self, pid):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, self.get_private_memory(pid))
+            self._stop_event.wait(self.poll_interval)
+
+    def start(self, pid):
+        self._thread = threading.Thread(target=self._sample, args=(pid,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        stop: stops sampling
+
+        return peak private memory seen, in bytes
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+        return self.peak
+
+
+class MemoryProfile:
+    """
+    MemoryProfile: estimates the peak private memory of a tophat run, calibrated by the
+                   peaks measured in earlier runs
+
+    The rough model is a fixed worker_memory plus index_ratio times the index size, as
+    segment_juncs and tophat_reports load the reference sequence privately. Measured peaks
+    are kept with the index size and read length of their run in a history file shared by
+    all jobs on the node. A new run is estimated by the model scaled with the largest
+    measured-to-modelled ratio among recent runs of similar read length (or all recent runs
+    if there are none), plus a safety margin.
+    """
+
+    def __init__(self, history_file, worker_memory, index_ratio=0.5, history_size=50,
+                 safety_margin=1.1):
+        self.history_file = history_file
+        self.worker_memory = worker_memory
+        self.index_ratio = index_ratio
+        self.history_size = history_size
+        self.safety_margin = safety_margin
+
+    def _model(self, index_size):
+        return self.worker_memory + self.index_ratio * index_size
+
+    def _load_history(self):
+        try:
+            with open(self.history_file) as history:
+                return json.load(history)
+        except (IOError, OSError, ValueError):
+            return []
+
+    def estimate(self, index_size, read_length=None):
+        """
+        estimate: projected peak private memory in bytes of a tophat run
+        """
+        history = self._load_history()
+        if read_length:
+            similar = [run for run in history if run.get('read_length') and
+                       0.5 <= float(run['read_length']) / read_length <= 2]
+            history = similar or history
+
+        model = self._model(index_size)
+        if not history:
+            return int(model)
+
+        calibration = max(run['peak'] / self._model(run['index_size']) for run in history)
+
+        return int(model * calibration * self.safety_margin)
+
+    def record(self, index_size, read_length, peak):
+        """
+        record: adds a measured peak to the history
+        """
+        mkdir_p(os.path.dirname(self.history_file))
+
+        with FileLock(self.history_file + '.lock'):
+            history = self._load_history()
+            history.append({'index_size': index_size, 'read_length': read_length,
+                            'peak': peak, 'time': time.time()})
+            history = history[-self.history_size:]
+
+            tmp_history_file = '{}.{}.tmp'.format(self.history_file, os.getpid())
+            with open(tmp_history_file, 'w') as history_file:
+                json.dump(history, history_file)
+            os.rename(tmp_history_file, self.history_file)
+
+        log('recorded peak private memory of {:.2f} GB (index {:.2f} GB, read length {})'.format(
+                            float(peak) / 1024 ** 3, float(index_size) / 1024 ** 3, read_length))
@@ -0,0 +1,258 @@
+import Queue
+import threading
+import traceback
+
+from kb_tophat2.Utils.Helpers import log
+
+
+class PipelineError(Exception):
+    """
+    PipelineError: result of an item that failed in stage, or was cancelled after another
+                   item failed
+    """
+
+    def __init__(self, stage, message, cancelled=False):
+        super(PipelineError, self).__init__(stage, message, cancelled)
+        self.stage = stage
+        self.message = message
+        self.cancelled = cancelled
+
+    def __str__(self):
+        if self.cancelled:
+            return '{} cancelled: {}'.format(self.stage, self.message)
+        return '{} failed: {}'.format(self.stage, self.message)
+
+
+class ReadsPipeline:
+    """
+    ReadsPipeline: runs the download, align and upload stages of a set of reads libraries
+                   concurrently
+
+    While align_workers libraries are aligning, up to prefetch_depth further libraries are
+    downloaded ahead of them (all but the first only while has_room reports enough disk),
+    and finished alignments are uploaded in the background. Libraries are downloaded in
+    batches of up to batch_size, as soon as a batch fits in that window or an aligner would
+    otherwise go idle. Items are taken in order and only once admit lets them in, so
+    downloads also wait for resources reserved by admit to be freed.
+
+    download: called with a list of items, returns the downloaded reads of each
+    align: called with an item and its downloaded reads, returns the alignment
+    upload: called with an item and its alignment, returns the result for the item
+    admit: called with the next item to download, returns whether it may start now
+    on_error: called once with the first PipelineError, with cancel_on_error set the items
+              not yet through the pipeline are then cancelled
+    """
+
+    def __init__(self, download, align, upload, align_workers, prefetch_depth=2,
+                 batch_size=1, upload_workers=1, has_room=None, admit=None,
+                 cancel_on_error=False, on_error=None, poll_interval=5):
+        self.download = download
+        self.align = align
+        self.upload = upload
+        self.align_workers = max(1, align_workers)
+        self.prefetch_depth = max(0, prefetch_depth)
+        self.batch_size = max(1, batch_size)
+        self.upload_workers = max(1, upload_workers)
+        self.has_room = has_room or (lambda: True)
+        self.admit = admit or (lambda item: True)
+        self.cancel_on_error = cancel_on_error
+        self.on_error = on_error
+        self.poll_interval = poll_interval
+
+        self._buffered = 0
+        self._condition = threading.Condition()
+        self._error_lock = threading.Lock()
+        self._failed = False
+        self._cancelled = threading.Event()
+        self._results = []
+
+    def _record_error(self, index, stage):
+        with self._error_lock:
+            error = PipelineError(stage, traceback.format_exc(),
+                                  cancelled=self._cancelled.is_set())
+            first_error = not self._failed
+            self._failed = True
+        log('caught exception in {} of library {}:\n{}'.format(stage, index, error))
+        self._results[index] = error
+
+        if first_error:
+            if self.cancel_on_error:
+                log('cancelling remaining libraries')
+                self._cancelled.set()
+                with self._condition:
+                    self._condition.notify_all()
+            if self.on_error:
+                self.on_error(error)
+
+    def _record_cancelled(self, index, stage):
+        self._results[index] = PipelineError(stage, 'an earlier library failed',
+                                             cancelled=True)
+
+    def _slot_limit(self):
+        limit = self.align_workers + self.prefetch_depth
+        if not self.has_room():
+            # reads beyond what the aligners need next are only fetched when disk allows
+            limit = min(limit, self.align_workers + 1)
+        return limit
+
+    def _reserve_slots(self, count, align_queue):
+        """
+        _reserve_slots: waits until a batch of up to count libraries may be downloaded
+
+        return number of libraries reserved
+        """
+        with self._condition:
+            while True:
+                limit = self._slot_limit()
+                free = limit - self._buffered
+                if free >= min(count, limit) or (free > 0 and align_queue.empty()):
+                    break
+                self._condition.wait(self.poll_interval)
+
+            reserved = min(count, free)
+            self._buffered += reserved
+
+        return reserved
+
+    def _release_slot(self, count=1):
+        with self._condition:
+            self._buffered -= count
+            self._condition.notify_all()
+
+    def _admit_batch(self, pending, count, align_queue):
+        """
+        _admit_batch: takes up to count leading items of pending that admit lets in, waiting
+                      while it lets in none
+
+        return list of (index, item)
+        """
+        while True:
+            batch = []
+            while (pending and len(batch) < count and not self._cancelled.is_set() and
+                   self.admit(pending[0][1])):
+                batch.append(pending.pop(0))
+            if len(batch) < count:
+                self._release_slot(count - len(batch))
+            if batch:
+                return batch
+
+            if self._cancelled.is_set():
+                return []
+
+            # wait for an alignment to finish and free what the next item needs
+            with self._condition:
+                self._condition.wait(self.poll_interval)
+            count = self._reserve_slots(count, align_queue)
+
+    def _download_batch(self, batch):
+        """
+        _download_batch: download a batch of (index, item), falling back to one call per item
+                         if the batch fails
+
+        return list of (index, item, downloaded)
+        """
+        try:
+            downloaded = self.download([item for _, item in batch])
+            return [(index, item, reads) for (index, item), reads in zip(batch, downloaded)]
+        except Exception:
+            if len(batch) == 1:
+                index, _ = batch[0]
+                self._record_error(index, 'download')
+                self._release_slot()
+                return []
+            log('batch download failed:\n{}\nretrying libraries one by one'.format(
+                                                                    traceback.format_exc()))
+
+        downloaded = []
+        for index, item in batch:
+            downloaded += self._download_batch([(index, item)])
+
+        return downloaded
+
+    def _run_downloads(self, items, align_queue):
+        pending = list(enumerate(items))
+        while pending and not self._cancelled.is_set():
+            count = self._reserve_slots(min(self.batch_size, len(pending)), align_queue)
+            batch = self._admit_batch(pending, count, align_queue)
+
+            for task in self._download_batch(batch):
+                align_queue.put(task)
+
+        for index, _ in pending:
+            self._record_cancelled(index, 'download')
+
+        for _ in range(self.align_workers):
+            align_queue.put(None)
+
+    def _run_alignments(self, align_queue, upload_queue):
+        while True:
+            task = align_queue.get()
+            if task is None:
+                return
+            index, item, downloaded = task
+            if self._cancelled.is_set():
+                self._record_cancelled(index, 'alignment')
+                self._release_slot()
+                continue
+
+            try:
+                aligned = self.align(item, downloaded)
+            except Exception:
+                self._record_error(index, 'alignment')
+                continue
+            finally:
+                self._release_slot()
+
+            upload_queue.put((index, item, aligned))
+
+    def _run_uploads(self, upload_queue):
+        while True:
+            task = upload_queue.get()
+            if task is None:
+                return
+            index, item, aligned = task
+            if self._cancelled.is_set():
+                self._record_cancelled(index, 'upload')
+                continue
+
+            try:
+                self._results[index] = self.upload(item, aligned)
+            except Exception:
+                self._record_error(index, 'upload')
+
+    @staticmethod
+    def _start(target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def run(self, items):
+        """
+        run: push every item through the pipeline
+
+        return results in the order of items, failed or cancelled items get a PipelineError
+        """
+        self._results = [None] * len(items)
+        align_queue = Queue.Queue()
+        upload_queue = Queue.Queue()
+
+        log('running pipeline of {} libraries with {} aligners, prefetch depth {} and download '
+            'batch size {}'.format(len(items), self.align_workers, self.prefetch_depth,
+                                   self.batch_size))
+
+        downloader = self._start(self._run_downloads, items, align_queue)
+        aligners = [self._start(self._run_alignments, align_queue, upload_queue)
+                    for _ in range(self.align_workers)]
+        uploaders = [self._start(self._run_uploads, upload_queue)
+                     for _ in range(self.upload_workers)]
+
+        downloader.join()
+        for aligner in aligners:
+            aligner.join()
+        for _ in uploaders:
+            upload_queue.put(None)
+        for uploader in uploaders:
+            uploader.join()
+
+        return self._results
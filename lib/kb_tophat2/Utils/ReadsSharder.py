@@ -0,0 +1,181 @@
+import os
+import subprocess
+
+from kb_tophat2.Utils.FastqStats import FastqStats
+from kb_tophat2.Utils.Helpers import log, mkdir_p
+
+
+class ReadsSharder:
+    """
+    ReadsSharder: splits FASTQ reads files into shards that can be aligned independently
+
+    Records are dealt out to the shards in blocks of block_records. Every reads file of a
+    library is split with the same block assignment, so mates stay paired across shards.
+    Gzipped input (see FastqStats.is_gzipped) is read through gzip in a separate process,
+    and shards named .gz are written back with gzip.
+
+    A library can also be subsampled, with the same record selection applied to every reads
+    file of the library, and an interleaved reads file can be split into its two mate files.
+    """
+
+    def __init__(self, shard_count, block_records=10000):
+        self.shard_count = shard_count
+        self.block_records = block_records
+
+    @staticmethod
+    def _open_input(reads_file):
+        if not FastqStats.is_gzipped(reads_file):
+            return None, open(reads_file, 'rb')
+        process = subprocess.Popen(['gzip', '-dc', reads_file], stdout=subprocess.PIPE)
+        return process, process.stdout
+
+    @staticmethod
+    def _open_output(shard_file):
+        output_file = open(shard_file, 'wb')
+        if not shard_file.endswith('.gz'):
+            return None, output_file
+        process = subprocess.Popen(['gzip', '-1', '-c'], stdin=subprocess.PIPE,
+                                   stdout=output_file)
+        output_file.close()
+        return process, process.stdin
+
+    @staticmethod
+    def _close(process, stream, description):
+        stream.close()
+        if process and process.wait() != 0:
+            raise RuntimeError('gzip failed on {} with exit code {}'.format(
+                                                            description, process.returncode))
+
+    def _split_file(self, reads_file, shard_files, block_records=None):
+        """
+        _split_file: deals the records of reads_file out to shard_files, in blocks of
+                     block_records (default self.block_records)
+
+        return number of records written to each shard
+        """
+        input_process, input_stream = self._open_input(reads_file)
+        outputs = [self._open_output(shard_file) for shard_file in shard_files]
+        record_counts = [0] * len(shard_files)
+
+        try:
+            block_lines = (block_records or self.block_records) * 4
+            line_count = 0
+            for line in input_stream:
+                shard = (line_count // block_lines) % len(shard_files)
+                outputs[shard][1].write(line)
+                line_count += 1
+                if line_count % 4 == 0:
+                    record_counts[shard] += 1
+        finally:
+            for (output_process, output_stream), shard_file in zip(outputs, shard_files):
+                self._close(output_process, output_stream, shard_file)
+            self._close(input_process, input_stream, reads_file)
+
+        return record_counts
+
+    def split(self, reads_files, shard_dir):
+        """
+        split: splits reads_files into shard_count shards under shard_dir
+
+        return list of reads files of each non-empty shard, in the order of reads_files
+        """
+        log('start splitting {} into {} shards'.format(reads_files, self.shard_count))
+
+        shards = []
+        for shard in range(self.shard_count):
+            shard_reads_dir = os.path.join(shard_dir, 'reads_shard_{}'.format(shard))
+            mkdir_p(shard_reads_dir)
+            shards.append([os.path.join(shard_reads_dir, os.path.basename(reads_file))
+                           for reads_file in reads_files])
+
+        record_counts = None
+        for index, reads_file in enumerate(reads_files):
+            file_record_counts = self._split_file(reads_file,
+                                                  [shard[index] for shard in shards])
+            if record_counts is not None and file_record_counts != record_counts:
+                raise ValueError('Paired reads files {} hold different numbers of '
+                                 'records'.format(reads_files))
+            record_counts = file_record_counts
+
+        log('records per shard: {}'.format(record_counts))
+
+        return [shard for shard, record_count in zip(shards, record_counts) if record_count]
+
+    def deinterleave(self, reads_file, mate_files):
+        """
+        deinterleave: writes alternating records of interleaved reads_file to the two
+                      mate_files, in one pass
+
+        return number of read pairs
+        """
+        log('start splitting interleaved {} into {}'.format(reads_file, mate_files))
+
+        for mate_file in mate_files:
+            mkdir_p(os.path.dirname(mate_file))
+        record_counts = self._split_file(reads_file, mate_files, block_records=1)
+        if record_counts[0] != record_counts[1]:
+            raise ValueError('Interleaved reads file {} holds an odd number of '
+                             'records'.format(reads_file))
+
+        return record_counts[0]
+
+    def _subsample_file(self, reads_file, sample_file, fraction, max_records):
+        """
+        _subsample_file: writes records selected by fraction, up to max_records of them, to
+                         sample_file, reading reads_file through to count all records
+
+        return (total records, sampled records)
+        """
+        input_process, input_stream = self._open_input(reads_file)
+        output_process, output_stream = self._open_output(sample_file)
+        record_count = 0
+        sampled_count = 0
+        selected = False
+
+        try:
+            line_count = 0
+            for line in input_stream:
+                if line_count % 4 == 0:
+                    # evenly spread selection, the same for every reads file of a library
+                    selected = (int((record_count + 1) * fraction) > int(record_count * fraction)
+                                and (max_records is None or sampled_count < max_records))
+                    record_count += 1
+                    if selected:
+                        sampled_count += 1
+                if selected:
+                    output_stream.write(line)
+                line_count += 1
+        finally:
+            self._close(output_process, output_stream, sample_file)
+            self._close(input_process, input_stream, reads_file)
+
+        return record_count, sampled_count
+
+    def subsample(self, reads_files, sample_dir, fraction=None, max_records=None):
+        """
+        subsample: writes a subsample of reads_files to sample_dir
+
+        fraction: fraction of records to keep, spread evenly over the files
+        max_records: keep at most this many records (pairs)
+
+        return (sample reads files, total records, sampled records)
+        """
+        log('start subsampling {} (fraction: {}, max records: {})'.format(
+                                                        reads_files, fraction, max_records))
+        mkdir_p(sample_dir)
+
+        sample_files = []
+        counts = None
+        for reads_file in reads_files:
+            sample_file = os.path.join(sample_dir, os.path.basename(reads_file))
+            file_counts = self._subsample_file(reads_file, sample_file, fraction or 1.0,
+                                               max_records)
+            if counts is not None and file_counts != counts:
+                raise ValueError('Paired reads files {} hold different numbers of '
+                                 'records'.format(reads_files))
+            counts = file_counts
+            sample_files.append(sample_file)
+
+        log('sampled {1} of {0} records'.format(*counts))
+
+        return sample_files, counts[0], counts[1]
@@ -0,0 +1,274 @@
+import errno
+import fcntl
+import os
+import stat
+import threading
+import zlib
+
+import requests
+
+from kb_tophat2.Utils.FastqStats import FastqStats
+from kb_tophat2.Utils.Helpers import log
+
+
+class ReadsStreamer:
+    """
+    ReadsStreamer: streams reads files from Shock into named pipes read by TopHat2
+
+    Every pipe is fed by a thread of the process that opened it. TopHat2 opens its reads
+    files more than once (it peeks at the format before prep_reads reads them through), so
+    a feeder starts the download over for every reader that opens the pipe, until the pipe
+    is closed. Gzipped files are passed through as they are and get a .gz pipe name, which
+    TopHat2 decompresses itself.
+
+    An interleaved file can be streamed into two pipes, one per mate. Each of them is fed
+    its own download of the file, decompressed and filtered to every other record, so
+    memory stays bounded however far the readers drift apart.
+
+    FASTQ statistics of a stream can be collected on the way: every download is scanned
+    while it is fed, and the statistics of the first one a reader takes in full are handed
+    to on_stats.
+
+    A download that fails or ends short of the file size ends the pipe like a complete
+    file would, so it is recorded, and check raises for it once the reader is done.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, token, poll_interval=0.1):
+        self.token = token
+        self.poll_interval = poll_interval
+        self.streams = {}
+        self._feeders = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # feeders stay with the process that opened the pipes, workers only read metadata
+        state = self.__dict__.copy()
+        state['_feeders'] = {}
+        state['_errors'] = {}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_pipe(file_path):
+        return stat.S_ISFIFO(os.stat(file_path).st_mode)
+
+    def describe(self, reads_files):
+        """
+        describe: stream metadata of those reads_files that are pipes of this streamer, to
+                  hand to other processes
+        """
+        with self._lock:
+            return dict((reads_file, self.streams[reads_file].copy())
+                        for reads_file in reads_files if reads_file in self.streams)
+
+    def check(self, pipe_paths):
+        """
+        check: raises RuntimeError if a reader of any of pipe_paths was fed an incomplete
+               file
+        """
+        with self._lock:
+            errors = [self._errors[pipe_path] for pipe_path in pipe_paths
+                      if pipe_path in self._errors]
+        if errors:
+            raise RuntimeError('Reads were not streamed in full, the alignment is '
+                               'incomplete:\n{}'.format('\n'.join(errors)))
+
+    def _record_error(self, pipe_path, message):
+        log(message)
+        with self._lock:
+            self._errors.setdefault(pipe_path, message)
+
+    @staticmethod
+    def _count_bytes(chunks, counter):
+        for chunk in chunks:
+            counter[0] += len(chunk)
+            yield chunk
+
+    def _open_download(self, shock_url, node_id):
+        response = requests.get('{}/node/{}?download_raw'.format(shock_url, node_id),
+                                headers={'Authorization': 'OAuth ' + self.token},
+                                stream=True)
+        if response.status_code != 200:
+            response.close()
+            raise RuntimeError('Unable to stream Shock node {}: {} {}'.format(
+                                                node_id, response.status_code, response.reason))
+        return response
+
+    def _is_gzipped(self, shock_url, node_id):
+        response = self._open_download(shock_url, node_id)
+        try:
+            return response.raw.read(2) == b'\x1f\x8b'
+        finally:
+            response.close()
+
+    def _wait_for_reader(self, pipe_path, stop_event):
+        """
+        _wait_for_reader: opens pipe_path for writing once a reader has opened it
+
+        return file descriptor, or None if the stream was closed first
+        """
+        while not stop_event.is_set():
+            try:
+                pipe_fd = os.open(pipe_path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as exc:
+                if exc.errno != errno.ENXIO:
+                    raise
+                # no reader yet
+                stop_event.wait(self.poll_interval)
+                continue
+            flags = fcntl.fcntl(pipe_fd, fcntl.F_GETFL)
+            fcntl.fcntl(pipe_fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+            return pipe_fd
+
+        return None
+
+    @staticmethod
+    def _select_mate(chunks, gzipped, mate):
+        """
+        _select_mate: filters chunks of an interleaved FASTQ file down to the records of
+                      mate (0 or 1), decompressing them first if gzipped
+
+        return generator of uncompressed chunks
+        """
+        decompressor = None
+        partial_line = b''
+        line_count = 0
+        for chunk in chunks:
+            if gzipped:
+                data = b''
+                while chunk:
+                    if decompressor is None:
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    data += decompressor.decompress(chunk)
+                    chunk = decompressor.unused_data
+                    if chunk:
+                        decompressor = None
+                chunk = data
+
+            lines = (partial_line + chunk).split(b'\n')
+            partial_line = lines.pop()
+            selected = []
+            for line in lines:
+                if (line_count // 4) % 2 == mate:
+                    selected.append(line + b'\n')
+                line_count += 1
+            if selected:
+                yield b''.join(selected)
+
+        if partial_line and (line_count // 4) % 2 == mate:
+            yield partial_line + b'\n'
+
+    def _feed(self, pipe_path, shock_url, node_id, size, stop_event, gzipped, mate,
+              on_stats):
+        readers = 0
+        while True:
+            try:
+                pipe_fd = self._wait_for_reader(pipe_path, stop_event)
+            except OSError as exc:
+                log('stopped feeding {}: {}'.format(pipe_path, exc))
+                return
+            if pipe_fd is None:
+                return
+            readers += 1
+
+            response = None
+            stats = FastqStats() if on_stats else None
+            downloaded = [0]
+            try:
+                response = self._open_download(shock_url, node_id)
+                # the size of a mate stream is an estimate, the download is the whole file
+                expected_size = int(response.headers.get('Content-Length') or 0) or (
+                                                                size if mate is None else None)
+                chunks = self._count_bytes(response.iter_content(self.CHUNK_SIZE),
+                                           downloaded)
+                if mate is not None:
+                    chunks = self._select_mate(chunks, gzipped, mate)
+                for chunk in chunks:
+                    if stop_event.is_set():
+                        stats = None
+                        break
+                    os.write(pipe_fd, chunk)
+                    if stats:
+                        stats.add_chunk(chunk, gzipped and mate is None)
+                else:
+                    if expected_size and downloaded[0] < expected_size:
+                        raise IOError('download of {} ended after {} of {} bytes'.format(
+                                                    node_id, downloaded[0], expected_size))
+                    log('streamed {} to reader {} of {}'.format(node_id, readers, pipe_path))
+                    if stats:
+                        stats.finish()
+                        on_stats(stats)
+                        on_stats = None
+            except (IOError, OSError) as exc:
+                # otherwise the reader only peeked at the head of the file
+                if exc.errno != errno.EPIPE:
+                    self._record_error(pipe_path, 'failed streaming {} into {}: {}'.format(
+                                                                    node_id, pipe_path, exc))
+            except Exception as exc:
+                self._record_error(pipe_path, 'failed streaming {} into {}: {}'.format(
+                                                                    node_id, pipe_path, exc))
+            finally:
+                if response is not None:
+                    response.close()
+                os.close(pipe_fd)
+
+    def open_stream(self, pipe_base_path, shock_url, node_id, size, mate=None, on_stats=None):
+        """
+        open_stream: creates a named pipe streaming Shock node node_id
+
+        pipe_base_path: pipe path without extension, .fastq or .fastq.gz is appended
+        size: size of the streamed part of the Shock file in bytes, as stored
+        mate: 0 or 1 to stream only that mate of an interleaved file, uncompressed
+        on_stats: called from the feeder thread with the FastqStats of the file, once it was
+                  streamed in full
+
+        return pipe path
+        """
+        gzipped = self._is_gzipped(shock_url, node_id)
+        pipe_path = pipe_base_path + ('.fastq.gz' if gzipped and mate is None else '.fastq')
+        os.mkfifo(pipe_path)
+
+        stop_event = threading.Event()
+        feeder = threading.Thread(target=self._feed,
+                                  args=(pipe_path, shock_url, node_id, size, stop_event,
+                                        gzipped, mate, on_stats))
+        feeder.daemon = True
+
+        with self._lock:
+            self.streams[pipe_path] = {'size': size, 'gzipped': gzipped}
+            self._feeders[pipe_path] = (feeder, stop_event)
+        feeder.start()
+
+        log('streaming Shock node {} into {}'.format(node_id, pipe_path))
+
+        return pipe_path
+
+    def close(self, pipe_paths=None):
+        """
+        close: stops feeding and removes the given pipes, or every pipe of this streamer
+        """
+        with self._lock:
+            if pipe_paths is None:
+                pipe_paths = list(self._feeders.keys())
+            feeders = [(pipe_path, self._feeders.pop(pipe_path, None))
+                       for pipe_path in pipe_paths]
+
+        for pipe_path, feeder in feeders:
+            if feeder is None:
+                continue
+            thread, stop_event = feeder
+            stop_event.set()
+            if os.path.exists(pipe_path):
+                os.remove(pipe_path)
+            # a feeder blocked writing to a reader that went away gets EPIPE on its own
+            thread.join(self.poll_interval * 10)
+            with self._lock:
+                self.streams.pop(pipe_path, None)
+                self._errors.pop(pipe_path, None)
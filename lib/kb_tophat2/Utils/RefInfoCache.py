@@ -0,0 +1,68 @@
+import json
+import os
+import re
+
+from kb_tophat2.Utils.Helpers import log, mkdir_p
+
+
+class RefInfoCache:
+    """
+    RefInfoCache: persistent store of object metadata keyed by versioned object reference
+
+    A record holds what alignment needs to know about an object before touching its data.
+    For an Assembly, ContigSet or Genome: object type and name, the ref path to its assembly,
+    total sequence length, contig count and index cache key. For a reads library: its FASTQ
+    statistics. Versioned workspace objects never change, so records are kept forever. The
+    cache does not check access, callers confirm that the user can read an object before
+    using its record.
+    """
+
+    VERSIONED_REF_PATTERN = re.compile(r'^\d+/\d+/\d+$')
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._records = {}
+
+        mkdir_p(cache_dir)
+
+    @classmethod
+    def is_versioned_ref(cls, ref):
+        return bool(cls.VERSIONED_REF_PATTERN.match(ref))
+
+    def _record_path(self, versioned_ref):
+        return os.path.join(self.cache_dir, versioned_ref.replace('/', '_') + '.json')
+
+    def get(self, versioned_ref):
+        """
+        get: return the record for versioned_ref, or None if it is not cached
+        """
+        if versioned_ref in self._records:
+            return self._records[versioned_ref]
+
+        try:
+            with open(self._record_path(versioned_ref)) as record_file:
+                record = json.load(record_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        self._records[versioned_ref] = record
+
+        return record
+
+    def put(self, versioned_ref, record):
+        """
+        put: store record for versioned_ref
+        """
+        if not self.is_versioned_ref(versioned_ref):
+            raise ValueError('Only versioned refs can be cached: {}'.format(versioned_ref))
+
+        # written aside and renamed so concurrent jobs never read a partial record
+        record_path = self._record_path(versioned_ref)
+        tmp_record_path = '{}.{}.tmp'.format(record_path, os.getpid())
+        with open(tmp_record_path, 'w') as record_file:
+            json.dump(record, record_file, indent=1)
+        os.rename(tmp_record_path, record_path)
+
+        self._records[versioned_ref] = record
+
+        log('cached info for {} in {}'.format(versioned_ref, self.cache_dir))
@@ -0,0 +1,159 @@
+import threading
+
+from kb_tophat2.Utils.Helpers import log
+
+
+class ResourcePlanner:
+    """
+    ResourcePlanner: admission control of concurrent reads libraries against scratch disk
+                     and memory budgets, and allocation of a core budget to their TopHat2
+                     runs
+
+    Every library reserves its projected scratch footprint (reads plus TopHat2 outputs and
+    temp files) before its reads are fetched, and is only admitted while all reservations
+    fit the budget. Once aligned, a reservation is settled to the size of what the library
+    keeps on scratch. A library that does not fit is still admitted once no other library is
+    in flight, so work always progresses.
+
+    When a library starts aligning it gets a share of the free cores weighted by its size
+    against the libraries expected to start alongside it, keeping a core for each of them.
+    A TopHat2 run keeps its threads until it ends, so the split is rebalanced at every start:
+    cores freed by finished libraries go to the next ones, and the last libraries get all
+    that is left.
+
+    Before that, a library reserves the projected peak memory of its run and waits while
+    that does not fit the memory budget next to the runs already going, unless none is.
+    """
+
+    def __init__(self, disk_budget, core_budget=1, max_concurrent=1, memory_budget=None):
+        self.disk_budget = disk_budget
+        self.core_budget = max(1, core_budget)
+        self.max_concurrent = max(1, max_concurrent)
+        self.memory_budget = memory_budget
+        self._active = {}
+        self._settled = {}
+        self._weights = {}
+        self._cores = {}
+        self._memory = {}
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def _format_size(size):
+        return '{:.2f} GB'.format(float(size) / 1024 ** 3)
+
+    def plan(self, libraries):
+        """
+        plan: registers the libraries to run and logs projected scratch footprints against the
+              budget
+
+        libraries: list of (key, library name, projected disk bytes, weight for cores)
+        """
+        with self._condition:
+            for key, _, _, weight in libraries:
+                self._weights[key] = weight
+
+        plan = 'resource plan, scratch budget {}, {} cores for up to {} libraries at once'.format(
+                        self._format_size(self.disk_budget), self.core_budget, self.max_concurrent)
+        if self.memory_budget is not None:
+            plan += ', memory budget {}'.format(self._format_size(self.memory_budget))
+        plan += ':'
+        for _, name, disk_bytes, _ in libraries:
+            plan += '\n  {}: {}'.format(name, self._format_size(disk_bytes))
+            if disk_bytes > self.disk_budget:
+                plan += ' (exceeds budget, runs alone)'
+        plan += '\n  total: {}'.format(self._format_size(sum(library[2] for library in
+                                                             libraries)))
+        log(plan)
+
+    def _reserved_disk(self):
+        return sum(self._active.values()) + sum(self._settled.values())
+
+    def reserved_disk(self):
+        with self._condition:
+            return self._reserved_disk()
+
+    def try_admit(self, key, disk_bytes):
+        """
+        try_admit: reserves disk_bytes for key if they fit the budget
+
+        return whether key was admitted
+        """
+        with self._condition:
+            reserved = self._reserved_disk()
+            if self._active and reserved + disk_bytes > self.disk_budget:
+                return False
+            self._active[key] = disk_bytes
+
+        log('admitted {} with {}, {} of {} reserved'.format(
+                        key, self._format_size(disk_bytes),
+                        self._format_size(reserved + disk_bytes),
+                        self._format_size(self.disk_budget)))
+        return True
+
+    def settle(self, key, disk_bytes):
+        """
+        settle: replaces the reservation of key by the disk_bytes it keeps
+        """
+        with self._condition:
+            if key in self._active:
+                del self._active[key]
+                self._settled[key] = disk_bytes
+
+    def release(self, key):
+        with self._condition:
+            self._active.pop(key, None)
+            self._settled.pop(key, None)
+            self._weights.pop(key, None)
+
+    def acquire_memory(self, key, memory_bytes):
+        """
+        acquire_memory: waits until memory_bytes fit the memory budget and reserves them
+        """
+        with self._condition:
+            waiting = False
+            while (self.memory_budget is not None and self._memory and
+                   sum(self._memory.values()) + memory_bytes > self.memory_budget):
+                if not waiting:
+                    log('holding back {} until {} of memory is free'.format(
+                                                        key, self._format_size(memory_bytes)))
+                    waiting = True
+                self._condition.wait()
+            self._memory[key] = memory_bytes
+
+        log('reserved {} of memory for {}'.format(self._format_size(memory_bytes), key))
+
+    def release_memory(self, key):
+        with self._condition:
+            self._memory.pop(key, None)
+            self._condition.notify_all()
+
+    def acquire_cores(self, key):
+        """
+        acquire_cores: waits for a free core and allocates key its share of the free cores
+
+        return number of threads for key
+        """
+        with self._condition:
+            while self.core_budget - sum(self._cores.values()) < 1:
+                self._condition.wait()
+
+            free = self.core_budget - sum(self._cores.values())
+            weight = self._weights.pop(key, 0) or 1
+            # the largest waiting libraries stand in for those starting alongside this one
+            starting = max(0, self.max_concurrent - len(self._cores) - 1)
+            others = sorted([other or 1 for other in self._weights.values()],
+                            reverse=True)[:starting]
+            threads = free
+            if others:
+                threads = int(free * weight / float(weight + sum(others)))
+                threads = max(1, min(threads, free - len(others)))
+            self._cores[key] = threads
+
+        log('allocated {} of {} free cores to {}'.format(threads, free, key))
+
+        return threads
+
+    def release_cores(self, key):
+        with self._condition:
+            self._cores.pop(key, None)
+            self._condition.notify_all()
@@ -0,0 +1,230 @@
+import os
+import re
+
+from kb_tophat2.Utils.CommandRunner import CommandRunner
+from kb_tophat2.Utils.Helpers import log, mkdir_p
+
+
+class ResultMerger:
+    """
+    ResultMerger: merges the output directories of TopHat2 runs on shards of one library
+
+    accepted_hits.bam files are merged keeping their coordinate order and unmapped.bam files
+    are concatenated. Junctions found in several shards are combined into one BED record
+    whose score (the number of spanning reads) is the sum over shards and whose overhangs
+    are the widest seen; insertions and deletions are combined the same way. The read and
+    pair counts of the align_summary.txt files are summed into one summary in TopHat2's own
+    format.
+    """
+
+    INDEL_FILES = ['insertions.bed', 'deletions.bed']
+
+    def __init__(self, samtools='samtools'):
+        self.samtools = samtools
+
+    @staticmethod
+    def _existing(shard_dirs, file_name):
+        return [os.path.join(shard_dir, file_name) for shard_dir in shard_dirs
+                if os.path.isfile(os.path.join(shard_dir, file_name))]
+
+    @staticmethod
+    def _read_bed(bed_file):
+        """
+        _read_bed: return (track line, records split into columns) of bed_file
+        """
+        track = None
+        records = []
+        with open(bed_file) as bed:
+            for line in bed:
+                line = line.rstrip('\n')
+                if not line:
+                    continue
+                if line.startswith('track'):
+                    track = line
+                    continue
+                records.append(line.split('\t'))
+
+        return track, records
+
+    @staticmethod
+    def _write_bed(bed_file, track, records):
+        with open(bed_file, 'w') as bed:
+            if track:
+                bed.write(track + '\n')
+            for record in records:
+                bed.write('\t'.join(str(column) for column in record) + '\n')
+
+    def _merge_bam(self, shard_dirs, merged_dir, file_name, sorted_by_coordinate):
+        bam_files = self._existing(shard_dirs, file_name)
+        if not bam_files:
+            return
+        merged_file = os.path.join(merged_dir, file_name)
+        if sorted_by_coordinate:
+            command = [self.samtools, 'merge', '-f', merged_file] + bam_files
+        else:
+            command = [self.samtools, 'cat', '-o', merged_file] + bam_files
+        log('merging {} of {} shards'.format(file_name, len(bam_files)))
+        CommandRunner().run(command)
+
+    def _merge_junctions(self, shard_dirs, merged_dir):
+        """
+        _merge_junctions: combines junctions.bed records sharing chromosome, intron and strand
+        """
+        junctions = {}
+        track = None
+        for bed_file in self._existing(shard_dirs, 'junctions.bed'):
+            file_track, records = self._read_bed(bed_file)
+            track = track or file_track
+            for record in records:
+                chrom, left, right, strand = record[0], int(record[1]), int(record[2]), record[5]
+                left_size, right_size = [int(size) for size in record[10].rstrip(',').split(',')]
+                intron = (chrom, left + left_size, right - right_size, strand)
+                score = int(record[4])
+                if intron in junctions:
+                    merged_left, merged_right, merged_score = junctions[intron]
+                    junctions[intron] = (min(left, merged_left), max(right, merged_right),
+                                         merged_score + score)
+                else:
+                    junctions[intron] = (left, right, score)
+
+        merged_records = []
+        for (chrom, donor, acceptor, strand), (left, right, score) in sorted(
+                                            junctions.items(),
+                                            key=lambda item: (item[0][0], item[1][0], item[0])):
+            merged_records.append([chrom, left, right, None, score, strand, left, right,
+                                   '255,0,0', 2,
+                                   '{},{}'.format(donor - left, right - acceptor),
+                                   '0,{}'.format(acceptor - left)])
+        for number, record in enumerate(merged_records, 1):
+            record[3] = 'JUNC{:08d}'.format(number)
+
+        self._write_bed(os.path.join(merged_dir, 'junctions.bed'), track, merged_records)
+        log('merged {} junctions'.format(len(merged_records)))
+
+    def _merge_indels(self, shard_dirs, merged_dir, file_name):
+        """
+        _merge_indels: combines insertion or deletion records of the same position and
+                       sequence, summing their read counts
+        """
+        indels = {}
+        track = None
+        for bed_file in self._existing(shard_dirs, file_name):
+            file_track, records = self._read_bed(bed_file)
+            track = track or file_track
+            for record in records:
+                key = (record[0], int(record[1]), int(record[2])) + tuple(record[3:4])
+                score = int(record[4]) if len(record) > 4 else 0
+                indels[key] = indels.get(key, 0) + score
+
+        merged_records = [list(key) + [score] for key, score in sorted(indels.items())]
+        self._write_bed(os.path.join(merged_dir, file_name), track, merged_records)
+
+    @staticmethod
+    def _read_summary(summary_file):
+        """
+        _read_summary: return (counts of each reads section in order, multiread limit, pair
+                       counts or None) of a TopHat2 align_summary.txt
+        """
+        sections = []
+        limit = None
+        pairs = None
+        with open(summary_file) as summary:
+            for line in summary:
+                line = line.strip()
+                section = re.match(r'^(Left reads|Right reads|Reads):$', line)
+                if section:
+                    sections.append((section.group(1), {'input': 0, 'mapped': 0,
+                                                        'multiple': 0, 'excess': 0}))
+                    continue
+                match = re.match(r'^Aligned pairs:\s*(\d+)$', line)
+                if match:
+                    pairs = {'aligned': int(match.group(1)), 'multiple': 0, 'discordant': 0}
+                    continue
+
+                if pairs is not None:
+                    match = re.match(r'^of these:\s*(\d+)', line)
+                    if match:
+                        pairs['multiple'] = int(match.group(1))
+                    match = re.search(r'(\d+) \(\s*[\d.]+%\) are discordant alignments$', line)
+                    if match:
+                        pairs['discordant'] = int(match.group(1))
+                elif sections:
+                    counts = sections[-1][1]
+                    match = re.match(r'^(Input|Mapped)\s*:\s*(\d+)', line)
+                    if match:
+                        counts[match.group(1).lower()] = int(match.group(2))
+                    match = re.match(r'^of these:\s*(\d+) .*\((\d+) have >(\d+)\)$', line)
+                    if match:
+                        counts['multiple'] = int(match.group(1))
+                        counts['excess'] = int(match.group(2))
+                        limit = int(match.group(3))
+
+        return sections, limit, pairs
+
+    @staticmethod
+    def _percent(count, total):
+        return 100.0 * count / total if total else 0.0
+
+    def _merge_summaries(self, shard_dirs, merged_dir):
+        """
+        _merge_summaries: sums the counts of align_summary.txt files, the shards of a
+                          library have the same reads sections
+        """
+        sections = []
+        limit = None
+        pairs = None
+        for summary_file in self._existing(shard_dirs, 'align_summary.txt'):
+            shard_sections, shard_limit, shard_pairs = self._read_summary(summary_file)
+            limit = limit or shard_limit
+            if not sections:
+                sections = [(name, dict.fromkeys(counts, 0)) for name, counts in shard_sections]
+            for (_, counts), (_, shard_counts) in zip(sections, shard_sections):
+                for key in counts:
+                    counts[key] += shard_counts[key]
+            if shard_pairs is not None:
+                pairs = pairs or dict.fromkeys(shard_pairs, 0)
+                for key in pairs:
+                    pairs[key] += shard_pairs[key]
+
+        summary = ''
+        for name, counts in sections:
+            summary += '{}:\n'.format(name)
+            summary += '          Input     : {:9d}\n'.format(counts['input'])
+            summary += '           Mapped   : {:9d} ({:4.1f}% of input)\n'.format(
+                                    counts['mapped'], self._percent(counts['mapped'],
+                                                                    counts['input']))
+            summary += ('            of these: {:9d} ({:4.1f}%) have multiple alignments '
+                        '({} have >{})\n').format(counts['multiple'],
+                                                  self._percent(counts['multiple'],
+                                                                counts['mapped']),
+                                                  counts['excess'], limit or 20)
+        summary += '{:4.1f}% overall read mapping rate.\n'.format(self._percent(
+                                        sum(counts['mapped'] for _, counts in sections),
+                                        sum(counts['input'] for _, counts in sections)))
+        if pairs is not None:
+            left_input = sections[0][1]['input'] if sections else 0
+            summary += '\nAligned pairs: {:9d}\n'.format(pairs['aligned'])
+            summary += '     of these: {:9d} ({:4.1f}%) have multiple alignments\n'.format(
+                                    pairs['multiple'], self._percent(pairs['multiple'],
+                                                                     pairs['aligned']))
+            summary += '          and: {:9d} ({:4.1f}%) are discordant alignments\n'.format(
+                                    pairs['discordant'], self._percent(pairs['discordant'],
+                                                                       pairs['aligned']))
+            summary += '{:4.1f}% concordant pair alignment rate.\n'.format(self._percent(
+                                    pairs['aligned'] - pairs['discordant'], left_input))
+
+        with open(os.path.join(merged_dir, 'align_summary.txt'), 'w') as summary_file:
+            summary_file.write(summary)
+
+    def merge(self, shard_dirs, merged_dir):
+        """
+        merge: merges TopHat2 output directories shard_dirs into merged_dir
+        """
+        mkdir_p(merged_dir)
+
+        self._merge_bam(shard_dirs, merged_dir, 'accepted_hits.bam', True)
+        self._merge_bam(shard_dirs, merged_dir, 'unmapped.bam', False)
+        self._merge_junctions(shard_dirs, merged_dir)
+        for file_name in self.INDEL_FILES:
+            self._merge_indels(shard_dirs, merged_dir, file_name)
+        self._merge_summaries(shard_dirs, merged_dir)
@@ -0,0 +1,104 @@
+import copy
+import json
+import os
+import time
+
+from kb_tophat2.Utils.FileLock import FileLock
+from kb_tophat2.Utils.Helpers import log
+
+
+class RunJournal:
+    """
+    RunJournal: state journal of a run_tophat2_app run, kept in its result directory
+
+    Records the params of the run and, for each reads library, the last stage it reached
+    with what that stage produced: downloaded (reads files), aligning (TopHat2 output
+    directory of a run in progress), aligned (TopHat2 result directory), merged (BAM file
+    merged from mapped and unmapped reads) and uploaded (Alignment object ref). A run
+    resumed from the journal picks up every library where it stopped.
+
+    Task workers record into the same journal, so every update is a locked read, modify
+    and atomic rewrite of the file.
+    """
+
+    JOURNAL_FILE = 'run_journal.json'
+
+    STAGES = ['downloaded', 'aligning', 'aligned', 'merged', 'uploaded']
+
+    # params that do not change what a run produces, free to differ when resuming
+    RESUMABLE_PARAMS = ['resume_from', 'num_threads', 'force']
+
+    def __init__(self, result_directory):
+        self.journal_file = os.path.join(result_directory, self.JOURNAL_FILE)
+
+    def exists(self):
+        return os.path.isfile(self.journal_file)
+
+    def _load(self):
+        try:
+            with open(self.journal_file) as journal_file:
+                return json.load(journal_file)
+        except (IOError, OSError, ValueError):
+            return {'params': None, 'libraries': {}}
+
+    def _write(self, journal):
+        tmp_journal_file = '{}.{}.tmp'.format(self.journal_file, os.getpid())
+        with open(tmp_journal_file, 'w') as journal_file:
+            json.dump(journal, journal_file, indent=1)
+        os.rename(tmp_journal_file, self.journal_file)
+
+    def start(self, params):
+        """
+        start: records the params of a new run, or checks that a resumed run has the same
+               params
+        """
+        run_params = dict((key, value) for key, value in params.items()
+                          if key not in self.RESUMABLE_PARAMS)
+
+        with FileLock(self.journal_file + '.lock'):
+            journal = self._load()
+            if journal['params'] is None:
+                journal['params'] = run_params
+                self._write(journal)
+                return
+
+            changed = sorted(key for key in set(journal['params']) | set(run_params)
+                             if journal['params'].get(key) != run_params.get(key))
+            if changed:
+                raise ValueError('Can not resume a run with different params: {}'.format(
+                                                                        ', '.join(changed)))
+
+        log('resuming run with {} journaled reads libraries'.format(len(journal['libraries'])))
+
+    def get(self, key):
+        """
+        get: return the journal record of reads library key, empty if it has none
+        """
+        return copy.deepcopy(self._load()['libraries'].get(key, {}))
+
+    def reached(self, key, stage):
+        """
+        reached: whether reads library key got as far as stage
+        """
+        record_stage = self.get(key).get('stage')
+        if record_stage is None:
+            return False
+
+        return self.STAGES.index(record_stage) >= self.STAGES.index(stage)
+
+    def record(self, key, stage, **fields):
+        """
+        record: moves reads library key to stage, adding fields to its record
+        """
+        if stage not in self.STAGES:
+            raise ValueError('Unknown run stage: {}'.format(stage))
+
+        with FileLock(self.journal_file + '.lock'):
+            journal = self._load()
+            library = journal['libraries'].setdefault(key, {})
+            library.update(fields)
+            library['stage'] = stage
+            library['time'] = time.time()
+            self._write(journal)
+
+        log('journaled {} as {}'.format(key, stage))
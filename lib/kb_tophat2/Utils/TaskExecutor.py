@@ -0,0 +1,181 @@
+import multiprocessing
+import os
+import signal
+import threading
+import traceback
+
+from kb_tophat2.Utils.Helpers import log
+
+
+class TaskError(Exception):
+    """
+    TaskError: a task failed in a worker, carrying the type, message and traceback of the
+               original exception
+    """
+
+    def __init__(self, task, error_type, message, traceback_text):
+        super(TaskError, self).__init__(task, error_type, message, traceback_text)
+        self.task = task
+        self.error_type = error_type
+        self.message = message
+        self.traceback_text = traceback_text
+
+    def __str__(self):
+        return '{} failed with {}: {}\n{}'.format(self.task, self.error_type, self.message,
+                                                  self.traceback_text)
+
+
+class TaskCancelledError(TaskError):
+    """
+    TaskCancelledError: a task was cancelled before it finished
+    """
+
+    def __init__(self, task):
+        super(TaskCancelledError, self).__init__(task, 'TaskCancelledError', 'cancelled', '')
+
+
+# state of the worker process, set up by _init_worker
+_worker = {}
+
+
+def _init_worker(factory, config):
+    # a process group per worker, so cancelling it also stops the commands it runs
+    os.setpgrp()
+    _worker['factory'] = factory
+    _worker['config'] = config
+
+
+def _run_task(method_name, args, kwargs):
+    """
+    _run_task: calls method_name on the worker instance, built on its first task
+
+    return (True, result) or (False, TaskError), so failures reach the parent's callback
+    """
+    try:
+        if 'instance' not in _worker:
+            _worker['instance'] = _worker['factory'](_worker['config'])
+        return True, getattr(_worker['instance'], method_name)(*args, **kwargs)
+    except Exception as exc:
+        # the original exception may not survive pickling, its description always does
+        return False, TaskError(method_name, type(exc).__name__, str(exc),
+                                traceback.format_exc())
+
+
+class TaskFuture:
+    """
+    TaskFuture: pending result of a task submitted to a TaskExecutor
+    """
+
+    def __init__(self, executor, task, async_result):
+        self._executor = executor
+        self._task = task
+        self._async_result = async_result
+
+    def ready(self):
+        return self._async_result.ready()
+
+    def get(self):
+        """
+        get: waits for the task
+
+        return result of the task, raising TaskError if it failed or TaskCancelledError if
+        the executor was cancelled first
+        """
+        while not self._async_result.ready():
+            if self._executor.cancelled:
+                raise TaskCancelledError(self._task)
+            self._async_result.wait(self._executor.poll_interval)
+
+        succeeded, result = self._async_result.get()
+        if not succeeded:
+            raise result
+
+        return result
+
+
+class TaskExecutor:
+    """
+    TaskExecutor: runs methods of a utility object in a bounded pool of worker processes
+
+    Workers only receive small task descriptors (method name and arguments). Each worker
+    builds its own utility instance with factory(config) on its first task, so the parent's
+    clients and state are never pickled. Failures come back as TaskError, and cancelling
+    the executor stops every worker together with the commands it runs.
+    """
+
+    def __init__(self, factory, config, max_workers, poll_interval=1):
+        self.max_workers = max(1, min(max_workers, multiprocessing.cpu_count()))
+        self.poll_interval = poll_interval
+        self.cancelled = False
+        self._failed = threading.Event()
+        self._pool = multiprocessing.Pool(self.max_workers, initializer=_init_worker,
+                                          initargs=(factory, config))
+
+        log('started {} task workers'.format(self.max_workers))
+
+    def _on_result(self, result):
+        if not result[0]:
+            self._failed.set()
+
+    def submit(self, method_name, *args, **kwargs):
+        """
+        submit: queues a call of method_name with args and kwargs on a worker
+
+        return TaskFuture
+        """
+        async_result = self._pool.apply_async(_run_task, (method_name, args, kwargs),
+                                              callback=self._on_result)
+
+        return TaskFuture(self, method_name, async_result)
+
+    def map(self, method_name, args_list):
+        """
+        map: calls method_name with each argument tuple of args_list, cancelling the remaining
+             calls as soon as one fails
+
+        return results in the order of args_list
+        """
+        futures = [self.submit(method_name, *args) for args in args_list]
+
+        while not all(future.ready() for future in futures):
+            if self._failed.wait(self.poll_interval):
+                break
+
+        if self._failed.is_set():
+            for future in futures:
+                if future.ready():
+                    try:
+                        future.get()
+                    except TaskError:
+                        self.cancel()
+                        raise
+
+        return [future.get() for future in futures]
+
+    def cancel(self):
+        """
+        cancel: stops all workers and the commands they run, pending tasks fail with
+                TaskCancelledError
+        """
+        if self.cancelled:
+            return
+        self.cancelled = True
+
+        log('cancelling task workers')
+        worker_pids = [worker.pid for worker in self._pool._pool]
+        self._pool.terminate()
+        # a process group outlives its leader, so the commands workers started are reached
+        for worker_pid in worker_pids:
+            try:
+                os.killpg(worker_pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        close: waits for queued tasks and stops the workers
+        """
+        if self.cancelled:
+            return
+        self._pool.close()
+        self._pool.join()
@@ -1,18 +1,17 @@
-import errno
 import json
 import multiprocessing
 import os
 import re
+import shutil
 import subprocess
-import sys
 import time
 import traceback
 import uuid
 import zipfile
 
-from pathos.multiprocessing import ProcessingPool as Pool
-
+from AssemblyUtil.AssemblyUtilClient import AssemblyUtil
 from DataFileUtil.DataFileUtilClient import DataFileUtil
+from GenomeFileUtil.GenomeFileUtilClient import GenomeFileUtil
 from KBaseReport.KBaseReportClient import KBaseReport
 from ReadsAlignmentUtils.ReadsAlignmentUtilsClient import ReadsAlignmentUtils
 from ReadsUtils.ReadsUtilsClient import ReadsUtils
@@ -20,17 +19,32 @@ from SetAPI.SetAPIServiceClient import SetAPI
 from Workspace.WorkspaceClient import Workspace as Workspace
 from kb_Bowtie2.kb_Bowtie2Client import kb_Bowtie2
 from kb_QualiMap.kb_QualiMapClient import kb_QualiMap
-
-
-def log(message, prefix_newline=False):
-    """Logging function, provides a hook to suppress or redirect log messages."""
-    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))  
+from kb_tophat2.Utils.AlignmentCache import AlignmentCache
+from kb_tophat2.Utils.AlignmentProgress import (AlignmentProgress, SetProgressReporter,
+                                                StageHistory)
+from kb_tophat2.Utils.CommandRunner import CommandRunner
+from kb_tophat2.Utils.FastqStats import FastqStats
+from kb_tophat2.Utils.FastStorage import FastStorage
+from kb_tophat2.Utils.Helpers import log, mkdir_p
+from kb_tophat2.Utils.IndexCache import IndexCache
+from kb_tophat2.Utils.IndexCatalog import IndexCatalog
+from kb_tophat2.Utils.MemoryProfile import MemoryProfile, PeakMemoryMonitor
+from kb_tophat2.Utils.ReadsPipeline import PipelineError, ReadsPipeline
+from kb_tophat2.Utils.ReadsSharder import ReadsSharder
+from kb_tophat2.Utils.ReadsStreamer import ReadsStreamer
+from kb_tophat2.Utils.ResultMerger import ResultMerger
+from kb_tophat2.Utils.RefInfoCache import RefInfoCache
+from kb_tophat2.Utils.ResourcePlanner import ResourcePlanner
+from kb_tophat2.Utils.RunJournal import RunJournal
+from kb_tophat2.Utils.TaskExecutor import TaskExecutor
 
 
 class TopHatUtil:
 
     TOPHAT2_TOOLKIT_PATH = '/kb/deployment/bin/TopHat2'
 
+    TOPHAT2_VERSION = '2.1.1'
+
     OPTIONS_MAP = {'read_mismatches': '--read-mismatches',
                    'read_gap_length': '--read-gap-length',
                    'read_edit_dist': '--read-edit-dist',
@@ -40,25 +54,47 @@ class TopHatUtil:
                    'report_secondary_alignments': '--report-secondary-alignments',
                    'no_coverage_search': '--no-coverage-search',
                    'library_type': '--library-type',
-                   'num_threads': '--num-threads'
+                   'num_threads': '--num-threads',
+                   'segment_length': '--segment-length',
+                   'phred64_quals': '--phred64-quals',
+                   'solexa_quals': '--solexa-quals'
                    }
 
-    BOOLEAN_OPTIONS = ['report_secondary_alignments', 'no_coverage_search']
+    BOOLEAN_OPTIONS = ['report_secondary_alignments', 'no_coverage_search',
+                       'phred64_quals', 'solexa_quals']
 
-    @staticmethod
-    def _mkdir_p(path):
-        """
-        _mkdir_p: make directory for given path
-        """
-        if not path:
-            return
-        try:
-            os.makedirs(path)
-        except OSError as exc:
-            if exc.errno == errno.EEXIST and os.path.isdir(path):
-                pass
-            else:
-                raise
+    # TopHat2 quality options for quality encodings other than its Phred+33 default
+    QUALITY_ENCODING_OPTIONS = {'phred64': 'phred64_quals',
+                                'solexa64': 'solexa_quals'}
+
+    # rough private memory of one tophat run, besides the Bowtie2 index it maps, until
+    # calibrated by measured runs
+    TOPHAT2_WORKER_MEMORY = 1024 ** 3
+
+    # rough peak disk usage of one tophat run (outputs and temp files) per byte of reads
+    TOPHAT2_DISK_EXPANSION = 4
+
+    # typical size ratio of uncompressed to gzipped FASTQ
+    GZIP_COMPRESSION_RATIO = 4
+
+    # rough bytes of a FASTQ record besides sequence and qualities (header, separator and
+    # line breaks)
+    FASTQ_RECORD_OVERHEAD = 50
+
+    # threads per tophat run when a library is aligned in shards, TopHat2 scales poorly
+    # beyond a few threads
+    TOPHAT2_SHARD_THREADS = 2
+
+    # TopHat2 default segment length, reads shorter than two segments are not split to
+    # search for junctions
+    TOPHAT2_SEGMENT_LENGTH = 25
+    TOPHAT2_MIN_SEGMENT_LENGTH = 12
+
+    # rough alignment throughput of one tophat thread, in read bases per second
+    TOPHAT2_BASES_PER_THREAD_SECOND = 50000
+
+    # TopHat2 stages that take about as long for a preview as for the whole library
+    TOPHAT2_FIXED_STAGES = ['checking']
 
     @staticmethod
     def _validate_run_tophat2_app_params(params):
@@ -75,34 +111,86 @@ class TopHatUtil:
             if p not in params:
                 raise ValueError('"{}" parameter is required, but missing'.format(p))
 
+        preview_fraction = params.get('preview_fraction')
+        if preview_fraction is not None and not 0 < float(preview_fraction) <= 1:
+            raise ValueError('"preview_fraction" must be greater than 0 and at most 1, '
+                             'was: {}'.format(preview_fraction))
+
+        preview_reads = params.get('preview_reads')
+        if preview_reads is not None and int(preview_reads) < 1:
+            raise ValueError('"preview_reads" must be positive, was: {}'.format(preview_reads))
+
+        if params.get('resume_from') and (preview_fraction or preview_reads):
+            raise ValueError('"resume_from" can not be used in preview mode')
+
     @staticmethod
-    def _run_command(command):
+    def _validate_prefetch_reference_params(params):
         """
-        _run_command: run command and print result
+        _validate_prefetch_reference_params:
+                validates params passed to prefetch_reference method
         """
 
-        log('start executing command:\n{}'.format(command))
+        log('start validating prefetch_reference params')
 
-        pipe = subprocess.Popen(command, stdout=subprocess.PIPE, shell=True)
-        output = pipe.communicate()[0]
-        exitCode = pipe.returncode
+        if not params.get('refs'):
+            raise ValueError('"refs" parameter is required, but missing')
 
-        if (exitCode == 0):
-            log('Executed commend:\n{}\n'.format(command) +
-                'Exit Code: {}\nOutput:\n{}'.format(exitCode, output))
-        else:
-            error_msg = 'Error running commend:\n{}\n'.format(command)
-            error_msg += 'Exit Code: {}\nOutput:\n{}'.format(exitCode, output)
-            raise ValueError(error_msg)
+    @staticmethod
+    def _run_command(command, memory_monitor=None, log_prefix=None, on_line=None):
+        """
+        _run_command: run command (argument list) and stream its output to the job log
 
-    def _get_bowtie_index(self, result_directory, assembly_or_genome_ref, workspace_name):
+        memory_monitor: PeakMemoryMonitor to sample the command's processes with
+        log_prefix: prefix of the logged output lines, the command name by default
+        on_line: called with every output line
+        """
+        CommandRunner(log_prefix).run(command, memory_monitor=memory_monitor, on_line=on_line)
+
+    @classmethod
+    def _get_bowtie2_version(cls):
         """
-        _get_bowtie_index: gets genome index file using kb_Bowtie2
+        _get_bowtie2_version: gets version of the bundled bowtie2 aligner
+        """
+        try:
+            output = subprocess.check_output([cls.TOPHAT2_TOOLKIT_PATH + '/bowtie2-align-s',
+                                              '--version'])
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+        match = re.search(r'version (\S+)', output.decode())
+
+        return match.group(1) if match else None
+
+    def _get_index_key(self, assembly_or_genome_ref):
+        """
+        _get_index_key: builds index cache key from the versioned object reference
+        """
+
+        return self._get_reference_info(assembly_or_genome_ref)['index_key']
+
+    def _get_cached_index(self, index_key, output_dir, fetch_index):
+        """
+        _get_cached_index: gets index directory from the node-local index cache, calling
+                           fetch_index to generate it in output_dir on a cache miss
+
+        The entry stays pinned until index_cache.release is called.
+        """
+
+        cached_index_dir = self.index_cache.get_index(index_key, fetch_index,
+                                                      staging_dir=output_dir, pin=True)
+
+        # hand out the read-only cached copy through a link in the result directory
+        os.symlink(cached_index_dir, output_dir)
+
+        return output_dir
+
+    def _fetch_bowtie_index(self, output_dir, assembly_or_genome_ref, workspace_name):
+        """
+        _fetch_bowtie_index: generates genome index files using kb_Bowtie2
         """
 
         log('start generating genome index file using kb_Bowtie2')
 
-        output_dir = os.path.join(result_directory, 'bowtie2_index_' + str(int(time.time() * 100)))
         get_bowtie_index_params = {'ref': assembly_or_genome_ref,
                                    'output_dir': output_dir,
                                    'ws_for_cache': workspace_name}
@@ -111,6 +199,199 @@ class TopHatUtil:
 
         return genome_index_file_dir
 
+    def _fetch_reference_info(self, info):
+        """
+        _fetch_reference_info: gets assembly ref path, total sequence length and contig count
+                               of an Assembly, ContigSet or Genome from the Workspace
+
+        dna_size and contig_count are None when neither the object nor its assembly record
+        them
+        """
+
+        versioned_ref = '{}/{}/{}'.format(info[6], info[0], info[4])
+        obj_type = self._get_type_from_obj_info(info)
+        included = ['/dna_size', '/num_contigs', '/contigs/[*]/length']
+
+        if obj_type == 'KBaseGenomes.Genome':
+            data = self.ws.get_objects2({'objects': [{
+                                            'ref': versioned_ref,
+                                            'included': ['/assembly_ref',
+                                                         '/contigset_ref'] + included}]}
+                                        )['data'][0]['data']
+            # the assembly is only readable through the genome that references it
+            assembly_ref = data.get('assembly_ref') or data.get('contigset_ref')
+            assembly_ref = versioned_ref + ';' + assembly_ref
+            if data.get('dna_size') is None or data.get('num_contigs') is None:
+                data = self.ws.get_objects2({'objects': [{'ref': assembly_ref,
+                                                          'included': included}]}
+                                            )['data'][0]['data']
+        else:
+            assembly_ref = versioned_ref
+            data = self.ws.get_objects2({'objects': [{'ref': versioned_ref,
+                                                      'included': included}]}
+                                        )['data'][0]['data']
+
+        dna_size = data.get('dna_size')
+        contig_count = data.get('num_contigs')
+        if 'contigs' in data and isinstance(data['contigs'], list):
+            # ContigSet only records per contig lengths
+            contig_lengths = [contig.get('length') or 0 for contig in data['contigs']]
+            if dna_size is None:
+                dna_size = sum(contig_lengths)
+            if contig_count is None:
+                contig_count = len(contig_lengths)
+
+        return {'ref': versioned_ref,
+                'type': obj_type,
+                'name': info[1],
+                'version': info[4],
+                'assembly_ref': assembly_ref,
+                'dna_size': dna_size,
+                'contig_count': contig_count,
+                'index_key': '{}_{}_{}'.format(info[6], info[0], info[4])}
+
+    def _get_reference_info(self, assembly_or_genome_ref):
+        """
+        _get_reference_info: gets metadata of an Assembly, ContigSet or Genome from the
+                             persistent reference info cache, fetching it on a cache miss
+
+        The cache is shared by the jobs of all users on the node, so every ref is first
+        resolved through get_object_info3 once per job, which also checks that the user can
+        read it.
+        """
+
+        versioned_ref = self._checked_refs.get(assembly_or_genome_ref)
+        if versioned_ref:
+            reference_info = self.ref_info_cache.get(versioned_ref)
+            if reference_info:
+                return reference_info
+
+        info = self.ws.get_object_info3({'objects': [{'ref': assembly_or_genome_ref}]})['infos'][0]
+        versioned_ref = '{}/{}/{}'.format(info[6], info[0], info[4])
+        self._checked_refs[assembly_or_genome_ref] = versioned_ref
+
+        reference_info = self.ref_info_cache.get(versioned_ref)
+        if reference_info is None:
+            reference_info = self._fetch_reference_info(info)
+            self.ref_info_cache.put(versioned_ref, reference_info)
+
+        return reference_info
+
+    def _build_bowtie_index(self, output_dir, assembly_info):
+        """
+        _build_bowtie_index: builds genome index files locally with multithreaded
+                             bowtie2-build
+        """
+
+        threads = multiprocessing.cpu_count()
+        log('start building genome index file using bowtie2-build with {} threads'.format(
+                                                                                    threads))
+
+        mkdir_p(output_dir)
+        fasta_file_path = self.au.get_assembly_as_fasta({
+                                                'ref': assembly_info['assembly_ref']})['path']
+
+        index_base = re.sub(r'[^\w.-]', '_', assembly_info['name'])
+        command = [self.TOPHAT2_TOOLKIT_PATH + '/bowtie2-build',
+                   '--threads', str(threads),
+                   fasta_file_path, os.path.join(output_dir, index_base)]
+        self._run_command(command, log_prefix=assembly_info['name'])
+
+        os.remove(fasta_file_path)
+
+        return output_dir
+
+    def _get_bowtie_index(self, result_directory, assembly_or_genome_ref, workspace_name):
+        """
+        _get_bowtie_index: gets genome index file from the node-local index cache
+
+        On a cache miss, assemblies of at least local_index_build_min_size bases are indexed
+        locally with multithreaded bowtie2-build, smaller ones are fetched using kb_Bowtie2
+        (falling back to a local build if that fails).
+        """
+
+        index_key = self._get_index_key(assembly_or_genome_ref)
+
+        # kb_Bowtie2 runs behind the callback server, so it can only write under scratch
+        output_dir = os.path.join(result_directory, 'bowtie2_index_' + str(int(time.time() * 100)))
+
+        def fetch_index():
+            assembly_info = self._get_reference_info(assembly_or_genome_ref)
+            dna_size = assembly_info['dna_size']
+            log('assembly size of {}: {} bases in {} contigs'.format(
+                                                            assembly_or_genome_ref, dna_size,
+                                                            assembly_info['contig_count']))
+
+            if dna_size is not None and dna_size >= self.local_index_build_min_size:
+                return self._build_bowtie_index(output_dir, assembly_info)
+
+            try:
+                return self._fetch_bowtie_index(output_dir, assembly_or_genome_ref,
+                                                workspace_name)
+            except Exception as e:
+                log('kb_Bowtie2 failed to generate index: {}'.format(e))
+                log('falling back to local index build')
+                shutil.rmtree(output_dir, ignore_errors=True)
+                return self._build_bowtie_index(output_dir, assembly_info)
+
+        return self._get_cached_index(index_key, output_dir, fetch_index)
+
+    def _build_transcriptome_index(self, output_dir, genome_ref, genome_index_base):
+        """
+        _build_transcriptome_index: builds TopHat2 transcriptome index from Genome annotation
+        """
+
+        log('start building transcriptome index from Genome annotation')
+
+        mkdir_p(output_dir)
+        gtf_file_dir = os.path.join(output_dir, 'gtf')
+        mkdir_p(gtf_file_dir)
+        gtf_file_path = self.gfu.genome_to_gff({'genome_ref': genome_ref,
+                                                'is_gtf': 1,
+                                                'target_dir': gtf_file_dir})['gff_file']['path']
+
+        # TopHat2 exits after building the transcriptome index when no reads are given
+        build_log_dir = os.path.join(output_dir, 'tophat2_build_log')
+        command = [self.TOPHAT2_TOOLKIT_PATH + '/tophat',
+                   '-o', build_log_dir,
+                   '-G', gtf_file_path,
+                   '--transcriptome-index', os.path.join(output_dir, 'transcriptome'),
+                   genome_index_base]
+        self._run_command(command, log_prefix='transcriptome index')
+
+        shutil.rmtree(gtf_file_dir)
+        shutil.rmtree(build_log_dir)
+
+        return output_dir
+
+    def _get_transcriptome_index(self, result_directory, assembly_or_genome_ref,
+                                 genome_index_base):
+        """
+        _get_transcriptome_index: gets TopHat2 transcriptome index for a Genome from the
+                                  node-local index cache, building it on a cache miss
+
+        return transcriptome index base, or None if assembly_or_genome_ref is not a Genome
+        """
+
+        if self._get_reference_info(assembly_or_genome_ref)['type'] != 'KBaseGenomes.Genome':
+            log('skipping transcriptome index, {} is not a Genome'.format(assembly_or_genome_ref))
+            return None
+
+        # cached next to the Bowtie2 index, which it is built from
+        index_key = self._get_index_key(assembly_or_genome_ref) + '_transcriptome'
+        output_dir = os.path.join(result_directory,
+                                  'transcriptome_index_' + str(int(time.time() * 100)))
+        transcriptome_index_dir = self._get_cached_index(
+                                        index_key, output_dir,
+                                        lambda: self._build_transcriptome_index(
+                                                                    output_dir,
+                                                                    assembly_or_genome_ref,
+                                                                    genome_index_base))
+
+        index_manifest = self.index_catalog.read_manifest(transcriptome_index_dir)
+
+        return os.path.join(transcriptome_index_dir, index_manifest['base_name'])
+
     @staticmethod
     def _get_type_from_obj_info(info):
         """
@@ -123,87 +404,359 @@ class TopHatUtil:
         _get_input_object_info: gets input object data type and info
         """
 
-        info = self.ws.get_object_info3({'objects': [{'ref': input_ref}]})['infos'][0]
+        return self._get_input_objects_info([input_ref])[0]
 
-        obj_type = self._get_type_from_obj_info(info)
+    def _get_input_objects_info(self, input_refs):
+        """
+        _get_input_objects_info: gets data type and info of input objects with one Workspace
+                                 call
+        """
 
-        if obj_type in ['KBaseAssembly.PairedEndLibrary', 'KBaseAssembly.SingleEndLibrary',
-                        'KBaseFile.PairedEndLibrary', 'KBaseFile.SingleEndLibrary']:
-            return {'run_mode': 'single_library', 'info': info, 'ref': input_ref}
-        elif obj_type == 'KBaseRNASeq.RNASeqSampleSet':
-            return {'run_mode': 'sample_set', 'info': info, 'ref': input_ref}
-        elif obj_type == 'KBaseSets.ReadsSet':
-            return {'run_mode': 'sample_set', 'info': info, 'ref': input_ref}
-        else:
-            raise ValueError('Object type of input_ref is not valid, was: ' + str(obj_type))
+        infos = self.ws.get_object_info3({'objects': [{'ref': input_ref}
+                                                      for input_ref in input_refs]})['infos']
+
+        input_objects_info = []
+        for input_ref, info in zip(input_refs, infos):
+            obj_type = self._get_type_from_obj_info(info)
+
+            if obj_type in ['KBaseAssembly.PairedEndLibrary', 'KBaseAssembly.SingleEndLibrary',
+                            'KBaseFile.PairedEndLibrary', 'KBaseFile.SingleEndLibrary']:
+                run_mode = 'single_library'
+            elif obj_type == 'KBaseRNASeq.RNASeqSampleSet':
+                run_mode = 'sample_set'
+            elif obj_type == 'KBaseSets.ReadsSet':
+                run_mode = 'sample_set'
+            else:
+                raise ValueError('Object type of input_ref is not valid, was: ' + str(obj_type))
 
-    def _get_reads_file(self, reads_ref, reads_type, result_directory):
+            input_objects_info.append({'run_mode': run_mode, 'info': info, 'ref': input_ref})
+
+        return input_objects_info
+
+    def _get_reads_files(self, reads_libraries, result_directory):
         """
-        _get_reads_file: gets reads file from Single/Paired End Libiary
+        _get_reads_files: gets reads files from Single/Paired End Libiaries with one
+                          ReadsUtils.download_reads call
+
+        reads_libraries: list of (reads_ref, reads_type)
+        return list of reads file paths of each library
+
+        Reads files that are still gzipped are handed to TopHat2 as .fastq.gz files, which it
+        reads directly. With deinterleave_reads set to 'local', interleaved paired end reads
+        are downloaded as they are and split here in one pass, instead of by ReadsUtils.
+        """
+
+        reads_refs = []
+        for reads_ref, reads_type in reads_libraries:
+            if reads_ref not in reads_refs:
+                reads_refs.append(reads_ref)
+
+        download_reads_params = {'read_libraries': reads_refs,
+                                 'interleaved': 'false' if self.deinterleave_reads == 'remote'
+                                                else None}
+
+        log('downloading {} reads libraries'.format(len(reads_refs)))
+        downloaded_files = self.ru.download_reads(download_reads_params)['files']
+
+        reads_files_list = []
+        for index, (reads_ref, reads_type) in enumerate(reads_libraries):
+            reads_files = downloaded_files[reads_ref]['files']
+            # a library listed twice is moved for its first use and copied for the others
+            place_file = os.rename if reads_ref in reads_refs else shutil.copy
+            if reads_ref in reads_refs:
+                reads_refs.remove(reads_ref)
+
+            reads_file_dir = os.path.join(result_directory, 'reads_file_{}_{}'.format(
+                                                            int(time.time() * 100), index))
+            mkdir_p(reads_file_dir)
+
+            extension = '.fastq'
+            if FastqStats.is_gzipped(reads_files['fwd']):
+                extension += '.gz'
+
+            reads_file_paths = []
+            if reads_type.split('.')[1] == 'SingleEndLibrary':
+                se_file_path = os.path.join(reads_file_dir, 'SE_reads' + extension)
+                place_file(reads_files['fwd'], se_file_path)
+                reads_file_paths.append(se_file_path)
+            elif reads_type.split('.')[1] == 'PairedEndLibrary':
+                pe_fwd_file_path = os.path.join(reads_file_dir, 'PE_reads_1' + extension)
+                pe_rev_file_path = os.path.join(reads_file_dir, 'PE_reads_2' + extension)
+                if reads_files.get('type') == 'interleaved':
+                    ReadsSharder(2).deinterleave(reads_files['fwd'],
+                                                 [pe_fwd_file_path, pe_rev_file_path])
+                    if place_file == os.rename:
+                        os.remove(reads_files['fwd'])
+                    reads_files['type'] = 'paired'
+                else:
+                    place_file(reads_files['fwd'], pe_fwd_file_path)
+                    place_file(reads_files['rev'], pe_rev_file_path)
+                reads_file_paths.append(pe_fwd_file_path)
+                reads_file_paths.append(pe_rev_file_path)
+
+            # later uses of a repeated library copy from the renamed files
+            reads_files['fwd'] = reads_file_paths[0]
+            if len(reads_file_paths) > 1:
+                reads_files['rev'] = reads_file_paths[1]
+
+            reads_files_list.append(reads_file_paths)
+
+        return reads_files_list
+
+    def _get_reads_size(self, reads_files):
         """
+        _get_reads_size: estimated uncompressed size of reads files
+        """
+        reads_size = 0
+        for reads_file in reads_files:
+            if self.reads_streamer.is_pipe(reads_file):
+                stream = self.reads_streamer.streams[reads_file]
+                file_size = stream['size']
+                gzipped = stream['gzipped']
+            else:
+                file_size = os.path.getsize(reads_file)
+                gzipped = FastqStats.is_gzipped(reads_file)
+            if gzipped:
+                file_size *= self.GZIP_COMPRESSION_RATIO
+            reads_size += file_size
 
-        reads_file_paths = []
+        return reads_size
 
-        download_reads_params = {'read_libraries': [reads_ref],
-                                 'interleaved': 'false',
-                                 'gzipped': None}
+    def _put_reads_stats(self, versioned_ref, file_stats):
+        """
+        _put_reads_stats: merges FastqStats of the reads files of a library and stores them
+                          in the reads stats cache
 
-        reads_files = self.ru.download_reads(download_reads_params)['files'][reads_ref]['files']
+        return stored statistics
+        """
+        stats = FastqStats()
+        for reads_file_stats in file_stats:
+            stats.merge(reads_file_stats)
+        reads_stats = stats.to_dict()
+        reads_stats['file_count'] = len(file_stats)
+
+        log('reads statistics of {}: {} reads, {} bases, median length {}, {} qualities'.format(
+                                versioned_ref, reads_stats['read_count'],
+                                reads_stats['base_count'], reads_stats['median_length'],
+                                reads_stats['quality_encoding']))
+        self.reads_stats_cache.put(versioned_ref, reads_stats)
+
+        return reads_stats
+
+    def _collect_reads_stats(self, input_object_info, reads_files):
+        """
+        _collect_reads_stats: scans downloaded reads files of a library once, unless its
+                              statistics are already stored
+
+        Streamed reads are scanned by their feeders instead.
+        """
+        info = input_object_info['info']
+        versioned_ref = '{}/{}/{}'.format(info[6], info[0], info[4])
+        reads_stats = self.reads_stats_cache.get(versioned_ref)
+        if reads_stats is not None:
+            return reads_stats
+
+        if any(self.reads_streamer.is_pipe(reads_file) for reads_file in reads_files):
+            return None
+
+        return self._put_reads_stats(versioned_ref, [FastqStats().scan_file(reads_file)
+                                                     for reads_file in reads_files])
+
+    def _get_segment_length(self, reads_stats):
+        """
+        _get_segment_length: segment length fitting two segments into the typical read, or
+                             None to keep the TopHat2 default
+        """
+        read_length = reads_stats.get('median_length')
+        if not read_length or read_length >= 2 * self.TOPHAT2_SEGMENT_LENGTH:
+            return None
 
-        reads_file_dir = os.path.join(result_directory, 
-                                      'reads_file_' + str(int(time.time() * 100)))
-        self._mkdir_p(reads_file_dir)
+        return max(self.TOPHAT2_MIN_SEGMENT_LENGTH, read_length // 2)
+
+    def _tune_option_params(self, input_object_info, cli_option_params):
+        """
+        _tune_option_params: sets segment length and quality encoding options of a library
+                             from its stored reads statistics
+
+        return copy of cli_option_params, unchanged if there are no statistics yet
+        """
+        info = input_object_info['info']
+        reads_stats = self.reads_stats_cache.get('{}/{}/{}'.format(info[6], info[0], info[4]))
+        option_params = cli_option_params.copy()
+        if not reads_stats:
+            return option_params
+
+        option_params['read_length'] = reads_stats.get('median_length')
+        option_params['base_count'] = reads_stats.get('base_count')
+        segment_length = self._get_segment_length(reads_stats)
+        if segment_length:
+            option_params['segment_length'] = segment_length
+        # derived from the quality range, stored encodings may predate the current rules
+        quality_encoding = FastqStats.get_quality_encoding(reads_stats.get('min_quality'),
+                                                           reads_stats.get('max_quality'))
+        quality_option = self.QUALITY_ENCODING_OPTIONS.get(quality_encoding)
+        if quality_option:
+            option_params[quality_option] = 1
+
+        threads = option_params.get('num_threads') or multiprocessing.cpu_count()
+        estimated_seconds = reads_stats['base_count'] / float(
+                                            self.TOPHAT2_BASES_PER_THREAD_SECOND * threads)
+        log('{}: {} reads, segment length {}, estimated alignment time {:.0f} seconds'.format(
+                        info[1], reads_stats['read_count'],
+                        segment_length or self.TOPHAT2_SEGMENT_LENGTH, estimated_seconds))
+
+        return option_params
+
+    @staticmethod
+    def _get_dir_size(path):
+        return sum(os.path.getsize(os.path.join(root, file_name))
+                   for root, dirs, file_names in os.walk(path) for file_name in file_names)
+
+    def _estimate_reads_footprints(self, input_objects_info):
+        """
+        _estimate_reads_footprints: estimates uncompressed reads size and peak scratch usage
+                                    (reads plus TopHat2 outputs and temp files) of reads
+                                    libraries
+
+        Sizes come from stored FASTQ statistics, or else read counts and lengths recorded in
+        the reads objects, or else the size of their Shock files. Libraries nothing is known
+        about are taken as large as the largest other one.
+
+        return list of {'reads_size', 'disk'}
+        """
+        objects = self.ws.get_objects2({'objects': [{'ref': input_object_info['ref'],
+                                                     'included': ['/read_count', '/read_size',
+                                                                  '/total_bases', '/lib/size',
+                                                                  '/lib1/size', '/lib2/size']}
+                                                    for input_object_info in
+                                                    input_objects_info]})['data']
+
+        reads_sizes = []
+        for input_object_info, obj in zip(input_objects_info, objects):
+            info = input_object_info['info']
+            data = obj['data']
+            reads_stats = self.reads_stats_cache.get('{}/{}/{}'.format(info[6], info[0],
+                                                                       info[4]))
+            if reads_stats:
+                read_count = reads_stats['read_count']
+                base_count = reads_stats['base_count']
+            else:
+                read_count = data.get('read_count') or 0
+                base_count = data.get('total_bases') or read_count * (data.get('read_size') or 0)
+
+            if base_count:
+                reads_size = 2 * base_count + read_count * self.FASTQ_RECORD_OVERHEAD
+            else:
+                # stored files may well be gzipped
+                shock_size = sum((data.get(lib) or {}).get('size') or 0
+                                 for lib in ['lib', 'lib1', 'lib2'])
+                reads_size = shock_size * self.GZIP_COMPRESSION_RATIO or None
+            reads_sizes.append(reads_size)
+
+        largest_reads_size = max([reads_size or 0 for reads_size in reads_sizes] or [0])
+
+        footprints = []
+        for reads_size in reads_sizes:
+            if reads_size is None:
+                reads_size = largest_reads_size
+            # ReadsUtils always downloads reads uncompressed
+            footprints.append({'reads_size': reads_size,
+                               'disk': reads_size + reads_size * self.TOPHAT2_DISK_EXPANSION})
+
+        return footprints
+
+    def _get_scratch_budget(self):
+        """
+        _get_scratch_budget: configured scratch_budget, or else the scratch space free now
+        """
+        if self.scratch_budget is not None:
+            return self.scratch_budget
+
+        stat = os.statvfs(self.scratch)
+
+        return stat.f_bavail * stat.f_frsize
+
+    def _order_reads_libraries(self, input_objects_info):
+        """
+        _order_reads_libraries: orders reads libraries largest first, so the longest
+                                alignments do not start last
 
-        if reads_type.split('.')[1] == 'SingleEndLibrary':
-            se_file_path = os.path.join(reads_file_dir, 'SE_reads.fastq')
-            os.rename(reads_files['fwd'], se_file_path)
-            reads_file_paths.append(se_file_path)
-        elif reads_type.split('.')[1] == 'PairedEndLibrary':
-            pe_fwd_file_path = os.path.join(reads_file_dir, 'PE_reads_1.fastq')
-            pe_rev_file_path = os.path.join(reads_file_dir, 'PE_reads_2.fastq')
-            os.rename(reads_files['fwd'], pe_fwd_file_path)
-            os.rename(reads_files['rev'], pe_rev_file_path)
-            reads_file_paths.append(pe_fwd_file_path)
-            reads_file_paths.append(pe_rev_file_path)
+        Libraries are weighed by stored base counts, or else by the size of their Shock
+        files (plain FASTQ holds about two bytes per base).
 
-        return reads_file_paths
+        return list of indices into input_objects_info
+        """
+        weights = []
+        for input_object_info in input_objects_info:
+            info = input_object_info['info']
+            reads_stats = self.reads_stats_cache.get('{}/{}/{}'.format(info[6], info[0],
+                                                                       info[4]))
+            weights.append(reads_stats['base_count'] if reads_stats else None)
+
+        unweighed = [index for index, weight in enumerate(weights) if weight is None]
+        if unweighed:
+            stream_sources = self._get_reads_stream_sources([input_objects_info[index]
+                                                             for index in unweighed])
+            for index, sources in zip(unweighed, stream_sources):
+                weights[index] = sum(source['size'] for source in sources or []) // 2
+
+        order = sorted(range(len(input_objects_info)), key=lambda index: -weights[index])
+        log('reads libraries ordered by estimated bases: {}'.format(
+                                                    [weights[index] for index in order]))
+
+        return order
 
     def _generate_command(self, genome_index_base, reads_files, 
                           tophat_result_dir, cli_option_params):
         """
-        _generate_command: generate tophat2 command
+        _generate_command: generate tophat2 command as argument list
         """
 
-        command = self.TOPHAT2_TOOLKIT_PATH + '/tophat '
+        toolkit_path = cli_option_params.get('toolkit_path') or self.TOPHAT2_TOOLKIT_PATH
+        command = [toolkit_path + '/tophat']
 
-        command += '-o {} '.format(tophat_result_dir)
+        command += ['-o', tophat_result_dir]
 
         for key, option in self.OPTIONS_MAP.items():
             option_value = cli_option_params.get(key)
             if key in self.BOOLEAN_OPTIONS and option_value:
-                option_value = ' '
-            if option_value:
-                command += '{} {} '.format(option, option_value)
+                command.append(option)
+            elif option_value:
+                command += [option, str(option_value)]
 
         preset_options = cli_option_params.get('preset_options')
         if preset_options:
-            command += '{} '.format('--' + preset_options)
+            command.append('--' + preset_options)
+
+        transcriptome_index_base = cli_option_params.get('transcriptome_index_base')
+        if transcriptome_index_base:
+            command += ['--transcriptome-index', transcriptome_index_base]
 
-        command += '{} {}'.format(genome_index_base, ' '.join(reads_files))
+        command += [genome_index_base] + reads_files
 
-        log('generated TopHat2 command: {}'.format(command))
+        log('generated TopHat2 command: {}'.format(CommandRunner.format_command(command)))
 
         return command
 
     def _save_alignment(self, tophat_result_dir, alignment_name, reads_ref,
-                        assembly_or_genome_ref, workspace_name, reads_condition):
+                        assembly_or_genome_ref, workspace_name, reads_condition,
+                        journal_key=None):
         """
         _save_alignment: upload Alignment object
+
+        journal_key: key of the library in the run journal, to journal the merged BAM file
+                     and reuse the one the resumed run merged
         """
 
         log('starting saving ReadsAlignment object')
 
-        bam_file_path = self._merge_bam_files(tophat_result_dir)
+        bam_file_path = None
+        if journal_key and self.run_journal.reached(journal_key, 'merged'):
+            bam_file_path = str(self.run_journal.get(journal_key)['bam_file'])
+        if not (bam_file_path and os.path.isfile(bam_file_path)):
+            bam_file_path = self._merge_bam_files(tophat_result_dir)
+            if journal_key:
+                self.run_journal.record(journal_key, 'merged', bam_file=bam_file_path)
         destination_ref = workspace_name + '/' + alignment_name
         if reads_condition:
             condition = reads_condition
@@ -215,7 +768,7 @@ class TopHatUtil:
                                    'read_library_ref': reads_ref,
                                    'assembly_or_genome_ref': assembly_or_genome_ref,
                                    'aligned_using': 'tophat2',
-                                   'aligner_version': '2.1.1',
+                                   'aligner_version': self.TOPHAT2_VERSION,
                                    'condition': condition}
 
         reads_alignment_object_ref = self.rau.upload_alignment(upload_alignment_params)['obj_ref']
@@ -228,9 +781,10 @@ class TopHatUtil:
         upload expects these to be in one file (like hisat and bowtie produces). This uses
         samtools to merge the files.
         """
-        command = 'samtools merge {}/{} {}/accepted_hits.bam {}/unmapped.bam'.format(
-            tophat_result_dir, merged_file_name, tophat_result_dir, tophat_result_dir)
-        self._run_command(command)
+        command = ['samtools', 'merge', '-f', os.path.join(tophat_result_dir, merged_file_name),
+                   os.path.join(tophat_result_dir, 'accepted_hits.bam'),
+                   os.path.join(tophat_result_dir, 'unmapped.bam')]
+        self._run_command(command, log_prefix=os.path.basename(tophat_result_dir))
         return os.path.join(tophat_result_dir, merged_file_name)
 
     def _save_alignment_set(self, reads_alignment_object_refs, workspace_name, alignment_set_name,
@@ -256,42 +810,719 @@ class TopHatUtil:
 
         return alignment_set_object_ref
 
+    def _get_reads_stream_sources(self, input_objects_info):
+        """
+        _get_reads_stream_sources: gets Shock files of KBaseFile reads libraries that can be
+                                   streamed (forward and reverse reads in separate files, or
+                                   interleaved ones when they are split locally)
+
+        return list with, for each library, list of {'url', 'id', 'size', 'mate'} in TopHat2
+        reads order, or None if the library can not be streamed. mate is 0 or 1 for the two
+        halves of an interleaved file and None otherwise.
+        """
+        stream_sources = [None] * len(input_objects_info)
+
+        kbase_file_libraries = [(index, input_object_info)
+                                for index, input_object_info in enumerate(input_objects_info)
+                                if self._get_type_from_obj_info(
+                                            input_object_info['info']).startswith('KBaseFile.')]
+        if not kbase_file_libraries:
+            return stream_sources
+
+        objects = self.ws.get_objects2({'objects': [{'ref': input_object_info['ref'],
+                                                     'included': ['/lib', '/lib1', '/lib2',
+                                                                  '/interleaved']}
+                                                    for _, input_object_info in
+                                                    kbase_file_libraries]})['data']
+
+        for (index, input_object_info), obj in zip(kbase_file_libraries, objects):
+            data = obj['data']
+            if data.get('interleaved'):
+                if self.deinterleave_reads != 'local':
+                    continue
+                lib = data.get('lib1')
+                if not (lib and lib.get('file')):
+                    continue
+                stream_sources[index] = [{'url': lib['file'].get('url') or self.shock_url,
+                                          'id': lib['file']['id'],
+                                          'size': (lib.get('size') or 0) // 2,
+                                          'mate': mate} for mate in [0, 1]]
+                continue
+            libs = [data['lib']] if 'lib' in data else [data.get('lib1'), data.get('lib2')]
+            if not all(lib and lib.get('file') for lib in libs):
+                continue
+            stream_sources[index] = [{'url': lib['file'].get('url') or self.shock_url,
+                                      'id': lib['file']['id'],
+                                      'size': lib.get('size') or 0,
+                                      'mate': None} for lib in libs]
+
+        return stream_sources
+
+    def _stream_reads_files(self, stream_sources, result_directory, input_object_info):
+        """
+        _stream_reads_files: creates named pipes streaming reads files from Shock
+
+        Statistics of a library not scanned before are stored once every file has been
+        streamed in full.
+
+        return list of reads pipe paths
+        """
+        reads_file_dir = os.path.join(result_directory, 'reads_stream_' + str(uuid.uuid4()))
+        mkdir_p(reads_file_dir)
+
+        if len(stream_sources) == 1:
+            pipe_names = ['SE_reads']
+        else:
+            pipe_names = ['PE_reads_1', 'PE_reads_2']
+
+        info = input_object_info['info']
+        versioned_ref = '{}/{}/{}'.format(info[6], info[0], info[4])
+        collect_stats = self.reads_stats_cache.get(versioned_ref) is None
+        file_stats = []
+
+        def on_stats(stats):
+            file_stats.append(stats)
+            if len(file_stats) == len(stream_sources):
+                self._put_reads_stats(versioned_ref, file_stats)
+
+        return [self.reads_streamer.open_stream(os.path.join(reads_file_dir, pipe_name),
+                                                source['url'], source['id'], source['size'],
+                                                mate=source['mate'],
+                                                on_stats=on_stats if collect_stats else None)
+                for pipe_name, source in zip(pipe_names, stream_sources)]
+
+    def _download_reads_libraries(self, input_objects_info, result_directory):
+        """
+        _download_reads_libraries: download reads files of reads libraries in one batch
+
+        Libraries of at least stream_reads_min_size bytes are streamed into named pipes
+        instead, where possible. FASTQ statistics of downloaded libraries are collected
+        before they are handed on.
+        """
+        stream_sources = [None] * len(input_objects_info)
+        if self.stream_reads_min_size is not None:
+            stream_sources = self._get_reads_stream_sources(input_objects_info)
+            stream_sources = [sources if sources and sum(source['size'] for source in sources) >=
+                              self.stream_reads_min_size else None
+                              for sources in stream_sources]
+
+        reads_libraries = [(input_object_info['ref'],
+                            self._get_type_from_obj_info(input_object_info['info']))
+                           for input_object_info, sources in zip(input_objects_info,
+                                                                 stream_sources)
+                           if sources is None]
+        downloaded_files = []
+        if reads_libraries:
+            downloaded_files = self._get_reads_files(reads_libraries, result_directory)
+
+        reads_files_list = []
+        for input_object_info, sources in zip(input_objects_info, stream_sources):
+            if sources is None:
+                reads_files = downloaded_files.pop(0)
+                self._collect_reads_stats(input_object_info, reads_files)
+            else:
+                reads_files = self._stream_reads_files(sources, result_directory,
+                                                       input_object_info)
+            reads_files_list.append(reads_files)
+
+        return reads_files_list
+
+    @staticmethod
+    def _get_journal_key(input_object_info):
+        """
+        _get_journal_key: key of a reads library in the run journal, its versioned ref
+        """
+        info = input_object_info['info']
+
+        return '{}/{}/{}'.format(info[6], info[0], info[4])
+
+    def _get_journaled_reads_files(self, journal_key):
+        """
+        _get_journaled_reads_files: reads files the resumed run downloaded for a library, if
+                                    they are all still there
+        """
+        record = self.run_journal.get(journal_key)
+        reads_files = [str(reads_file) for reads_file in record.get('reads_files') or []]
+        if record.get('stage') not in ['downloaded', 'aligning'] or not reads_files:
+            return None
+        if not all(os.path.isfile(reads_file) for reads_file in reads_files):
+            return None
+
+        return reads_files
+
+    def _get_journaled_result_dir(self, journal_key):
+        """
+        _get_journaled_result_dir: TopHat2 result directory of a library the resumed run
+                                   aligned, if it is still there
+        """
+        if not self.run_journal.reached(journal_key, 'aligned'):
+            return None
+
+        tophat_result_dir = str(self.run_journal.get(journal_key)['tophat_result_dir'])
+        if not os.path.isfile(os.path.join(tophat_result_dir, 'accepted_hits.bam')):
+            return None
+
+        return tophat_result_dir
+
+    def _get_journaled_alignment_ref(self, journal_key):
+        """
+        _get_journaled_alignment_ref: Alignment object the resumed run saved for a library
+        """
+        if not self.run_journal.reached(journal_key, 'uploaded'):
+            return None
+
+        return str(self.run_journal.get(journal_key)['alignment_ref'])
+
+    def _download_journaled_reads_libraries(self, input_objects_info, result_directory):
+        """
+        _download_journaled_reads_libraries: downloads reads libraries like
+                                             _download_reads_libraries, except those the
+                                             resumed run downloaded or aligned already
+
+        Downloaded reads files are journaled, streamed ones can not be reused.
+
+        return list of reads files of each library, None for libraries aligned already
+        """
+        reads_files_list = [None] * len(input_objects_info)
+        pending = []
+        for position, input_object_info in enumerate(input_objects_info):
+            journal_key = self._get_journal_key(input_object_info)
+            if self._get_journaled_result_dir(journal_key):
+                continue
+            reads_files = self._get_journaled_reads_files(journal_key)
+            if reads_files:
+                log('reusing reads files of {} downloaded before'.format(journal_key))
+                reads_files_list[position] = reads_files
+            else:
+                pending.append(position)
+
+        if not pending:
+            return reads_files_list
+
+        downloaded_files = self._download_reads_libraries([input_objects_info[position]
+                                                           for position in pending],
+                                                          result_directory)
+        for position, reads_files in zip(pending, downloaded_files):
+            reads_files_list[position] = reads_files
+            if not any(self.reads_streamer.is_pipe(reads_file) for reads_file in reads_files):
+                self.run_journal.record(self._get_journal_key(input_objects_info[position]),
+                                        'downloaded', reads_files=reads_files)
+
+        return reads_files_list
+
+    @staticmethod
+    def _get_interrupted_run(run_journal, journal_key, reads_files):
+        """
+        _get_interrupted_run: finds the TopHat2 run of a library that the resumed run left
+                              mid-alignment
+
+        TopHat2 resumes from its last checkpoint with the command logged in its output
+        directory, so the run is only picked up with the very same reads files.
+
+        return (TopHat2 output directory, result directory) or None
+        """
+        record = run_journal.get(journal_key)
+        tophat_run_dir = record.get('tophat_run_dir')
+        if record.get('stage') != 'aligning' or record.get('reads_files') != reads_files:
+            return None
+        if not os.path.isfile(os.path.join(tophat_run_dir, 'logs', 'run.log')):
+            return None
+
+        return tophat_run_dir, record['tophat_result_dir']
+
+    def _align_reads_library(self, reads_obj_name, genome_index_base, reads_files,
+                             result_directory, cli_option_params, reads_streams=None,
+                             journal_key=None):
+        """
+        _align_reads_library: run TopHat2 on downloaded reads files
+
+        reads_streams: ReadsStreamer metadata of piped reads files, when run in a task worker
+        journal_key: key of the library in the run journal of result_directory, to journal
+                     the run and resume it if the resumed run left it mid-alignment
+
+        return TopHat2 result directory
+        """
+        if reads_streams:
+            self.reads_streamer.streams.update(reads_streams)
+
+        # task workers have no run journal of their own, it is found in result_directory
+        run_journal = RunJournal(result_directory) if journal_key else None
+        interrupted_run = None
+        if run_journal:
+            interrupted_run = self._get_interrupted_run(run_journal, journal_key, reads_files)
+
+        if interrupted_run:
+            tophat_run_dir, tophat_result_dir = interrupted_run
+            log('resuming interrupted TopHat2 run of {} in {}'.format(reads_obj_name,
+                                                                      tophat_run_dir))
+            toolkit_path = cli_option_params.get('toolkit_path') or self.TOPHAT2_TOOLKIT_PATH
+            command = [toolkit_path + '/tophat', '--resume', tophat_run_dir]
+        else:
+            tophat_result_dir = os.path.join(result_directory,
+                                             'tophat2_result_' + reads_obj_name +
+                                             '_' + str(int(time.time() * 100)))
+
+            # TopHat2 keeps its temp files under the output dir, so both go to fast storage
+            reads_size = self._get_reads_size(reads_files)
+            tophat_run_dir = self.fast_storage.make_dir(os.path.basename(tophat_result_dir),
+                                                        reads_size * self.TOPHAT2_DISK_EXPANSION)
+            if not tophat_run_dir:
+                tophat_run_dir = tophat_result_dir
+
+            command = self._generate_command(genome_index_base, reads_files,
+                                             tophat_run_dir, cli_option_params)
+            if run_journal:
+                run_journal.record(journal_key, 'aligning', reads_files=reads_files,
+                                   tophat_run_dir=tophat_run_dir,
+                                   tophat_result_dir=tophat_result_dir)
+
+        threads = cli_option_params.get('num_threads') or multiprocessing.cpu_count()
+        # about as many bases as sequence and quality characters of the reads
+        bases = cli_option_params.get('base_count') or self._get_reads_size(reads_files) // 2
+
+        def run_tophat(command):
+            progress = AlignmentProgress(reads_obj_name, bases, threads, self.stage_history,
+                                         fallback_seconds=bases / float(
+                                             self.TOPHAT2_BASES_PER_THREAD_SECOND * threads),
+                                         progress_file=AlignmentProgress.get_progress_file(
+                                             os.path.join(result_directory, 'progress'),
+                                             journal_key or reads_obj_name))
+            memory_monitor = PeakMemoryMonitor()
+            self._run_command(command, memory_monitor=memory_monitor,
+                              log_prefix=reads_obj_name, on_line=progress.on_line)
+            progress.finish()
+            return memory_monitor
+
+        try:
+            memory_monitor = run_tophat(command)
+        except ValueError as e:
+            # only a run that filled up the fast storage starts over on scratch, and only
+            # from files, piped reads are consumed
+            if (tophat_run_dir == tophat_result_dir or
+                    any(self.reads_streamer.is_pipe(reads_file) for reads_file in reads_files) or
+                    not ('No space left on device' in str(e) or self.fast_storage.is_full())):
+                # only an output directory on scratch stays for a resumed run, fast storage
+                # is node memory or disk that other jobs need
+                if tophat_run_dir != tophat_result_dir:
+                    self.fast_storage.discard(tophat_run_dir)
+                raise
+
+            log('fast storage ran out of space aligning {}, realigning on scratch'.format(
+                                                                            reads_obj_name))
+            self.fast_storage.discard(tophat_run_dir)
+            tophat_run_dir = tophat_result_dir
+            command = self._generate_command(genome_index_base, reads_files,
+                                             tophat_run_dir, cli_option_params)
+            if run_journal:
+                run_journal.record(journal_key, 'aligning', reads_files=reads_files,
+                                   tophat_run_dir=tophat_run_dir,
+                                   tophat_result_dir=tophat_result_dir)
+            memory_monitor = run_tophat(command)
+
+        # a stream cut short reads like a complete file to TopHat2
+        self.reads_streamer.check(reads_files)
+
+        if memory_monitor.peak:
+            self.memory_profile.record(self._get_index_size(genome_index_base),
+                                       cli_option_params.get('read_length'),
+                                       memory_monitor.peak)
+
+        if tophat_run_dir != tophat_result_dir:
+            log('moving TopHat2 outputs from fast storage to {}'.format(tophat_result_dir))
+            self.fast_storage.move_outputs(tophat_run_dir, tophat_result_dir,
+                                           exclude=['tmp'])
+
+        return tophat_result_dir
+
+    def _align_reads_library_task(self, *args, **kwargs):
+        """
+        _align_reads_library_task: _align_reads_library in a task worker, which has a fast
+                                   storage of its own that no run_tophat2_app cleans up
+        """
+        try:
+            return self._align_reads_library(*args, **kwargs)
+        finally:
+            self.fast_storage.cleanup()
+
+    def _get_shard_count(self, reads_files, cli_option_params):
+        """
+        _get_shard_count: number of shards to align a library in, 1 to align it in one run
+
+        Libraries of at least reads_shard_min_size bytes get one shard per
+        TOPHAT2_SHARD_THREADS of the available threads. Streamed libraries are aligned in
+        one run, splitting them would write the on-disk copy streaming avoids.
+        """
+        if self.reads_shard_min_size is None:
+            return 1
+
+        if any(self.reads_streamer.is_pipe(reads_file) for reads_file in reads_files):
+            log('aligning streamed reads {} in one run'.format(reads_files))
+            return 1
+
+        if self._get_reads_size(reads_files) < self.reads_shard_min_size:
+            return 1
+
+        threads = min(cli_option_params.get('num_threads') or multiprocessing.cpu_count(),
+                      multiprocessing.cpu_count())
+
+        return max(1, threads // self.TOPHAT2_SHARD_THREADS)
+
+    def _align_reads_library_sharded(self, reads_obj_name, genome_index_base, reads_files,
+                                     result_directory, cli_option_params, shard_count):
+        """
+        _align_reads_library_sharded: splits reads into shards (keeping mates paired), aligns
+                                      them as concurrent TopHat2 runs sharing one
+                                      memory-mapped index and merges their outputs
+
+        return TopHat2 result directory
+        """
+        shard_dir = os.path.join(result_directory,
+                                 'tophat2_shards_' + str(int(time.time() * 100)))
+        option_params = cli_option_params.copy()
+        shard_count = min(shard_count,
+                          self._share_index(genome_index_base, shard_dir, [option_params]))
+        if shard_count < 2:
+            log('not enough memory to align {} in shards'.format(reads_obj_name))
+            shutil.rmtree(shard_dir, ignore_errors=True)
+            return self._align_reads_library(reads_obj_name, genome_index_base, reads_files,
+                                             result_directory, cli_option_params)
+
+        shard_reads_files = ReadsSharder(shard_count).split(reads_files, shard_dir)
+        shard_count = len(shard_reads_files)
+
+        threads = cli_option_params.get('num_threads') or multiprocessing.cpu_count()
+        option_params['num_threads'] = max(1, threads // shard_count)
+        if option_params.get('base_count'):
+            option_params['base_count'] //= shard_count
+
+        log('aligning {} in {} shards with {} threads each'.format(
+                                        reads_obj_name, shard_count, option_params['num_threads']))
+
+        executor = TaskExecutor(self.__class__, self.config, shard_count)
+        try:
+            shard_result_dirs = executor.map('_align_reads_library_task',
+                                             [('{}_shard{}'.format(reads_obj_name, shard),
+                                               genome_index_base, shard_reads_files[shard],
+                                               shard_dir, option_params)
+                                              for shard in range(shard_count)])
+        finally:
+            executor.close()
+
+        tophat_result_dir = os.path.join(result_directory, 
+                                         'tophat2_result_' + reads_obj_name + 
+                                         '_' + str(int(time.time() * 100)))
+        ResultMerger().merge(shard_result_dirs, tophat_result_dir)
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+        return tophat_result_dir
+
+    def _get_alignment_input(self, input_object_info, cli_option_params):
+        """
+        _get_alignment_input: normalized inputs of aligning a reads library, which its
+                              Alignment is memoized by
+
+        Options tuned to the reads (read length, segment length, quality encoding) follow
+        from the versioned reads ref, num_threads does not change the alignment.
+        """
+        options = {}
+        for key in list(self.OPTIONS_MAP.keys()) + ['preset_options', 'use_transcriptome_index']:
+            option_value = cli_option_params.get(key)
+            if key == 'num_threads' or option_value in [None, '']:
+                continue
+            if key in self.BOOLEAN_OPTIONS + ['use_transcriptome_index']:
+                if not option_value:
+                    continue
+                option_value = True
+            options[key] = str(option_value)
+
+        info = input_object_info['info']
+        reference_info = self._get_reference_info(cli_option_params.get('assembly_or_genome_ref'))
+
+        return {'reads_ref': '{}/{}/{}'.format(info[6], info[0], info[4]),
+                'assembly_or_genome_ref': reference_info['ref'],
+                'condition': cli_option_params.get('reads_condition') or 'unspecified',
+                'options': options,
+                'aligner_version': self.TOPHAT2_VERSION,
+                'bowtie2_version': self.index_catalog.bowtie2_version}
+
+    def _get_memoized_alignment(self, input_object_info, cli_option_params):
+        """
+        _get_memoized_alignment: Alignment an earlier run made from the same inputs, if it is
+                                 still accessible
+
+        An Alignment outside the target workspace, or named differently, is copied there under
+        the name this run would give it.
+
+        return Alignment object ref, or None if the library has to be aligned
+        """
+        if cli_option_params.get('force'):
+            return None
+
+        alignment_input = self._get_alignment_input(input_object_info, cli_option_params)
+        record = self.alignment_cache.get(AlignmentCache.make_key(alignment_input))
+        if record is None:
+            return None
+
+        alignment_ref = record['alignment_ref']
+        info = self.ws.get_object_info3({'objects': [{'ref': alignment_ref}],
+                                         'ignoreErrors': 1})['infos'][0]
+        if info is None:
+            log('cached Alignment {} is no longer accessible'.format(alignment_ref))
+            return None
+
+        alignment_object_name = input_object_info['info'][1] + cli_option_params.get(
+                                                                        'alignment_suffix')
+        workspace_name = cli_option_params.get('workspace_name')
+        if info[7] != workspace_name or info[1] != alignment_object_name:
+            info = self.ws.copy_object({'from': {'ref': alignment_ref},
+                                        'to': {'workspace': workspace_name,
+                                               'name': alignment_object_name}})
+            log('copied cached Alignment {} to {}/{}'.format(alignment_ref, workspace_name,
+                                                             alignment_object_name))
+
+        reads_alignment_object_ref = '{}/{}/{}'.format(info[6], info[0], info[4])
+        log('reusing Alignment {} of the same inputs for {}'.format(
+                                    reads_alignment_object_ref, alignment_input['reads_ref']))
+
+        return reads_alignment_object_ref
+
+    def _upload_reads_library(self, input_object_info, tophat_result_dir, cli_option_params):
+        """
+        _upload_reads_library: save TopHat2 result of a single reads library as Alignment
+        """
+        alignment_object_name = input_object_info['info'][1] + cli_option_params.get(
+                                                                        'alignment_suffix')
+        assembly_or_genome_ref = cli_option_params.get('assembly_or_genome_ref')
+        journal_key = self._get_journal_key(input_object_info)
+        reads_alignment_object_ref = self._save_alignment(tophat_result_dir,
+                                                          alignment_object_name,
+                                                          input_object_info['ref'],
+                                                          assembly_or_genome_ref,
+                                                          cli_option_params.get('workspace_name'),
+                                                          cli_option_params.get('reads_condition'),
+                                                          journal_key=journal_key)
+        self.run_journal.record(journal_key, 'uploaded', alignment_ref=reads_alignment_object_ref)
+
+        alignment_input = self._get_alignment_input(input_object_info, cli_option_params)
+        self.alignment_cache.put(AlignmentCache.make_key(alignment_input), alignment_input,
+                                 reads_alignment_object_ref)
+
+        return reads_alignment_object_ref
+
     def _process_single_reads_library(self, input_object_info, genome_index_base, 
                                       result_directory, cli_option_params):
         """
         _process_single_reads_library: process single reads library
         """
+        reads_obj_name = input_object_info['info'][1]
+        journal_key = self._get_journal_key(input_object_info)
+        reads_alignment_object_ref = self._get_journaled_alignment_ref(journal_key)
+        if reads_alignment_object_ref:
+            log('reusing Alignment {} saved before'.format(reads_alignment_object_ref))
+            return reads_alignment_object_ref
+
+        reads_alignment_object_ref = self._get_memoized_alignment(input_object_info,
+                                                                  cli_option_params)
+        if reads_alignment_object_ref:
+            self.run_journal.record(journal_key, 'uploaded',
+                                    alignment_ref=reads_alignment_object_ref)
+            return reads_alignment_object_ref
+
+        tophat_result_dir = self._get_journaled_result_dir(journal_key)
+        if tophat_result_dir:
+            log('reusing TopHat2 result {} aligned before'.format(tophat_result_dir))
+        else:
+            reads_files = self._download_journaled_reads_libraries([input_object_info],
+                                                                   result_directory)[0]
+            option_params = self._tune_option_params(input_object_info, cli_option_params)
+
+            shard_count = self._get_shard_count(reads_files, option_params)
+            if shard_count > 1:
+                tophat_result_dir = self._align_reads_library_sharded(reads_obj_name,
+                                                                      genome_index_base,
+                                                                      reads_files,
+                                                                      result_directory,
+                                                                      option_params,
+                                                                      shard_count)
+            else:
+                tophat_result_dir = self._align_reads_library(reads_obj_name,
+                                                              genome_index_base,
+                                                              reads_files, result_directory,
+                                                              option_params,
+                                                              journal_key=journal_key)
+
+            self.reads_streamer.close(reads_files)
+            self.run_journal.record(journal_key, 'aligned', tophat_result_dir=tophat_result_dir)
+
+        reads_alignment_object_ref = self._upload_reads_library(input_object_info,
+                                                                tophat_result_dir,
+                                                                cli_option_params)
+
+        return reads_alignment_object_ref
+
+    @staticmethod
+    def _parse_align_summary(tophat_result_dir):
+        """
+        _parse_align_summary: gets input and mapped read counts and the overall read mapping
+                              rate from TopHat2 align_summary.txt
+        """
+        with open(os.path.join(tophat_result_dir, 'align_summary.txt')) as summary_file:
+            summary = summary_file.read()
+
+        input_reads = sum(int(count) for count in re.findall(r'Input\s*:\s*(\d+)', summary))
+        mapped_reads = sum(int(count) for count in re.findall(r'Mapped\s*:\s*(\d+)', summary))
+        match = re.search(r'([\d.]+)% overall read mapping rate', summary)
+        if match:
+            mapping_rate = float(match.group(1))
+        else:
+            mapping_rate = 100.0 * mapped_reads / input_reads if input_reads else 0.0
+
+        return {'input_reads': input_reads,
+                'mapped_reads': mapped_reads,
+                'mapping_rate': mapping_rate}
+
+    @classmethod
+    def _estimate_run_seconds(cls, preview_seconds, stage_seconds, scale):
+        """
+        _estimate_run_seconds: run time of a whole library from the run time and stage times
+                               of its preview run over 1 / scale of its reads
+
+        Startup, index checks and other fixed costs are counted once, only the time of the
+        stages going through the reads grows with them.
+        """
+        if not stage_seconds:
+            # nothing to tell the fixed costs apart by
+            return preview_seconds * scale
+
+        read_seconds = min(preview_seconds, sum(seconds for stage, seconds in
+                                                stage_seconds.items()
+                                                if stage not in cls.TOPHAT2_FIXED_STAGES))
+
+        return preview_seconds - read_seconds + read_seconds * scale
+
+    @staticmethod
+    def _count_junctions(tophat_result_dir):
+        """
+        _count_junctions: number of junctions in TopHat2 junctions.bed
+        """
+        junctions_file = os.path.join(tophat_result_dir, 'junctions.bed')
+        if not os.path.isfile(junctions_file):
+            return 0
+        with open(junctions_file) as junctions:
+            return sum(1 for line in junctions if line.strip() and not line.startswith('track'))
+
+    def _preview_reads_library(self, input_object_info, genome_index_base, result_directory,
+                               cli_option_params):
+        """
+        _preview_reads_library: aligns a subsample of a reads library and extrapolates the
+                                statistics of the preview run to the whole library
+        """
+        reads_obj_name = input_object_info['info'][1]
+        reads_files = self._download_reads_libraries([input_object_info], result_directory)[0]
+
         try:
-            reads_obj_type = self._get_type_from_obj_info(input_object_info['info'])
-            reads_obj_name = input_object_info['info'][1]
-            reads_files = self._get_reads_file(input_object_info['ref'], 
-                                               reads_obj_type, 
-                                               result_directory)
-            
-            tophat_result_dir = os.path.join(result_directory, 
-                                             'tophat2_result_' + reads_obj_name + 
-                                             '_' + str(int(time.time() * 100)))
-            command = self._generate_command(genome_index_base, reads_files, 
-                                             tophat_result_dir, cli_option_params)
-            self._run_command(command)
-
-            alignment_object_name = reads_obj_name + cli_option_params.get('alignment_suffix')
-            assembly_or_genome_ref = cli_option_params.get('assembly_or_genome_ref')
-            reads_alignment_object_ref = self._save_alignment(tophat_result_dir,
-                                                              alignment_object_name,
-                                                              input_object_info['ref'],
-                                                              assembly_or_genome_ref,
-                                                              cli_option_params.get('workspace_name'),
-                                                              cli_option_params.get('reads_condition'))
-        except:
-            log('caught exception in worker')
-            e = sys.exc_info()[0]
-
-            error_msg = 'ERROR -- {}: {}'.format(e, ''.join(traceback.format_stack()))
-
-            reads_alignment_object_ref = error_msg
+            sample_dir = os.path.join(result_directory, 'preview_reads_{}_{}'.format(
+                                                    reads_obj_name, int(time.time() * 100)))
+            sample_files, total_reads, sampled_reads = ReadsSharder(1).subsample(
+                                            reads_files, sample_dir,
+                                            fraction=cli_option_params.get('preview_fraction'),
+                                            max_records=cli_option_params.get('preview_reads'))
+            reads_disk_size = sum(os.path.getsize(reads_file) for reads_file in reads_files
+                                  if not self.reads_streamer.is_pipe(reads_file))
         finally:
-            return reads_alignment_object_ref
+            self.reads_streamer.close(reads_files)
+            shutil.rmtree(os.path.dirname(reads_files[0]), ignore_errors=True)
+
+        if not sampled_reads:
+            raise ValueError('Preview of {} selected no reads'.format(reads_obj_name))
+
+        start_time = time.time()
+        tophat_result_dir = self._align_reads_library(reads_obj_name, genome_index_base,
+                                                      sample_files, result_directory,
+                                                      self._tune_option_params(
+                                                                        input_object_info,
+                                                                        cli_option_params))
+        preview_seconds = time.time() - start_time
+        shutil.rmtree(sample_dir, ignore_errors=True)
+        progress = AlignmentProgress.read_progress(AlignmentProgress.get_progress_file(
+                                os.path.join(result_directory, 'progress'), reads_obj_name))
+
+        align_summary = self._parse_align_summary(tophat_result_dir)
+        output_size = self._get_dir_size(tophat_result_dir)
+        scale = float(total_reads) / sampled_reads
+
+        preview_result = {'reads_ref': input_object_info['ref'],
+                          'total_reads': total_reads,
+                          'sampled_reads': sampled_reads,
+                          'mapped_reads': align_summary['mapped_reads'],
+                          'mapping_rate': align_summary['mapping_rate'],
+                          'junction_count': self._count_junctions(tophat_result_dir),
+                          'preview_seconds': preview_seconds,
+                          'estimated_run_seconds': self._estimate_run_seconds(
+                                                preview_seconds,
+                                                progress and progress['stage_seconds'], scale),
+                          'estimated_disk_bytes': int(output_size * scale + reads_disk_size)}
+        log('preview of {}: {}'.format(reads_obj_name, preview_result))
+
+        return preview_result
+
+    def _preview_reads_libraries(self, input_object_info, genome_index_base, result_directory,
+                                 cli_option_params):
+        """
+        _preview_reads_libraries: previews a single reads library or every library of a set
+        """
+        if input_object_info['run_mode'] == 'single_library':
+            return [self._preview_reads_library(input_object_info, genome_index_base,
+                                                result_directory, cli_option_params)]
+
+        reads_refs = self.fetch_reads_refs_from_sampleset(input_object_info['ref'],
+                                                          input_object_info['info'])
+        reads_input_objects_info = self._get_input_objects_info([reads_ref['ref']
+                                                                 for reads_ref in reads_refs])
+        option_params_list = [cli_option_params.copy() for _ in reads_refs]
+        memory_worker_limit = self._share_index(genome_index_base, result_directory,
+                                                option_params_list)
+
+        cpus = min(cli_option_params.get('num_threads') or multiprocessing.cpu_count(),
+                   multiprocessing.cpu_count(), memory_worker_limit, len(reads_refs))
+        log('previewing {} libraries with {} cpus'.format(len(reads_refs), cpus))
+
+        executor = TaskExecutor(self.__class__, self.config, cpus)
+        try:
+            return executor.map('_preview_reads_library',
+                                [(reads_input_object_info, genome_index_base, result_directory,
+                                  option_params) for reads_input_object_info, option_params in
+                                 zip(reads_input_objects_info, option_params_list)])
+        finally:
+            executor.close()
+
+    def _generate_report_preview(self, preview_results, result_directory, workspace_name):
+        """
+        _generate_report_preview: generate summary report for preview runs
+        """
+
+        log('start creating preview report')
+
+        message = 'TopHat2 preview (no alignment saved)\n'
+        for preview_result in preview_results:
+            message += ('\n{reads_ref}: aligned {sampled_reads} of {total_reads} reads, '
+                        '{mapping_rate:.2f}% overall read mapping rate, {junction_count} '
+                        'junctions; estimated full run: {estimated_run_seconds:.0f} seconds, '
+                        '{estimated_disk_bytes} bytes of disk').format(**preview_result)
+
+        output_files = self._generate_output_file_list_sets_library(result_directory)
+
+        report_params = {'message': message,
+                         'workspace_name': workspace_name,
+                         'file_links': output_files,
+                         'report_object_name': 'kb_tophat2_report_' + str(uuid.uuid4())}
+
+        kbase_report_client = KBaseReport(self.callback_url)
+        output = kbase_report_client.create_extended_report(report_params)
+
+        report_output = {'report_name': output['name'], 'report_ref': output['ref']}
+
+        return report_output
 
     def _generate_report_single_library(self, reads_alignment_object_ref, result_directory, 
                                         workspace_name):
@@ -304,8 +1535,14 @@ class TopHatUtil:
         output_files = self._generate_output_file_list_single_library(result_directory)
         output_html_files = self._generate_html_report(reads_alignment_object_ref)
 
+        message = ''
         description = 'Alignment generated by TopHat2'
-        report_params = {'message': '',
+        if not output_files:
+            # a memoized Alignment is reused without running TopHat2 in this job
+            message = ('Reused the Alignment of an earlier TopHat2 run with the same inputs, '
+                       'no TopHat2 output files were generated')
+            description = 'Alignment reused from an earlier TopHat2 run'
+        report_params = {'message': message,
                          'workspace_name': workspace_name,
                          'file_links': output_files,
                          'objects_created': [{'ref': reads_alignment_object_ref,
@@ -381,6 +1618,8 @@ class TopHatUtil:
         """
         _generate_output_file_list_single_library: zip result files and generate file_links 
                                                    for report
+
+        return empty list if the run produced no TopHat2 result (its Alignment was reused)
         """
 
         log('start packing result files')
@@ -389,8 +1628,10 @@ class TopHatUtil:
         result_file = os.path.join(result_directory, 'TopHat2_result.zip')
 
         result_dirs = os.listdir(result_directory)
-        tophat2_result_dir_name = filter(re.compile('tophat2_result_*').match, result_dirs)[0]
-        tophat2_result_dir = os.path.join(result_directory, tophat2_result_dir_name)
+        tophat2_result_dir_names = filter(re.compile('tophat2_result_*').match, result_dirs)
+        if not tophat2_result_dir_names:
+            return output_files
+        tophat2_result_dir = os.path.join(result_directory, tophat2_result_dir_names[0])
 
         with zipfile.ZipFile(result_file, 'w',
                              zipfile.ZIP_DEFLATED,
@@ -477,6 +1718,123 @@ class TopHatUtil:
 
         return refs
 
+    def _make_shared_index_toolkit(self, result_directory):
+        """
+        _make_shared_index_toolkit: makes a TopHat2 toolkit directory whose bowtie2 runs with
+                                    --mm, so concurrent alignments share one memory-mapped
+                                    copy of the index
+
+        TopHat2 has no option to pass --mm through and always runs the bowtie2 found next to
+        the tophat script, so the script is copied next to a wrapper instead.
+        """
+
+        toolkit_path = os.path.join(result_directory, 'tophat2_toolkit_mm')
+        # left behind by the run a resumed run continues
+        shutil.rmtree(toolkit_path, ignore_errors=True)
+        mkdir_p(toolkit_path)
+
+        for program in os.listdir(self.TOPHAT2_TOOLKIT_PATH):
+            if program in ['tophat', 'bowtie2']:
+                continue
+            os.symlink(os.path.join(self.TOPHAT2_TOOLKIT_PATH, program),
+                       os.path.join(toolkit_path, program))
+
+        shutil.copy(os.path.join(self.TOPHAT2_TOOLKIT_PATH, 'tophat'), toolkit_path)
+
+        bowtie2_wrapper = os.path.join(toolkit_path, 'bowtie2')
+        with open(bowtie2_wrapper, 'w') as wrapper_file:
+            wrapper_file.write('#!/bin/sh\n')
+            wrapper_file.write('exec {} --mm "$@"\n'.format(
+                                        os.path.join(self.TOPHAT2_TOOLKIT_PATH, 'bowtie2')))
+        os.chmod(bowtie2_wrapper, 0o755)
+
+        return toolkit_path
+
+    @staticmethod
+    def _prewarm_index(genome_index_file_dir):
+        """
+        _prewarm_index: reads the index files once to pull them into the page cache
+
+        return total size of the index files
+        """
+
+        log('start pre-warming genome index into page cache')
+
+        index_size = 0
+        for file_name in os.listdir(genome_index_file_dir):
+            if not re.search(r'\.bt2l?$', file_name):
+                continue
+            with open(os.path.join(genome_index_file_dir, file_name), 'rb') as index_file:
+                for chunk in iter(lambda: index_file.read(8 * 1024 * 1024), b''):
+                    index_size += len(chunk)
+
+        return index_size
+
+    @staticmethod
+    def _get_available_memory():
+        """
+        _get_available_memory: gets MemAvailable from /proc/meminfo in bytes
+        """
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+
+        return None
+
+    @staticmethod
+    def _get_index_size(genome_index_base):
+        """
+        _get_index_size: total size of the Bowtie2 index files
+        """
+        genome_index_file_dir = os.path.dirname(genome_index_base)
+
+        return sum(os.path.getsize(os.path.join(genome_index_file_dir, file_name))
+                   for file_name in os.listdir(genome_index_file_dir)
+                   if re.search(r'\.bt2l?$', file_name))
+
+    def _get_memory_worker_limit(self, index_size):
+        """
+        _get_memory_worker_limit: number of concurrent tophat runs that fit in memory when
+                                  they all map one shared copy of the index
+        """
+
+        available_memory = self._get_available_memory()
+        if available_memory is None:
+            return multiprocessing.cpu_count()
+
+        workers = (available_memory - index_size) // self.memory_profile.estimate(index_size)
+
+        return max(1, int(workers))
+
+    def _share_index(self, genome_index_base, result_directory, option_params_list):
+        """
+        _share_index: sets up concurrent tophat runs to share one memory-mapped copy of the
+                      index, loaded into page cache once
+
+        return number of concurrent tophat runs that fit in memory
+        """
+        genome_index_file_dir = os.path.dirname(genome_index_base)
+        index_size = self._prewarm_index(genome_index_file_dir)
+        toolkit_path = self._make_shared_index_toolkit(result_directory)
+        for option_params in option_params_list:
+            option_params['toolkit_path'] = toolkit_path
+
+        memory_worker_limit = self._get_memory_worker_limit(index_size)
+        log('memory allows {} concurrent workers sharing a {} byte index'.format(
+                                                            memory_worker_limit, index_size))
+
+        return memory_worker_limit
+
+    def _has_scratch_room_for_prefetch(self):
+        """
+        _has_scratch_room_for_prefetch: whether scratch keeps reads_prefetch_min_free bytes
+                                        free to download reads ahead of alignment
+        """
+        stat = os.statvfs(self.scratch)
+
+        return stat.f_bavail * stat.f_frsize >= self.reads_prefetch_min_free
+
     def _process_set_reads_library(self, input_object_info, genome_index_base, 
                                    result_directory, cli_option_params):
         """
@@ -490,30 +1848,151 @@ class TopHatUtil:
         alignment_set_name = set_object_name + cli_option_params['alignment_set_suffix']
 
         arg_1 = []
-        arg_2 = [genome_index_base] * len(reads_refs)
-        arg_3 = [result_directory] * len(reads_refs)
         arg_4 = []
         conditions = []
-        for reads_ref in reads_refs:
-            reads_input_object_info = self._get_input_object_info(reads_ref['ref'])
+        reads_input_objects_info = self._get_input_objects_info([reads_ref['ref']
+                                                                 for reads_ref in reads_refs])
+        for reads_ref, reads_input_object_info in zip(reads_refs, reads_input_objects_info):
             option_params = cli_option_params.copy()
             option_params['reads_condition'] = reads_ref['condition']
             conditions.append(reads_ref['condition'])
             arg_1.append(reads_input_object_info)
             arg_4.append(option_params)
 
-        cpus = min(cli_option_params.get('num_threads'), multiprocessing.cpu_count())
-        pool = Pool(ncpus=cpus)
+        reads_alignment_object_refs = []
+        for reads_input_object_info, option_params in zip(arg_1, arg_4):
+            journal_key = self._get_journal_key(reads_input_object_info)
+            reads_alignment_object_ref = self._get_journaled_alignment_ref(journal_key)
+            if reads_alignment_object_ref is None:
+                reads_alignment_object_ref = self._get_memoized_alignment(
+                                                        reads_input_object_info, option_params)
+                if reads_alignment_object_ref:
+                    self.run_journal.record(journal_key, 'uploaded',
+                                            alignment_ref=reads_alignment_object_ref)
+            reads_alignment_object_refs.append(reads_alignment_object_ref)
+        pending = [index for index, reads_alignment_object_ref in
+                   enumerate(reads_alignment_object_refs) if reads_alignment_object_ref is None]
+        if len(pending) < len(reads_refs):
+            log('reusing {} Alignments saved before'.format(len(reads_refs) - len(pending)))
+        if not pending:
+            # nothing to align, so no shared index and no workers either
+            return self._save_alignment_set(reads_alignment_object_refs,
+                                            cli_option_params['workspace_name'],
+                                            alignment_set_name, conditions)
+
+        memory_worker_limit = self._share_index(genome_index_base, result_directory, arg_4)
+
+        # num_threads is the core budget shared by all concurrent tophat runs
+        core_budget = min(cli_option_params.get('num_threads') or multiprocessing.cpu_count(),
+                          multiprocessing.cpu_count())
+        cpus = max(1, min(core_budget, memory_worker_limit, len(pending)))
         log('running _process_alignment_object with {} cpus'.format(cpus))
+        executor = TaskExecutor(self.__class__, self.config, cpus)
+
+        footprints = self._estimate_reads_footprints(arg_1)
+        index_size = self._get_index_size(genome_index_base)
+        memory_budget = self._get_available_memory()
+        if memory_budget is not None:
+            # the shared index sits in page cache once, next to the private memory of runs
+            memory_budget -= index_size
+        planner = ResourcePlanner(self._get_scratch_budget(), core_budget=core_budget,
+                                  max_concurrent=cpus, memory_budget=memory_budget)
+        planner.plan([(index, arg_1[index]['info'][1], footprints[index]['disk'],
+                       footprints[index]['reads_size']) for index in pending])
+
+        def admit(library):
+            index, _, _ = library
+            return planner.try_admit(index, footprints[index]['disk'])
+
+        def download(libraries):
+            try:
+                return self._download_journaled_reads_libraries([reads_input_object_info for
+                                                                 _, reads_input_object_info, _
+                                                                 in libraries],
+                                                                result_directory)
+            except Exception:
+                # a failed batch is retried library by library, a single library gives up
+                if len(libraries) == 1:
+                    planner.release(libraries[0][0])
+                raise
 
-        reads_alignment_object_refs = pool.map(self._process_single_reads_library, 
-                                               arg_1, arg_2, arg_3, arg_4)
-
-        for reads_alignment_object_ref in reads_alignment_object_refs:
-            if reads_alignment_object_ref.startswith('ERROR'):
-                error_msg = 'Caught exception in worker\n'
-                error_msg += '{}'.format(reads_alignment_object_ref)
-                raise ValueError(error_msg)
+        def align(library, reads_files):
+            index, reads_input_object_info, option_params = library
+            journal_key = self._get_journal_key(reads_input_object_info)
+            if reads_files is None:
+                tophat_result_dir = self._get_journaled_result_dir(journal_key)
+                log('reusing TopHat2 result {} aligned before'.format(tophat_result_dir))
+                planner.settle(index, self._get_dir_size(tophat_result_dir))
+                return tophat_result_dir
+
+            option_params = self._tune_option_params(reads_input_object_info, option_params)
+            memory_bytes = self.memory_profile.estimate(index_size,
+                                                        option_params.get('read_length'))
+            run_size = footprints[index]['reads_size'] * self.TOPHAT2_DISK_EXPANSION
+            if self.fast_storage.in_memory and self.fast_storage.has_room(run_size):
+                # a run placed on tmpfs keeps its outputs and temp files in memory too
+                memory_bytes += run_size
+            planner.acquire_memory(index, memory_bytes)
+            option_params['num_threads'] = planner.acquire_cores(index)
+            tophat_result_dir = None
+            try:
+                tophat_result_dir = executor.submit(
+                                        '_align_reads_library_task',
+                                        reads_input_object_info['info'][1], genome_index_base,
+                                        reads_files, result_directory, option_params,
+                                        reads_streams=self.reads_streamer.describe(reads_files),
+                                        journal_key=journal_key).get()
+                # the worker aligned reads streamed by the feeders of this process
+                self.reads_streamer.check(reads_files)
+                self.run_journal.record(journal_key, 'aligned',
+                                        tophat_result_dir=tophat_result_dir)
+                return tophat_result_dir
+            finally:
+                self.reads_streamer.close(reads_files)
+                planner.release_cores(index)
+                planner.release_memory(index)
+                if tophat_result_dir:
+                    # aligned reads are no longer needed, make room for the next prefetch
+                    shutil.rmtree(os.path.dirname(reads_files[0]), ignore_errors=True)
+                    planner.settle(index, self._get_dir_size(tophat_result_dir))
+                else:
+                    # reads of a failed library are kept for a resumed run
+                    planner.release(index)
+
+        def upload(library, tophat_result_dir):
+            _, reads_input_object_info, option_params = library
+            return self._upload_reads_library(reads_input_object_info, tophat_result_dir,
+                                              option_params)
+
+        pipeline = ReadsPipeline(download, align, upload, cpus,
+                                 prefetch_depth=self.reads_prefetch_depth,
+                                 batch_size=self.reads_download_batch_size,
+                                 has_room=self._has_scratch_room_for_prefetch,
+                                 admit=admit, cancel_on_error=True,
+                                 on_error=lambda error: executor.cancel())
+        order = [index for index in self._order_reads_libraries(arg_1) if index in pending]
+        # made before the workers start writing their progress files into it
+        progress_dir = os.path.join(result_directory, 'progress')
+        mkdir_p(progress_dir)
+        reporter = SetProgressReporter([(self._get_journal_key(arg_1[index]),
+                                         arg_1[index]['info'][1]) for index in pending],
+                                       self.run_journal, progress_dir, cpus)
+        reporter.start()
+        try:
+            ordered_results = pipeline.run([(index, arg_1[index], arg_4[index])
+                                            for index in order])
+        finally:
+            executor.close()
+            reporter.stop()
+        for index, result in zip(order, ordered_results):
+            reads_alignment_object_refs[index] = result
+
+        errors = [result for result in reads_alignment_object_refs
+                  if isinstance(result, PipelineError)]
+        if errors:
+            # the first failure, the others were cancelled because of it
+            error = sorted(errors, key=lambda error: error.cancelled)[0]
+            raise ValueError('Caught exception in worker\n{}'.format(error))
 
         workspace_name = cli_option_params['workspace_name']
         reads_alignment_set_object_ref = self._save_alignment_set(reads_alignment_object_refs,
@@ -531,12 +2010,105 @@ class TopHatUtil:
         self.scratch = config['scratch']
         self.srv_wiz_url = config['srv-wiz-url']
         self.ws = Workspace(self.ws_url, token=self.token)
+        self.au = AssemblyUtil(self.callback_url)
         self.bt = kb_Bowtie2(self.callback_url)
         self.rau = ReadsAlignmentUtils(self.callback_url)
         self.qualimap = kb_QualiMap(self.callback_url)
         self.ru = ReadsUtils(self.callback_url)
         self.dfu = DataFileUtil(self.callback_url)
+        self.gfu = GenomeFileUtil(self.callback_url)
         self.set_client = SetAPI(self.srv_wiz_url)
+        self.config = config
+        self.run_journal = None
+        self._checked_refs = {}
+        self.failed_runs_dir = config.get('failed-runs-dir')
+
+        index_cache_dir = config.get('index-cache-dir') or os.path.join(self.scratch,
+                                                                        'index_cache')
+        ref_info_cache_dir = config.get('ref-info-cache-dir') or os.path.join(self.scratch,
+                                                                              'ref_info_cache')
+        self.ref_info_cache = RefInfoCache(ref_info_cache_dir)
+        reads_stats_cache_dir = config.get('reads-stats-cache-dir') or os.path.join(
+                                                                self.scratch, 'reads_stats_cache')
+        self.reads_stats_cache = RefInfoCache(reads_stats_cache_dir)
+        alignment_cache_dir = config.get('alignment-cache-dir') or os.path.join(
+                                                                self.scratch, 'alignment_cache')
+        self.alignment_cache = AlignmentCache(alignment_cache_dir)
+        memory_profile_file = config.get('memory-profile-file') or os.path.join(
+                                                        self.scratch, 'tophat2_memory_profile.json')
+        self.memory_profile = MemoryProfile(memory_profile_file, self.TOPHAT2_WORKER_MEMORY)
+        stage_profile_file = config.get('stage-profile-file') or os.path.join(
+                                                        self.scratch, 'tophat2_stage_profile.json')
+        self.stage_history = StageHistory(stage_profile_file)
+        index_cache_quota = float(config.get('index-cache-quota-gb') or 100) * 1024 ** 3
+        index_cache_lock_timeout = float(config.get('index-cache-lock-timeout') or 6 * 3600)
+        self.deinterleave_reads = (config.get('deinterleave-reads') or 'remote').lower()
+        if self.deinterleave_reads not in ['local', 'remote']:
+            raise ValueError('"deinterleave-reads" must be local or remote, was: ' +
+                             self.deinterleave_reads)
+        self.reads_prefetch_depth = int(config.get('reads-prefetch-depth') or 2)
+        self.reads_streamer = ReadsStreamer(self.token)
+        stream_reads_min_size = config.get('stream-reads-min-size-gb')
+        self.stream_reads_min_size = None
+        if stream_reads_min_size:
+            self.stream_reads_min_size = float(stream_reads_min_size) * 1024 ** 3
+        reads_shard_min_size = config.get('reads-shard-min-size-gb')
+        self.reads_shard_min_size = None
+        if reads_shard_min_size:
+            self.reads_shard_min_size = float(reads_shard_min_size) * 1024 ** 3
+        self.reads_download_batch_size = int(config.get('reads-download-batch-size') or 4)
+        self.reads_prefetch_min_free = float(config.get('reads-prefetch-min-free-gb') or
+                                             20) * 1024 ** 3
+        scratch_budget = config.get('scratch-budget-gb')
+        self.scratch_budget = None
+        if scratch_budget:
+            self.scratch_budget = float(scratch_budget) * 1024 ** 3
+        fast_storage_reserve = float(config.get('fast-storage-reserve-gb') or 1) * 1024 ** 3
+        self.fast_storage = FastStorage(config.get('fast-storage-dir'), fast_storage_reserve)
+        self.local_index_build_min_size = int(config.get('local-index-build-min-size') or
+                                              100000000)
+        self.index_catalog = IndexCatalog(bowtie2_version=self._get_bowtie2_version())
+        self.index_cache = IndexCache(index_cache_dir, index_cache_quota,
+                                      lock_timeout=index_cache_lock_timeout,
+                                      catalog=self.index_catalog)
+
+    def _get_resume_directory(self, resume_from):
+        """
+        _get_resume_directory: result directory of the journaled run to resume
+        """
+        run_name = os.path.basename(os.path.normpath(resume_from))
+        result_directory = os.path.join(self.scratch, run_name)
+        if not RunJournal(result_directory).exists() and self.failed_runs_dir:
+            # the run failed in an earlier job, the journal paths point into the scratch,
+            # which is mounted at the same path in every job
+            kept_directory = os.path.join(self.failed_runs_dir, run_name)
+            if RunJournal(kept_directory).exists():
+                log('restoring failed run from {}'.format(kept_directory))
+                shutil.move(kept_directory, result_directory)
+        if not RunJournal(result_directory).exists():
+            raise ValueError('"resume_from" must be the result directory of a journaled run, '
+                             'found no run journal in: {}'.format(result_directory))
+
+        return result_directory
+
+    def _keep_failed_run(self, result_directory):
+        """
+        _keep_failed_run: move the result directory of a failed journaled run out of the job
+                          scratch, so that a later job can resume it
+        """
+        if not (self.run_journal and self.failed_runs_dir):
+            return
+
+        kept_directory = os.path.join(self.failed_runs_dir, os.path.basename(result_directory))
+        try:
+            mkdir_p(self.failed_runs_dir)
+            shutil.rmtree(kept_directory, ignore_errors=True)
+            shutil.move(result_directory, kept_directory)
+            log('kept failed run in {}, pass {} as resume_from to resume the run'.format(
+                                            kept_directory, os.path.basename(result_directory)))
+        except Exception:
+            log('failed to keep failed run {}:\n{}'.format(
+                                                result_directory, traceback.format_exc()))
 
     def run_tophat2_app(self, params):
         """
@@ -565,12 +2137,24 @@ class TopHatUtil:
         library_type: library type (fr-unstranded, fr-firststrand, fr-secondstrand)
         preset_options: alignment preset options (b2-very-fast, b2-fast, b2-sensitive, 
                                                   b2-very-sensitive)
+        use_transcriptome_index: align against a transcriptome index built from the Genome
+                                 annotation (ignored for Assembly and ContigSet)
+        preview_fraction: preview mode, align only this fraction of each reads library and
+                          report mapping statistics and full run estimates instead of saving
+                          alignments
+        preview_reads: preview mode, align at most this many reads (pairs) of each library
+        resume_from: result directory (or its name) of an earlier run with the same params to
+                     resume, reusing the reads libraries it downloaded, aligned and saved;
+                     runs of earlier jobs are found in failed-runs-dir
+        force: realign reads libraries an earlier run aligned from the same inputs, instead of
+               reusing its Alignments
 
         return:
         result_directory: folder path that holds all files generated by run_tophat2_app
         reads_alignment_object_ref: generated Alignment/AlignmentSet object reference
         report_name: report name generated by KBaseReport
         report_ref: report reference generated by KBaseReport
+        preview_results: preview statistics of each reads library (preview mode only)
         """
 
         log('--->\nrunning TopHatUtil.run_tophat2_app\n' +
@@ -578,47 +2162,90 @@ class TopHatUtil:
 
         self._validate_run_tophat2_app_params(params)
 
-        result_directory = os.path.join(self.scratch, str(uuid.uuid4()))
-        self._mkdir_p(result_directory)
-
-        genome_index_file_dir = self._get_bowtie_index(result_directory, 
-                                                       params.get('assembly_or_genome_ref'),
-                                                       params.get('workspace_name'))
-        genome_index_files = os.listdir(genome_index_file_dir)
-
-        log('generated genome index files: {}'.format(genome_index_files))
-        genome_index_base = ""
-        for index_file in genome_index_files:
-            match = re.match('(.*)\.(rev\.)?\d\.\w+', index_file)
-            # should match Bdistachyon_v3.1.assembly.3.bt2 or Bdistachyon_v3.1.assembly.rev.1.bt2
-            # but not bowtie2_index_153005139683.tar.gz
-            # and return Bdistachyon_v3.1.assembly as group 1
-            if match:
-                genome_index_base = genome_index_file_dir + '/' + match.group(1)
-                break
-
-        if not genome_index_base:
-            # this prefix is a required TopHat parameter
-            raise RuntimeError("Unable to parse Bowtie index files")
+        if params.get('resume_from'):
+            result_directory = self._get_resume_directory(params.get('resume_from'))
+        else:
+            result_directory = os.path.join(self.scratch, str(uuid.uuid4()))
+            mkdir_p(result_directory)
 
-        input_object_info = self._get_input_object_info(params.get('input_ref'))
+        self.run_journal = None
+        if not (params.get('preview_fraction') or params.get('preview_reads')):
+            self.run_journal = RunJournal(result_directory)
+            self.run_journal.start(params)
+            log('journaling run in {}, pass it as resume_from to resume the run'.format(
+                                                                            result_directory))
 
-        if input_object_info['run_mode'] == 'single_library':
-            reads_alignment_object_ref = self._process_single_reads_library(input_object_info, 
-                                                                            genome_index_base,
-                                                                            result_directory,
-                                                                            params)
-            report_output = self._generate_report_single_library(reads_alignment_object_ref,
-                                                                 result_directory,
-                                                                 params.get('workspace_name'))
-        elif input_object_info['run_mode'] == 'sample_set':
-            reads_alignment_object_ref = self._process_set_reads_library(input_object_info,
-                                                                         genome_index_base,
-                                                                         result_directory,
-                                                                         params)
-            report_output = self._generate_report_sets_library(reads_alignment_object_ref,
-                                                               result_directory,
-                                                               params.get('workspace_name'))
+        run_failed = False
+        try:
+            genome_index_file_dir = self._get_bowtie_index(result_directory,
+                                                           params.get('assembly_or_genome_ref'),
+                                                           params.get('workspace_name'))
+            index_manifest = self.index_catalog.read_manifest(genome_index_file_dir)
+
+            log('using genome index files: {}'.format(sorted(index_manifest['files'].keys())))
+            genome_index_file_dir = self.fast_storage.stage_dir(genome_index_file_dir,
+                                                                'bowtie2_index')
+            genome_index_base = os.path.join(genome_index_file_dir, index_manifest['base_name'])
+
+            if params.get('use_transcriptome_index'):
+                transcriptome_index_base = self._get_transcriptome_index(
+                                                        result_directory,
+                                                        params.get('assembly_or_genome_ref'),
+                                                        genome_index_base)
+                if transcriptome_index_base:
+                    transcriptome_index_dir = self.fast_storage.stage_dir(
+                                                    os.path.dirname(transcriptome_index_base),
+                                                    'transcriptome_index')
+                    transcriptome_index_base = os.path.join(
+                                                    transcriptome_index_dir,
+                                                    os.path.basename(transcriptome_index_base))
+                params['transcriptome_index_base'] = transcriptome_index_base
+
+            input_object_info = self._get_input_object_info(params.get('input_ref'))
+
+            if params.get('preview_fraction') or params.get('preview_reads'):
+                preview_results = self._preview_reads_libraries(input_object_info,
+                                                                genome_index_base,
+                                                                result_directory,
+                                                                params)
+                report_output = self._generate_report_preview(preview_results,
+                                                              result_directory,
+                                                              params.get('workspace_name'))
+                returnVal = {'result_directory': result_directory,
+                             'preview_results': preview_results}
+                returnVal.update(report_output)
+
+                return returnVal
+
+            if input_object_info['run_mode'] == 'single_library':
+                reads_alignment_object_ref = self._process_single_reads_library(
+                                                                        input_object_info,
+                                                                        genome_index_base,
+                                                                        result_directory,
+                                                                        params)
+                report_output = self._generate_report_single_library(
+                                                                reads_alignment_object_ref,
+                                                                result_directory,
+                                                                params.get('workspace_name'))
+            elif input_object_info['run_mode'] == 'sample_set':
+                reads_alignment_object_ref = self._process_set_reads_library(input_object_info,
+                                                                             genome_index_base,
+                                                                             result_directory,
+                                                                             params)
+                report_output = self._generate_report_sets_library(
+                                                                reads_alignment_object_ref,
+                                                                result_directory,
+                                                                params.get('workspace_name'))
+        except Exception:
+            run_failed = True
+            raise
+        finally:
+            self.index_cache.log_stats()
+            self.index_cache.release()
+            self.reads_streamer.close()
+            self.fast_storage.cleanup()
+            if run_failed:
+                self._keep_failed_run(result_directory)
 
         returnVal = {'result_directory': result_directory,
                      'reads_alignment_object_ref': reads_alignment_object_ref}
@@ -626,3 +2253,85 @@ class TopHatUtil:
         returnVal.update(report_output)
 
         return returnVal
+
+    def _prefetch_single_reference(self, ref, staging_directory, workspace_name,
+                                   include_transcriptome_index):
+        """
+        _prefetch_single_reference: populate the index cache for one ref and report its status
+        """
+
+        reference_status = {'ref': ref,
+                            'bowtie2_index_status': 'failed',
+                            'transcriptome_index_status': 'skipped'}
+        try:
+            reference_status['index_key'] = self._get_index_key(ref)
+
+            misses = self.index_cache.misses
+            genome_index_file_dir = self._get_bowtie_index(staging_directory, ref,
+                                                           workspace_name)
+            fetched = self.index_cache.misses > misses
+            reference_status['bowtie2_index_status'] = 'fetched' if fetched else 'cached'
+
+            if include_transcriptome_index:
+                index_manifest = self.index_catalog.read_manifest(genome_index_file_dir)
+                genome_index_base = os.path.join(genome_index_file_dir,
+                                                 index_manifest['base_name'])
+                reference_status['transcriptome_index_status'] = 'failed'
+                misses = self.index_cache.misses
+                transcriptome_index_base = self._get_transcriptome_index(staging_directory,
+                                                                         ref,
+                                                                         genome_index_base)
+                if transcriptome_index_base is None:
+                    reference_status['transcriptome_index_status'] = 'skipped'
+                else:
+                    fetched = self.index_cache.misses > misses
+                    reference_status['transcriptome_index_status'] = ('fetched' if fetched
+                                                                      else 'cached')
+        except Exception as e:
+            log('failed to prefetch indexes for {}:\n{}'.format(ref, traceback.format_exc()))
+            reference_status['error'] = str(e)
+
+        log('prefetch status of {}: {}'.format(ref, reference_status))
+
+        return reference_status
+
+    def prefetch_reference(self, params):
+        """
+        prefetch_reference: populate the node-local index cache ahead of alignment jobs
+
+        required params:
+        refs: refs to Assembly, ContigSet, or Genome objects to prefetch indexes for
+
+        optional params:
+        workspace_name: workspace in which kb_Bowtie2 may cache the indexes it generates
+        include_transcriptome_index: also build the transcriptome index for Genome refs
+
+        return:
+        reference_status: cache status of each ref, in the order given
+        """
+
+        log('--->\nrunning TopHatUtil.prefetch_reference\n' +
+            'params:\n{}'.format(json.dumps(params, indent=1)))
+
+        self._validate_prefetch_reference_params(params)
+
+        # indexes are generated under scratch and moved into the cache, only links remain here
+        staging_directory = os.path.join(self.scratch, 'prefetch_' + str(uuid.uuid4()))
+        mkdir_p(staging_directory)
+
+        reference_status = []
+        try:
+            for ref in params.get('refs'):
+                reference_status.append(self._prefetch_single_reference(
+                                                    ref, staging_directory,
+                                                    params.get('workspace_name'),
+                                                    params.get('include_transcriptome_index')))
+                # nothing here uses the indexes of a prefetched ref, so the next refs may
+                # evict them once the quota is reached
+                self.index_cache.release()
+        finally:
+            self.index_cache.log_stats()
+            self.index_cache.release()
+            shutil.rmtree(staging_directory, ignore_errors=True)
+
+        return {'reference_status': reference_status}
@@ -139,6 +139,11 @@ TopHatInput is a reference to a hash where the following keys are defined:
 	no_coverage_search has a value which is a kb_tophat2.boolean
 	library_type has a value which is a string
 	preset_options has a value which is a string
+	use_transcriptome_index has a value which is a kb_tophat2.boolean
+	preview_fraction has a value which is a float
+	preview_reads has a value which is an int
+	resume_from has a value which is a string
+	force has a value which is a kb_tophat2.boolean
 obj_ref is a string
 boolean is an int
 TopHatResult is a reference to a hash where the following keys are defined:
@@ -146,6 +151,17 @@ TopHatResult is a reference to a hash where the following keys are defined:
 	reads_alignment_object_ref has a value which is a kb_tophat2.obj_ref
 	report_name has a value which is a string
 	report_ref has a value which is a string
+	preview_results has a value which is a reference to a list where each element is a kb_tophat2.PreviewResult
+PreviewResult is a reference to a hash where the following keys are defined:
+	reads_ref has a value which is a kb_tophat2.obj_ref
+	total_reads has a value which is an int
+	sampled_reads has a value which is an int
+	mapped_reads has a value which is an int
+	mapping_rate has a value which is a float
+	junction_count has a value which is an int
+	preview_seconds has a value which is a float
+	estimated_run_seconds has a value which is a float
+	estimated_disk_bytes has a value which is an int
 
 </pre>
 
@@ -173,6 +189,11 @@ TopHatInput is a reference to a hash where the following keys are defined:
 	no_coverage_search has a value which is a kb_tophat2.boolean
 	library_type has a value which is a string
 	preset_options has a value which is a string
+	use_transcriptome_index has a value which is a kb_tophat2.boolean
+	preview_fraction has a value which is a float
+	preview_reads has a value which is an int
+	resume_from has a value which is a string
+	force has a value which is a kb_tophat2.boolean
 obj_ref is a string
 boolean is an int
 TopHatResult is a reference to a hash where the following keys are defined:
@@ -180,6 +201,17 @@ TopHatResult is a reference to a hash where the following keys are defined:
 	reads_alignment_object_ref has a value which is a kb_tophat2.obj_ref
 	report_name has a value which is a string
 	report_ref has a value which is a string
+	preview_results has a value which is a reference to a list where each element is a kb_tophat2.PreviewResult
+PreviewResult is a reference to a hash where the following keys are defined:
+	reads_ref has a value which is a kb_tophat2.obj_ref
+	total_reads has a value which is an int
+	sampled_reads has a value which is an int
+	mapped_reads has a value which is an int
+	mapping_rate has a value which is a float
+	junction_count has a value which is an int
+	preview_seconds has a value which is a float
+	estimated_run_seconds has a value which is a float
+	estimated_disk_bytes has a value which is an int
 
 
 =end text
@@ -240,6 +272,115 @@ ref: https://ccb.jhu.edu/software/tophat/manual.shtml
     }
 }
  
+
+=head2 prefetch_reference
+
+  $returnVal = $obj->prefetch_reference($params)
+
+=over 4
+
+=item Parameter and return types
+
+=begin html
+
+<pre>
+$params is a kb_tophat2.PrefetchReferenceInput
+$returnVal is a kb_tophat2.PrefetchReferenceResult
+PrefetchReferenceInput is a reference to a hash where the following keys are defined:
+	refs has a value which is a reference to a list where each element is a kb_tophat2.obj_ref
+	workspace_name has a value which is a string
+	include_transcriptome_index has a value which is a kb_tophat2.boolean
+obj_ref is a string
+boolean is an int
+PrefetchReferenceResult is a reference to a hash where the following keys are defined:
+	reference_status has a value which is a reference to a list where each element is a kb_tophat2.ReferenceCacheStatus
+ReferenceCacheStatus is a reference to a hash where the following keys are defined:
+	ref has a value which is a kb_tophat2.obj_ref
+	index_key has a value which is a string
+	bowtie2_index_status has a value which is a string
+	transcriptome_index_status has a value which is a string
+	error has a value which is a string
+
+</pre>
+
+=end html
+
+=begin text
+
+$params is a kb_tophat2.PrefetchReferenceInput
+$returnVal is a kb_tophat2.PrefetchReferenceResult
+PrefetchReferenceInput is a reference to a hash where the following keys are defined:
+	refs has a value which is a reference to a list where each element is a kb_tophat2.obj_ref
+	workspace_name has a value which is a string
+	include_transcriptome_index has a value which is a kb_tophat2.boolean
+obj_ref is a string
+boolean is an int
+PrefetchReferenceResult is a reference to a hash where the following keys are defined:
+	reference_status has a value which is a reference to a list where each element is a kb_tophat2.ReferenceCacheStatus
+ReferenceCacheStatus is a reference to a hash where the following keys are defined:
+	ref has a value which is a kb_tophat2.obj_ref
+	index_key has a value which is a string
+	bowtie2_index_status has a value which is a string
+	transcriptome_index_status has a value which is a string
+	error has a value which is a string
+
+
+=end text
+
+=item Description
+
+prefetch_reference: populate the node-local index cache ahead of alignment jobs
+
+=back
+
+=cut
+
+ sub prefetch_reference
+{
+    my($self, @args) = @_;
+
+# Authentication: required
+
+    if ((my $n = @args) != 1)
+    {
+	Bio::KBase::Exceptions::ArgumentValidationError->throw(error =>
+							       "Invalid argument count for function prefetch_reference (received $n, expecting 1)");
+    }
+    {
+	my($params) = @args;
+
+	my @_bad_arguments;
+        (ref($params) eq 'HASH') or push(@_bad_arguments, "Invalid type for argument 1 \"params\" (value was \"$params\")");
+        if (@_bad_arguments) {
+	    my $msg = "Invalid arguments passed to prefetch_reference:\n" . join("", map { "\t$_\n" } @_bad_arguments);
+	    Bio::KBase::Exceptions::ArgumentValidationError->throw(error => $msg,
+								   method_name => 'prefetch_reference');
+	}
+    }
+
+    my $url = $self->{url};
+    my $result = $self->{client}->call($url, $self->{headers}, {
+	    method => "kb_tophat2.prefetch_reference",
+	    params => \@args,
+    });
+    if ($result) {
+	if ($result->is_error) {
+	    Bio::KBase::Exceptions::JSONRPC->throw(error => $result->error_message,
+					       code => $result->content->{error}->{code},
+					       method_name => 'prefetch_reference',
+					       data => $result->content->{error}->{error} # JSON::RPC::ReturnObject only supports JSONRPC 1.1 or 1.O
+					      );
+	} else {
+	    return wantarray ? @{$result->result} : $result->result->[0];
+	}
+    } else {
+        Bio::KBase::Exceptions::HTTP->throw(error => "Error invoking method prefetch_reference",
+					    status_line => $self->{client}->status_line,
+					    method_name => 'prefetch_reference',
+				       );
+    }
+}
+ 
   
 sub status
 {
@@ -283,16 +424,16 @@ sub version {
             Bio::KBase::Exceptions::JSONRPC->throw(
                 error => $result->error_message,
                 code => $result->content->{code},
-                method_name => 'run_tophat2_app',
+                method_name => 'prefetch_reference',
             );
         } else {
             return wantarray ? @{$result->result} : $result->result->[0];
         }
     } else {
         Bio::KBase::Exceptions::HTTP->throw(
-            error => "Error invoking method run_tophat2_app",
+            error => "Error invoking method prefetch_reference",
             status_line => $self->{client}->status_line,
-            method_name => 'run_tophat2_app',
+            method_name => 'prefetch_reference',
         );
     }
 }
@@ -420,6 +561,16 @@ report_secondary_alignments: use this option to output secondary alignments
 no_coverage_search: use this option to disable the coverage-based search for junctions
 library_type: library type (fr-unstranded, fr-firststrand, fr-secondstrand)
 preset_options: alignment preset options (b2-very-fast, b2-fast, b2-sensitive, b2-very-sensitive)
+use_transcriptome_index: align against a transcriptome index built from the Genome
+                         annotation (ignored for Assembly and ContigSet)
+preview_fraction: preview mode, align only this fraction of each reads library and
+                  report mapping statistics and full run estimates instead of saving
+                  alignments
+preview_reads: preview mode, align at most this many reads (pairs) of each library
+resume_from: result directory (or its name) of an earlier run with the same params to
+             resume, reusing the reads libraries it downloaded, aligned and saved
+force: realign reads libraries an earlier run aligned from the same inputs, instead of
+       reusing its Alignments
 
 ref: https://ccb.jhu.edu/software/tophat/manual.shtml
 
@@ -447,6 +598,11 @@ report_secondary_alignments has a value which is a kb_tophat2.boolean
 no_coverage_search has a value which is a kb_tophat2.boolean
 library_type has a value which is a string
 preset_options has a value which is a string
+use_transcriptome_index has a value which is a kb_tophat2.boolean
+preview_fraction has a value which is a float
+preview_reads has a value which is an int
+resume_from has a value which is a string
+force has a value which is a kb_tophat2.boolean
 
 </pre>
 
@@ -472,6 +628,70 @@ report_secondary_alignments has a value which is a kb_tophat2.boolean
 no_coverage_search has a value which is a kb_tophat2.boolean
 library_type has a value which is a string
 preset_options has a value which is a string
+use_transcriptome_index has a value which is a kb_tophat2.boolean
+preview_fraction has a value which is a float
+preview_reads has a value which is an int
+resume_from has a value which is a string
+force has a value which is a kb_tophat2.boolean
+
+
+=end text
+
+=back
+
+
+
+=head2 PreviewResult
+
+=over 4
+
+
+
+=item Description
+
+reads_ref: reads library reference
+total_reads: number of reads (pairs) in the library
+sampled_reads: number of reads (pairs) aligned in the preview
+mapped_reads: number of aligned reads, counting each mate
+mapping_rate: overall read mapping rate of the preview (percent)
+junction_count: number of junctions found in the preview
+preview_seconds: wall time of the preview alignment
+estimated_run_seconds: extrapolated wall time of aligning the whole library
+estimated_disk_bytes: extrapolated scratch usage of aligning the whole library
+
+
+=item Definition
+
+=begin html
+
+<pre>
+a reference to a hash where the following keys are defined:
+reads_ref has a value which is a kb_tophat2.obj_ref
+total_reads has a value which is an int
+sampled_reads has a value which is an int
+mapped_reads has a value which is an int
+mapping_rate has a value which is a float
+junction_count has a value which is an int
+preview_seconds has a value which is a float
+estimated_run_seconds has a value which is a float
+estimated_disk_bytes has a value which is an int
+
+</pre>
+
+=end html
+
+=begin text
+
+a reference to a hash where the following keys are defined:
+reads_ref has a value which is a kb_tophat2.obj_ref
+total_reads has a value which is an int
+sampled_reads has a value which is an int
+mapped_reads has a value which is an int
+mapping_rate has a value which is a float
+junction_count has a value which is an int
+preview_seconds has a value which is a float
+estimated_run_seconds has a value which is a float
+estimated_disk_bytes has a value which is an int
 
 
 =end text
@@ -492,6 +712,8 @@ result_directory: folder path that holds all files generated by run_tophat2_app
 reads_alignment_object_ref: generated Alignment/AlignmentSet object reference
 report_name: report name generated by KBaseReport
 report_ref: report reference generated by KBaseReport
+preview_results: preview statistics of each reads library (preview mode only, no
+                 alignment is saved then)
 
 
 =item Definition
@@ -504,6 +726,7 @@ result_directory has a value which is a string
 reads_alignment_object_ref has a value which is a kb_tophat2.obj_ref
 report_name has a value which is a string
 report_ref has a value which is a string
+preview_results has a value which is a reference to a list where each element is a kb_tophat2.PreviewResult
 
 </pre>
 
@@ -516,6 +739,132 @@ result_directory has a value which is a string
 reads_alignment_object_ref has a value which is a kb_tophat2.obj_ref
 report_name has a value which is a string
 report_ref has a value which is a string
+preview_results has a value which is a reference to a list where each element is a kb_tophat2.PreviewResult
+
+
+=end text
+
+=back
+
+=head2 PrefetchReferenceInput
+
+=over 4
+
+
+
+=item Description
+
+required params:
+refs: refs to Assembly, ContigSet, or Genome objects to prefetch indexes for
+
+optional params:
+workspace_name: workspace in which kb_Bowtie2 may cache the indexes it generates
+include_transcriptome_index: also build the transcriptome index for Genome refs
+
+
+=item Definition
+
+=begin html
+
+<pre>
+a reference to a hash where the following keys are defined:
+refs has a value which is a reference to a list where each element is a kb_tophat2.obj_ref
+workspace_name has a value which is a string
+include_transcriptome_index has a value which is a kb_tophat2.boolean
+
+</pre>
+
+=end html
+
+=begin text
+
+a reference to a hash where the following keys are defined:
+refs has a value which is a reference to a list where each element is a kb_tophat2.obj_ref
+workspace_name has a value which is a string
+include_transcriptome_index has a value which is a kb_tophat2.boolean
+
+
+=end text
+
+=back
+
+
+
+=head2 ReferenceCacheStatus
+
+=over 4
+
+
+
+=item Description
+
+ref: ref as given in refs
+index_key: key of the index in the node-local index cache
+bowtie2_index_status: one of 'cached' (already on the node), 'fetched' or 'failed'
+transcriptome_index_status: as bowtie2_index_status, or 'skipped' when not requested
+                            or ref is not a Genome
+error: error message if any index failed
+
+
+=item Definition
+
+=begin html
+
+<pre>
+a reference to a hash where the following keys are defined:
+ref has a value which is a kb_tophat2.obj_ref
+index_key has a value which is a string
+bowtie2_index_status has a value which is a string
+transcriptome_index_status has a value which is a string
+error has a value which is a string
+
+</pre>
+
+=end html
+
+=begin text
+
+a reference to a hash where the following keys are defined:
+ref has a value which is a kb_tophat2.obj_ref
+index_key has a value which is a string
+bowtie2_index_status has a value which is a string
+transcriptome_index_status has a value which is a string
+error has a value which is a string
+
+
+=end text
+
+=back
+
+
+
+=head2 PrefetchReferenceResult
+
+=over 4
+
+
+
+=item Description
+
+reference_status: cache status of each ref, in the order given
+
+
+=item Definition
+
+=begin html
+
+<pre>
+a reference to a hash where the following keys are defined:
+reference_status has a value which is a reference to a list where each element is a kb_tophat2.ReferenceCacheStatus
+
+</pre>
+
+=end html
+
+=begin text
+
+a reference to a hash where the following keys are defined:
+reference_status has a value which is a reference to a list where each element is a kb_tophat2.ReferenceCacheStatus
 
 
 =end text
@@ -524,6 +873,7 @@ report_ref has a value which is a string
 
 
 
+
 =cut
 
 package kb_tophat2::kb_tophat2Client::RpcClient;
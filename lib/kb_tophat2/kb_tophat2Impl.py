@@ -61,12 +61,21 @@ class kb_tophat2:
            coverage-based search for junctions library_type: library type
            (fr-unstranded, fr-firststrand, fr-secondstrand) preset_options:
            alignment preset options (b2-very-fast, b2-fast, b2-sensitive,
-           b2-very-sensitive) ref:
-           https://ccb.jhu.edu/software/tophat/manual.shtml) -> structure:
-           parameter "input_ref" of type "obj_ref" (An X/Y/Z style
-           reference), parameter "assembly_or_genome_ref" of type "obj_ref"
-           (An X/Y/Z style reference), parameter "workspace_name" of String,
-           parameter "alignment_set_suffix" of String, parameter
+           b2-very-sensitive) use_transcriptome_index: align against a
+           transcriptome index built from the Genome annotation (ignored for
+           Assembly and ContigSet) preview_fraction: preview mode, align only
+           this fraction of each reads library and report mapping statistics
+           and full run estimates instead of saving alignments preview_reads:
+           preview mode, align at most this many reads (pairs) of each
+           library resume_from: result directory (or its name) of an earlier
+           run with the same params to resume, reusing the reads libraries it
+           downloaded, aligned and saved force: realign reads libraries an
+           earlier run aligned from the same inputs, instead of reusing its
+           Alignments ref: https://ccb.jhu.edu/software/tophat/manual.shtml)
+           -> structure: parameter "input_ref" of type "obj_ref" (An X/Y/Z
+           style reference), parameter "assembly_or_genome_ref" of type
+           "obj_ref" (An X/Y/Z style reference), parameter "workspace_name"
+           of String, parameter "alignment_set_suffix" of String, parameter
            "alignment_suffix" of String, parameter "reads_condition" of
            String, parameter "num_threads" of Long, parameter
            "read_mismatches" of Long, parameter "read_gap_length" of Long,
@@ -77,16 +86,39 @@ class kb_tophat2:
            false, 1 for true. @range (0, 1)), parameter "no_coverage_search"
            of type "boolean" (A boolean - 0 for false, 1 for true. @range (0,
            1)), parameter "library_type" of String, parameter
-           "preset_options" of String
+           "preset_options" of String, parameter "use_transcriptome_index" of
+           type "boolean" (A boolean - 0 for false, 1 for true. @range (0,
+           1)), parameter "preview_fraction" of Double, parameter
+           "preview_reads" of Long, parameter "resume_from" of String,
+           parameter "force" of type "boolean" (A boolean - 0 for false, 1
+           for true. @range (0, 1))
         :returns: instance of type "TopHatResult" (result_directory: folder
            path that holds all files generated by run_tophat2_app
            reads_alignment_object_ref: generated Alignment/AlignmentSet
            object reference report_name: report name generated by KBaseReport
-           report_ref: report reference generated by KBaseReport) ->
-           structure: parameter "result_directory" of String, parameter
+           report_ref: report reference generated by KBaseReport
+           preview_results: preview statistics of each reads library (preview
+           mode only, no alignment is saved then)) -> structure: parameter
+           "result_directory" of String, parameter
            "reads_alignment_object_ref" of type "obj_ref" (An X/Y/Z style
            reference), parameter "report_name" of String, parameter
-           "report_ref" of String
+           "report_ref" of String, parameter "preview_results" of list of
+           type "PreviewResult" (reads_ref: reads library reference
+           total_reads: number of reads (pairs) in the library sampled_reads:
+           number of reads (pairs) aligned in the preview mapped_reads:
+           number of aligned reads, counting each mate mapping_rate: overall
+           read mapping rate of the preview (percent) junction_count: number
+           of junctions found in the preview preview_seconds: wall time of
+           the preview alignment estimated_run_seconds: extrapolated wall
+           time of aligning the whole library estimated_disk_bytes:
+           extrapolated scratch usage of aligning the whole library) ->
+           structure: parameter "reads_ref" of type "obj_ref" (An X/Y/Z style
+           reference), parameter "total_reads" of Long, parameter
+           "sampled_reads" of Long, parameter "mapped_reads" of Long,
+           parameter "mapping_rate" of Double, parameter "junction_count" of
+           Long, parameter "preview_seconds" of Double, parameter
+           "estimated_run_seconds" of Double, parameter
+           "estimated_disk_bytes" of Long
         """
         # ctx is the context object
         # return variables are: returnVal
@@ -108,6 +140,49 @@ class kb_tophat2:
                              'returnVal is not type dict as required.')
         # return the results
         return [returnVal]
+
+    def prefetch_reference(self, ctx, params):
+        """
+        prefetch_reference: populate the node-local index cache ahead of alignment jobs
+        :param params: instance of type "PrefetchReferenceInput" (required
+           params: refs: refs to Assembly, ContigSet, or Genome objects to
+           prefetch indexes for optional params: workspace_name: workspace in
+           which kb_Bowtie2 may cache the indexes it generates
+           include_transcriptome_index: also build the transcriptome index
+           for Genome refs) -> structure: parameter "refs" of list of type
+           "obj_ref" (An X/Y/Z style reference), parameter "workspace_name"
+           of String, parameter "include_transcriptome_index" of type
+           "boolean" (A boolean - 0 for false, 1 for true. @range (0, 1))
+        :returns: instance of type "PrefetchReferenceResult"
+           (reference_status: cache status of each ref, in the order given)
+           -> structure: parameter "reference_status" of list of type
+           "ReferenceCacheStatus" (ref: ref as given in refs index_key: key
+           of the index in the node-local index cache bowtie2_index_status:
+           one of 'cached' (already on the node), 'fetched' or 'failed'
+           transcriptome_index_status: as bowtie2_index_status, or 'skipped'
+           when not requested or ref is not a Genome error: error message if
+           any index failed) -> structure: parameter "ref" of type "obj_ref"
+           (An X/Y/Z style reference), parameter "index_key" of String,
+           parameter "bowtie2_index_status" of String, parameter
+           "transcriptome_index_status" of String, parameter "error" of
+           String
+        """
+        # ctx is the context object
+        # return variables are: returnVal
+        #BEGIN prefetch_reference
+        print '--->\nRunning kb_tophat2.prefetch_reference\nparams:'
+        print json.dumps(params, indent=1)
+
+        tophat_runner = TopHatUtil(self.config)
+        returnVal = tophat_runner.prefetch_reference(params)
+        #END prefetch_reference
+
+        # At some point might do deeper type checking...
+        if not isinstance(returnVal, dict):
+            raise ValueError('Method prefetch_reference return value ' +
+                             'returnVal is not type dict as required.')
+        # return the results
+        return [returnVal]
     def status(self, ctx):
         #BEGIN_STATUS
         returnVal = {'state': "OK",
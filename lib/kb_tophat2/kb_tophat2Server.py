@@ -337,6 +337,10 @@ class Application(object):
                              name='kb_tophat2.run_tophat2_app',
                              types=[dict])
         self.method_authentication['kb_tophat2.run_tophat2_app'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_tophat2.prefetch_reference,
+                             name='kb_tophat2.prefetch_reference',
+                             types=[dict])
+        self.method_authentication['kb_tophat2.prefetch_reference'] = 'required'  # noqa
         self.rpc_service.add(impl_kb_tophat2.status,
                              name='kb_tophat2.status',
                              types=[dict])
@@ -181,6 +181,24 @@ public class KbTophat2Client {
         return res.get(0);
     }
 
+    /**
+     * <p>Original spec-file function name: prefetch_reference</p>
+     * <pre>
+     * prefetch_reference: populate the node-local index cache ahead of alignment jobs
+     * </pre>
+     * @param   params   instance of type {@link us.kbase.kbtophat2.PrefetchReferenceInput PrefetchReferenceInput}
+     * @return   parameter "returnVal" of type {@link us.kbase.kbtophat2.PrefetchReferenceResult PrefetchReferenceResult}
+     * @throws IOException if an IO exception occurs
+     * @throws JsonClientException if a JSON RPC exception occurs
+     */
+    public PrefetchReferenceResult prefetchReference(PrefetchReferenceInput params, RpcContext... jsonRpcContext) throws IOException, JsonClientException {
+        List<Object> args = new ArrayList<Object>();
+        args.add(params);
+        TypeReference<List<PrefetchReferenceResult>> retType = new TypeReference<List<PrefetchReferenceResult>>() {};
+        List<PrefetchReferenceResult> res = caller.jsonrpcCall("kb_tophat2.prefetch_reference", args, retType, true, true, jsonRpcContext, this.serviceVersion);
+        return res.get(0);
+    }
+
     public Map<String, Object> status(RpcContext... jsonRpcContext) throws IOException, JsonClientException {
         List<Object> args = new ArrayList<Object>();
         TypeReference<List<Map<String, Object>>> retType = new TypeReference<List<Map<String, Object>>>() {};
@@ -0,0 +1,103 @@
+
+package us.kbase.kbtophat2;
+
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+import javax.annotation.Generated;
+import com.fasterxml.jackson.annotation.JsonAnyGetter;
+import com.fasterxml.jackson.annotation.JsonAnySetter;
+import com.fasterxml.jackson.annotation.JsonInclude;
+import com.fasterxml.jackson.annotation.JsonProperty;
+import com.fasterxml.jackson.annotation.JsonPropertyOrder;
+
+
+/**
+ * <p>Original spec-file type: PrefetchReferenceInput</p>
+ * <pre>
+ * required params:
+ * refs: refs to Assembly, ContigSet, or Genome objects to prefetch indexes for
+ * optional params:
+ * workspace_name: workspace in which kb_Bowtie2 may cache the indexes it generates
+ * include_transcriptome_index: also build the transcriptome index for Genome refs
+ * </pre>
+ * 
+ */
+@JsonInclude(JsonInclude.Include.NON_NULL)
+@Generated("com.googlecode.jsonschema2pojo")
+@JsonPropertyOrder({
+    "refs",
+    "workspace_name",
+    "include_transcriptome_index"
+})
+public class PrefetchReferenceInput {
+
+    @JsonProperty("refs")
+    private List<String> refs;
+    @JsonProperty("workspace_name")
+    private String workspaceName;
+    @JsonProperty("include_transcriptome_index")
+    private Long includeTranscriptomeIndex;
+    private Map<String, Object> additionalProperties = new HashMap<String, Object>();
+
+    @JsonProperty("refs")
+    public List<String> getRefs() {
+        return refs;
+    }
+
+    @JsonProperty("refs")
+    public void setRefs(List<String> refs) {
+        this.refs = refs;
+    }
+
+    public PrefetchReferenceInput withRefs(List<String> refs) {
+        this.refs = refs;
+        return this;
+    }
+
+    @JsonProperty("workspace_name")
+    public String getWorkspaceName() {
+        return workspaceName;
+    }
+
+    @JsonProperty("workspace_name")
+    public void setWorkspaceName(String workspaceName) {
+        this.workspaceName = workspaceName;
+    }
+
+    public PrefetchReferenceInput withWorkspaceName(String workspaceName) {
+        this.workspaceName = workspaceName;
+        return this;
+    }
+
+    @JsonProperty("include_transcriptome_index")
+    public Long getIncludeTranscriptomeIndex() {
+        return includeTranscriptomeIndex;
+    }
+
+    @JsonProperty("include_transcriptome_index")
+    public void setIncludeTranscriptomeIndex(Long includeTranscriptomeIndex) {
+        this.includeTranscriptomeIndex = includeTranscriptomeIndex;
+    }
+
+    public PrefetchReferenceInput withIncludeTranscriptomeIndex(Long includeTranscriptomeIndex) {
+        this.includeTranscriptomeIndex = includeTranscriptomeIndex;
+        return this;
+    }
+
+    @JsonAnyGetter
+    public Map<String, Object> getAdditionalProperties() {
+        return this.additionalProperties;
+    }
+
+    @JsonAnySetter
+    public void setAdditionalProperties(String name, Object value) {
+        this.additionalProperties.put(name, value);
+    }
+
+    @Override
+    public String toString() {
+        return ((((((((("PrefetchReferenceInput"+" [refs=")+ refs)+", workspaceName=")+ workspaceName)+", includeTranscriptomeIndex=")+ includeTranscriptomeIndex)+", additionalProperties=")+ additionalProperties)+"]");
+    }
+
+}
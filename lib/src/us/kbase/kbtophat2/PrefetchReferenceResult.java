@@ -0,0 +1,63 @@
+
+package us.kbase.kbtophat2;
+
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+import javax.annotation.Generated;
+import com.fasterxml.jackson.annotation.JsonAnyGetter;
+import com.fasterxml.jackson.annotation.JsonAnySetter;
+import com.fasterxml.jackson.annotation.JsonInclude;
+import com.fasterxml.jackson.annotation.JsonProperty;
+import com.fasterxml.jackson.annotation.JsonPropertyOrder;
+
+
+/**
+ * <p>Original spec-file type: PrefetchReferenceResult</p>
+ * <pre>
+ * reference_status: cache status of each ref, in the order given
+ * </pre>
+ * 
+ */
+@JsonInclude(JsonInclude.Include.NON_NULL)
+@Generated("com.googlecode.jsonschema2pojo")
+@JsonPropertyOrder({
+    "reference_status"
+})
+public class PrefetchReferenceResult {
+
+    @JsonProperty("reference_status")
+    private List<ReferenceCacheStatus> referenceStatus;
+    private Map<String, Object> additionalProperties = new HashMap<String, Object>();
+
+    @JsonProperty("reference_status")
+    public List<ReferenceCacheStatus> getReferenceStatus() {
+        return referenceStatus;
+    }
+
+    @JsonProperty("reference_status")
+    public void setReferenceStatus(List<ReferenceCacheStatus> referenceStatus) {
+        this.referenceStatus = referenceStatus;
+    }
+
+    public PrefetchReferenceResult withReferenceStatus(List<ReferenceCacheStatus> referenceStatus) {
+        this.referenceStatus = referenceStatus;
+        return this;
+    }
+
+    @JsonAnyGetter
+    public Map<String, Object> getAdditionalProperties() {
+        return this.additionalProperties;
+    }
+
+    @JsonAnySetter
+    public void setAdditionalProperties(String name, Object value) {
+        this.additionalProperties.put(name, value);
+    }
+
+    @Override
+    public String toString() {
+        return ((((("PrefetchReferenceResult"+" [referenceStatus=")+ referenceStatus)+", additionalProperties=")+ additionalProperties)+"]");
+    }
+
+}
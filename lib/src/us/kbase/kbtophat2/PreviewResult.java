@@ -0,0 +1,214 @@
+
+package us.kbase.kbtophat2;
+
+import java.util.HashMap;
+import java.util.Map;
+import javax.annotation.Generated;
+import com.fasterxml.jackson.annotation.JsonAnyGetter;
+import com.fasterxml.jackson.annotation.JsonAnySetter;
+import com.fasterxml.jackson.annotation.JsonInclude;
+import com.fasterxml.jackson.annotation.JsonProperty;
+import com.fasterxml.jackson.annotation.JsonPropertyOrder;
+
+
+/**
+ * <p>Original spec-file type: PreviewResult</p>
+ * <pre>
+ * reads_ref: reads library reference
+ * total_reads: number of reads (pairs) in the library
+ * sampled_reads: number of reads (pairs) aligned in the preview
+ * mapped_reads: number of aligned reads, counting each mate
+ * mapping_rate: overall read mapping rate of the preview (percent)
+ * junction_count: number of junctions found in the preview
+ * preview_seconds: wall time of the preview alignment
+ * estimated_run_seconds: extrapolated wall time of aligning the whole library
+ * estimated_disk_bytes: extrapolated scratch usage of aligning the whole library
+ * </pre>
+ * 
+ */
+@JsonInclude(JsonInclude.Include.NON_NULL)
+@Generated("com.googlecode.jsonschema2pojo")
+@JsonPropertyOrder({
+    "reads_ref",
+    "total_reads",
+    "sampled_reads",
+    "mapped_reads",
+    "mapping_rate",
+    "junction_count",
+    "preview_seconds",
+    "estimated_run_seconds",
+    "estimated_disk_bytes"
+})
+public class PreviewResult {
+
+    @JsonProperty("reads_ref")
+    private String readsRef;
+    @JsonProperty("total_reads")
+    private Long totalReads;
+    @JsonProperty("sampled_reads")
+    private Long sampledReads;
+    @JsonProperty("mapped_reads")
+    private Long mappedReads;
+    @JsonProperty("mapping_rate")
+    private Double mappingRate;
+    @JsonProperty("junction_count")
+    private Long junctionCount;
+    @JsonProperty("preview_seconds")
+    private Double previewSeconds;
+    @JsonProperty("estimated_run_seconds")
+    private Double estimatedRunSeconds;
+    @JsonProperty("estimated_disk_bytes")
+    private Long estimatedDiskBytes;
+    private Map<String, Object> additionalProperties = new HashMap<String, Object>();
+
+    @JsonProperty("reads_ref")
+    public String getReadsRef() {
+        return readsRef;
+    }
+
+    @JsonProperty("reads_ref")
+    public void setReadsRef(String readsRef) {
+        this.readsRef = readsRef;
+    }
+
+    public PreviewResult withReadsRef(String readsRef) {
+        this.readsRef = readsRef;
+        return this;
+    }
+
+    @JsonProperty("total_reads")
+    public Long getTotalReads() {
+        return totalReads;
+    }
+
+    @JsonProperty("total_reads")
+    public void setTotalReads(Long totalReads) {
+        this.totalReads = totalReads;
+    }
+
+    public PreviewResult withTotalReads(Long totalReads) {
+        this.totalReads = totalReads;
+        return this;
+    }
+
+    @JsonProperty("sampled_reads")
+    public Long getSampledReads() {
+        return sampledReads;
+    }
+
+    @JsonProperty("sampled_reads")
+    public void setSampledReads(Long sampledReads) {
+        this.sampledReads = sampledReads;
+    }
+
+    public PreviewResult withSampledReads(Long sampledReads) {
+        this.sampledReads = sampledReads;
+        return this;
+    }
+
+    @JsonProperty("mapped_reads")
+    public Long getMappedReads() {
+        return mappedReads;
+    }
+
+    @JsonProperty("mapped_reads")
+    public void setMappedReads(Long mappedReads) {
+        this.mappedReads = mappedReads;
+    }
+
+    public PreviewResult withMappedReads(Long mappedReads) {
+        this.mappedReads = mappedReads;
+        return this;
+    }
+
+    @JsonProperty("mapping_rate")
+    public Double getMappingRate() {
+        return mappingRate;
+    }
+
+    @JsonProperty("mapping_rate")
+    public void setMappingRate(Double mappingRate) {
+        this.mappingRate = mappingRate;
+    }
+
+    public PreviewResult withMappingRate(Double mappingRate) {
+        this.mappingRate = mappingRate;
+        return this;
+    }
+
+    @JsonProperty("junction_count")
+    public Long getJunctionCount() {
+        return junctionCount;
+    }
+
+    @JsonProperty("junction_count")
+    public void setJunctionCount(Long junctionCount) {
+        this.junctionCount = junctionCount;
+    }
+
+    public PreviewResult withJunctionCount(Long junctionCount) {
+        this.junctionCount = junctionCount;
+        return this;
+    }
+
+    @JsonProperty("preview_seconds")
+    public Double getPreviewSeconds() {
+        return previewSeconds;
+    }
+
+    @JsonProperty("preview_seconds")
+    public void setPreviewSeconds(Double previewSeconds) {
+        this.previewSeconds = previewSeconds;
+    }
+
+    public PreviewResult withPreviewSeconds(Double previewSeconds) {
+        this.previewSeconds = previewSeconds;
+        return this;
+    }
+
+    @JsonProperty("estimated_run_seconds")
+    public Double getEstimatedRunSeconds() {
+        return estimatedRunSeconds;
+    }
+
+    @JsonProperty("estimated_run_seconds")
+    public void setEstimatedRunSeconds(Double estimatedRunSeconds) {
+        this.estimatedRunSeconds = estimatedRunSeconds;
+    }
+
+    public PreviewResult withEstimatedRunSeconds(Double estimatedRunSeconds) {
+        this.estimatedRunSeconds = estimatedRunSeconds;
+        return this;
+    }
+
+    @JsonProperty("estimated_disk_bytes")
+    public Long getEstimatedDiskBytes() {
+        return estimatedDiskBytes;
+    }
+
+    @JsonProperty("estimated_disk_bytes")
+    public void setEstimatedDiskBytes(Long estimatedDiskBytes) {
+        this.estimatedDiskBytes = estimatedDiskBytes;
+    }
+
+    public PreviewResult withEstimatedDiskBytes(Long estimatedDiskBytes) {
+        this.estimatedDiskBytes = estimatedDiskBytes;
+        return this;
+    }
+
+    @JsonAnyGetter
+    public Map<String, Object> getAdditionalProperties() {
+        return this.additionalProperties;
+    }
+
+    @JsonAnySetter
+    public void setAdditionalProperties(String name, Object value) {
+        this.additionalProperties.put(name, value);
+    }
+
+    @Override
+    public String toString() {
+        return ((((((((((((((((((((("PreviewResult"+" [readsRef=")+ readsRef)+", totalReads=")+ totalReads)+", sampledReads=")+ sampledReads)+", mappedReads=")+ mappedReads)+", mappingRate=")+ mappingRate)+", junctionCount=")+ junctionCount)+", previewSeconds=")+ previewSeconds)+", estimatedRunSeconds=")+ estimatedRunSeconds)+", estimatedDiskBytes=")+ estimatedDiskBytes)+", additionalProperties=")+ additionalProperties)+"]");
+    }
+
+}
@@ -0,0 +1,139 @@
+
+package us.kbase.kbtophat2;
+
+import java.util.HashMap;
+import java.util.Map;
+import javax.annotation.Generated;
+import com.fasterxml.jackson.annotation.JsonAnyGetter;
+import com.fasterxml.jackson.annotation.JsonAnySetter;
+import com.fasterxml.jackson.annotation.JsonInclude;
+import com.fasterxml.jackson.annotation.JsonProperty;
+import com.fasterxml.jackson.annotation.JsonPropertyOrder;
+
+
+/**
+ * <p>Original spec-file type: ReferenceCacheStatus</p>
+ * <pre>
+ * ref: ref as given in refs
+ * index_key: key of the index in the node-local index cache
+ * bowtie2_index_status: one of 'cached' (already on the node), 'fetched' or 'failed'
+ * transcriptome_index_status: as bowtie2_index_status, or 'skipped' when not requested
+ * or ref is not a Genome
+ * error: error message if any index failed
+ * </pre>
+ * 
+ */
+@JsonInclude(JsonInclude.Include.NON_NULL)
+@Generated("com.googlecode.jsonschema2pojo")
+@JsonPropertyOrder({
+    "ref",
+    "index_key",
+    "bowtie2_index_status",
+    "transcriptome_index_status",
+    "error"
+})
+public class ReferenceCacheStatus {
+
+    @JsonProperty("ref")
+    private String ref;
+    @JsonProperty("index_key")
+    private String indexKey;
+    @JsonProperty("bowtie2_index_status")
+    private String bowtie2IndexStatus;
+    @JsonProperty("transcriptome_index_status")
+    private String transcriptomeIndexStatus;
+    @JsonProperty("error")
+    private String error;
+    private Map<String, Object> additionalProperties = new HashMap<String, Object>();
+
+    @JsonProperty("ref")
+    public String getRef() {
+        return ref;
+    }
+
+    @JsonProperty("ref")
+    public void setRef(String ref) {
+        this.ref = ref;
+    }
+
+    public ReferenceCacheStatus withRef(String ref) {
+        this.ref = ref;
+        return this;
+    }
+
+    @JsonProperty("index_key")
+    public String getIndexKey() {
+        return indexKey;
+    }
+
+    @JsonProperty("index_key")
+    public void setIndexKey(String indexKey) {
+        this.indexKey = indexKey;
+    }
+
+    public ReferenceCacheStatus withIndexKey(String indexKey) {
+        this.indexKey = indexKey;
+        return this;
+    }
+
+    @JsonProperty("bowtie2_index_status")
+    public String getBowtie2IndexStatus() {
+        return bowtie2IndexStatus;
+    }
+
+    @JsonProperty("bowtie2_index_status")
+    public void setBowtie2IndexStatus(String bowtie2IndexStatus) {
+        this.bowtie2IndexStatus = bowtie2IndexStatus;
+    }
+
+    public ReferenceCacheStatus withBowtie2IndexStatus(String bowtie2IndexStatus) {
+        this.bowtie2IndexStatus = bowtie2IndexStatus;
+        return this;
+    }
+
+    @JsonProperty("transcriptome_index_status")
+    public String getTranscriptomeIndexStatus() {
+        return transcriptomeIndexStatus;
+    }
+
+    @JsonProperty("transcriptome_index_status")
+    public void setTranscriptomeIndexStatus(String transcriptomeIndexStatus) {
+        this.transcriptomeIndexStatus = transcriptomeIndexStatus;
+    }
+
+    public ReferenceCacheStatus withTranscriptomeIndexStatus(String transcriptomeIndexStatus) {
+        this.transcriptomeIndexStatus = transcriptomeIndexStatus;
+        return this;
+    }
+
+    @JsonProperty("error")
+    public String getError() {
+        return error;
+    }
+
+    @JsonProperty("error")
+    public void setError(String error) {
+        this.error = error;
+    }
+
+    public ReferenceCacheStatus withError(String error) {
+        this.error = error;
+        return this;
+    }
+
+    @JsonAnyGetter
+    public Map<String, Object> getAdditionalProperties() {
+        return this.additionalProperties;
+    }
+
+    @JsonAnySetter
+    public void setAdditionalProperties(String name, Object value) {
+        this.additionalProperties.put(name, value);
+    }
+
+    @Override
+    public String toString() {
+        return ((((((((((((("ReferenceCacheStatus"+" [ref=")+ ref)+", indexKey=")+ indexKey)+", bowtie2IndexStatus=")+ bowtie2IndexStatus)+", transcriptomeIndexStatus=")+ transcriptomeIndexStatus)+", error=")+ error)+", additionalProperties=")+ additionalProperties)+"]");
+    }
+
+}
@@ -33,6 +33,16 @@ import com.fasterxml.jackson.annotation.JsonPropertyOrder;
  * no_coverage_search: use this option to disable the coverage-based search for junctions
  * library_type: library type (fr-unstranded, fr-firststrand, fr-secondstrand)
  * preset_options: alignment preset options (b2-very-fast, b2-fast, b2-sensitive, b2-very-sensitive)
+ * use_transcriptome_index: align against a transcriptome index built from the Genome
+ * annotation (ignored for Assembly and ContigSet)
+ * preview_fraction: preview mode, align only this fraction of each reads library and
+ * report mapping statistics and full run estimates instead of saving
+ * alignments
+ * preview_reads: preview mode, align at most this many reads (pairs) of each library
+ * resume_from: result directory (or its name) of an earlier run with the same params to
+ * resume, reusing the reads libraries it downloaded, aligned and saved
+ * force: realign reads libraries an earlier run aligned from the same inputs, instead of
+ * reusing its Alignments
  * ref: https://ccb.jhu.edu/software/tophat/manual.shtml
  * </pre>
  * 
@@ -56,7 +66,12 @@ import com.fasterxml.jackson.annotation.JsonPropertyOrder;
     "report_secondary_alignments",
     "no_coverage_search",
     "library_type",
-    "preset_options"
+    "preset_options",
+    "use_transcriptome_index",
+    "preview_fraction",
+    "preview_reads",
+    "resume_from",
+    "force"
 })
 public class TopHatInput {
 
@@ -94,6 +109,16 @@ public class TopHatInput {
     private String libraryType;
     @JsonProperty("preset_options")
     private String presetOptions;
+    @JsonProperty("use_transcriptome_index")
+    private Long useTranscriptomeIndex;
+    @JsonProperty("preview_fraction")
+    private Double previewFraction;
+    @JsonProperty("preview_reads")
+    private Long previewReads;
+    @JsonProperty("resume_from")
+    private String resumeFrom;
+    @JsonProperty("force")
+    private Long force;
     private Map<String, Object> additionalProperties = new HashMap<String, Object>();
 
     @JsonProperty("input_ref")
@@ -351,6 +376,81 @@ public class TopHatInput {
         return this;
     }
 
+    @JsonProperty("use_transcriptome_index")
+    public Long getUseTranscriptomeIndex() {
+        return useTranscriptomeIndex;
+    }
+
+    @JsonProperty("use_transcriptome_index")
+    public void setUseTranscriptomeIndex(Long useTranscriptomeIndex) {
+        this.useTranscriptomeIndex = useTranscriptomeIndex;
+    }
+
+    public TopHatInput withUseTranscriptomeIndex(Long useTranscriptomeIndex) {
+        this.useTranscriptomeIndex = useTranscriptomeIndex;
+        return this;
+    }
+
+    @JsonProperty("preview_fraction")
+    public Double getPreviewFraction() {
+        return previewFraction;
+    }
+
+    @JsonProperty("preview_fraction")
+    public void setPreviewFraction(Double previewFraction) {
+        this.previewFraction = previewFraction;
+    }
+
+    public TopHatInput withPreviewFraction(Double previewFraction) {
+        this.previewFraction = previewFraction;
+        return this;
+    }
+
+    @JsonProperty("preview_reads")
+    public Long getPreviewReads() {
+        return previewReads;
+    }
+
+    @JsonProperty("preview_reads")
+    public void setPreviewReads(Long previewReads) {
+        this.previewReads = previewReads;
+    }
+
+    public TopHatInput withPreviewReads(Long previewReads) {
+        this.previewReads = previewReads;
+        return this;
+    }
+
+    @JsonProperty("resume_from")
+    public String getResumeFrom() {
+        return resumeFrom;
+    }
+
+    @JsonProperty("resume_from")
+    public void setResumeFrom(String resumeFrom) {
+        this.resumeFrom = resumeFrom;
+    }
+
+    public TopHatInput withResumeFrom(String resumeFrom) {
+        this.resumeFrom = resumeFrom;
+        return this;
+    }
+
+    @JsonProperty("force")
+    public Long getForce() {
+        return force;
+    }
+
+    @JsonProperty("force")
+    public void setForce(Long force) {
+        this.force = force;
+    }
+
+    public TopHatInput withForce(Long force) {
+        this.force = force;
+        return this;
+    }
+
     @JsonAnyGetter
     public Map<String, Object> getAdditionalProperties() {
         return this.additionalProperties;
@@ -363,7 +463,7 @@ public class TopHatInput {
 
     @Override
     public String toString() {
-        return ((((((((((((((((((((((((((((((((((((("TopHatInput"+" [inputRef=")+ inputRef)+", assemblyOrGenomeRef=")+ assemblyOrGenomeRef)+", workspaceName=")+ workspaceName)+", alignmentSetSuffix=")+ alignmentSetSuffix)+", alignmentSuffix=")+ alignmentSuffix)+", readsCondition=")+ readsCondition)+", numThreads=")+ numThreads)+", readMismatches=")+ readMismatches)+", readGapLength=")+ readGapLength)+", readEditDist=")+ readEditDist)+", minIntronLength=")+ minIntronLength)+", maxIntronLength=")+ maxIntronLength)+", minAnchorLength=")+ minAnchorLength)+", reportSecondaryAlignments=")+ reportSecondaryAlignments)+", noCoverageSearch=")+ noCoverageSearch)+", libraryType=")+ libraryType)+", presetOptions=")+ presetOptions)+", additionalProperties=")+ additionalProperties)+"]");
+        return ((((((((((((((((((((((((((((((((((((((((((((((("TopHatInput"+" [inputRef=")+ inputRef)+", assemblyOrGenomeRef=")+ assemblyOrGenomeRef)+", workspaceName=")+ workspaceName)+", alignmentSetSuffix=")+ alignmentSetSuffix)+", alignmentSuffix=")+ alignmentSuffix)+", readsCondition=")+ readsCondition)+", numThreads=")+ numThreads)+", readMismatches=")+ readMismatches)+", readGapLength=")+ readGapLength)+", readEditDist=")+ readEditDist)+", minIntronLength=")+ minIntronLength)+", maxIntronLength=")+ maxIntronLength)+", minAnchorLength=")+ minAnchorLength)+", reportSecondaryAlignments=")+ reportSecondaryAlignments)+", noCoverageSearch=")+ noCoverageSearch)+", libraryType=")+ libraryType)+", presetOptions=")+ presetOptions)+", useTranscriptomeIndex=")+ useTranscriptomeIndex)+", previewFraction=")+ previewFraction)+", previewReads=")+ previewReads)+", resumeFrom=")+ resumeFrom)+", force=")+ force)+", additionalProperties=")+ additionalProperties)+"]");
     }
 
 }
@@ -2,6 +2,7 @@
 package us.kbase.kbtophat2;
 
 import java.util.HashMap;
+import java.util.List;
 import java.util.Map;
 import javax.annotation.Generated;
 import com.fasterxml.jackson.annotation.JsonAnyGetter;
@@ -18,6 +19,8 @@ import com.fasterxml.jackson.annotation.JsonPropertyOrder;
  * reads_alignment_object_ref: generated Alignment/AlignmentSet object reference
  * report_name: report name generated by KBaseReport
  * report_ref: report reference generated by KBaseReport
+ * preview_results: preview statistics of each reads library (preview mode only, no
+ * alignment is saved then)
  * </pre>
  * 
  */
@@ -27,7 +30,8 @@ import com.fasterxml.jackson.annotation.JsonPropertyOrder;
     "result_directory",
     "reads_alignment_object_ref",
     "report_name",
-    "report_ref"
+    "report_ref",
+    "preview_results"
 })
 public class TopHatResult {
 
@@ -39,6 +43,8 @@ public class TopHatResult {
     private String reportName;
     @JsonProperty("report_ref")
     private String reportRef;
+    @JsonProperty("preview_results")
+    private List<PreviewResult> previewResults;
     private Map<String, Object> additionalProperties = new HashMap<String, Object>();
 
     @JsonProperty("result_directory")
@@ -101,6 +107,21 @@ public class TopHatResult {
         return this;
     }
 
+    @JsonProperty("preview_results")
+    public List<PreviewResult> getPreviewResults() {
+        return previewResults;
+    }
+
+    @JsonProperty("preview_results")
+    public void setPreviewResults(List<PreviewResult> previewResults) {
+        this.previewResults = previewResults;
+    }
+
+    public TopHatResult withPreviewResults(List<PreviewResult> previewResults) {
+        this.previewResults = previewResults;
+        return this;
+    }
+
     @JsonAnyGetter
     public Map<String, Object> getAdditionalProperties() {
         return this.additionalProperties;
@@ -113,7 +134,7 @@ public class TopHatResult {
 
     @Override
     public String toString() {
-        return ((((((((((("TopHatResult"+" [resultDirectory=")+ resultDirectory)+", readsAlignmentObjectRef=")+ readsAlignmentObjectRef)+", reportName=")+ reportName)+", reportRef=")+ reportRef)+", additionalProperties=")+ additionalProperties)+"]");
+        return ((((((((((((("TopHatResult"+" [resultDirectory=")+ resultDirectory)+", readsAlignmentObjectRef=")+ readsAlignmentObjectRef)+", reportName=")+ reportName)+", reportRef=")+ reportRef)+", previewResults=")+ previewResults)+", additionalProperties=")+ additionalProperties)+"]");
     }
 
 }
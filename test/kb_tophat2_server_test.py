@@ -21,6 +21,8 @@ from kb_tophat2.kb_tophat2Impl import kb_tophat2
 from kb_tophat2.kb_tophat2Server import MethodContext
 from kb_tophat2.authclient import KBaseAuth as _KBaseAuth
 from kb_tophat2.Utils.TopHatUtil import TopHatUtil
+from kb_tophat2.Utils.FastqStats import FastqStats
+from kb_tophat2.Utils.IndexCache import IndexCache
 from AssemblyUtil.AssemblyUtilClient import AssemblyUtil
 from ReadsUtils.ReadsUtilsClient import ReadsUtils
 from DataFileUtil.DataFileUtilClient import DataFileUtil
@@ -196,6 +198,76 @@ class kb_tophat2Test(unittest.TestCase):
     def getContext(self):
         return self.__class__.ctx
 
+    def test_index_cache_lru_eviction(self):
+        cache_dir = os.path.join(self.scratch, 'index_cache_test_' + str(int(time.time() * 100)))
+        index_cache = IndexCache(cache_dir, 250)
+
+        def fetch_index(key):
+            index_dir = os.path.join(self.scratch, 'index_src_{}_{}'.format(
+                                                            key, int(time.time() * 100)))
+            os.makedirs(index_dir)
+            with open(os.path.join(index_dir, 'test_ref.1.bt2'), 'w') as index_file:
+                index_file.write('x' * 100)
+            return index_dir
+
+        for key in ['index_a', 'index_b']:
+            index_cache.get_index(key, lambda: fetch_index(key))
+            time.sleep(1)
+        # index_a becomes most recently used, so index_b is evicted next
+        index_cache.get_index('index_a', None)
+        time.sleep(1)
+        index_cache.get_index('index_c', lambda: fetch_index('index_c'))
+
+        self.assertIsNotNone(index_cache.lookup('index_a'))
+        self.assertIsNone(index_cache.lookup('index_b'))
+        self.assertIsNotNone(index_cache.lookup('index_c'))
+        self.assertEqual(index_cache.hits, 1)
+        self.assertEqual(index_cache.misses, 3)
+
+    def test_reference_info_cache(self):
+        tophat_runner = TopHatUtil(self.cfg)
+
+        genome_info = tophat_runner._get_reference_info(self.genome_ref)
+        self.assertEqual(genome_info['type'], 'KBaseGenomes.Genome')
+        self.assertTrue(genome_info['assembly_ref'].startswith(genome_info['ref'] + ';'))
+        self.assertGreater(genome_info['dna_size'], 0)
+        self.assertGreater(genome_info['contig_count'], 0)
+
+        # versioned refs are answered from the persistent cache by a fresh instance
+        tophat_runner = TopHatUtil(self.cfg)
+        self.assertEqual(tophat_runner.ref_info_cache.get(genome_info['ref']), genome_info)
+        self.assertEqual(tophat_runner._get_index_key(genome_info['ref']),
+                         genome_info['index_key'])
+
+    def test_fastq_stats(self):
+        reads_stats = FastqStats().scan_file(os.path.join('data', 'reads_1.fq'))
+        reads_stats.merge(FastqStats().scan_file(os.path.join('data', 'reads_2.fq')))
+        reads_stats = reads_stats.to_dict()
+
+        self.assertEqual(reads_stats['read_count'], 200)
+        self.assertEqual(reads_stats['median_length'], 75)
+        self.assertEqual(reads_stats['length_histogram'], {'75': 200})
+        # all 'I' qualities are valid Phred+64 too, but taken as the Phred+33 default
+        self.assertEqual(reads_stats['quality_encoding'], 'phred33')
+
+        tophat_runner = TopHatUtil(self.cfg)
+        self.assertIsNone(tophat_runner._get_segment_length(reads_stats))
+        self.assertEqual(tophat_runner._get_segment_length({'median_length': 36}), 18)
+
+    def test_fastq_quality_encoding(self):
+        def get_quality_encoding(qualities):
+            reads_stats = FastqStats()
+            for index, quality in enumerate(qualities):
+                reads_stats.add_chunk('@read_{}\n{}\n+\n{}\n'.format(index, 'A' * len(quality),
+                                                                   quality))
+            return reads_stats.quality_encoding()
+
+        # Phred+33 Q26 to Q40 lies within the Solexa+64 range
+        self.assertEqual(get_quality_encoding([';<=>?@ABCDEFGHI', 'IIIIIIII;;;;']), 'phred33')
+        self.assertEqual(get_quality_encoding(['#+5?IIII']), 'phred33')
+        self.assertEqual(get_quality_encoding([';;;@@@hhh']), 'solexa64')
+        self.assertEqual(get_quality_encoding(['BBBBffhh', '@@@@']), 'phred64')
+
     def test_bad_run_tophat2_app_params(self):
         invalidate_input_params = {
             'missing_input_ref': 'input_ref',
@@ -237,6 +309,39 @@ class kb_tophat2Test(unittest.TestCase):
                 ValueError, '"alignment_suffix" parameter is required, but missing'):
             self.getImpl().run_tophat2_app(self.getContext(), invalidate_input_params)
 
+        invalidate_input_params = {
+            'input_ref': 'input_ref',
+            'assembly_or_genome_ref': 'assembly_or_genome_ref',
+            'workspace_name': 'workspace_name',
+            'alignment_suffix': 'alignment_suffix',
+            'preview_fraction': 1.5
+        }
+        with self.assertRaisesRegexp(
+                ValueError, '"preview_fraction" must be greater than 0 and at most 1'):
+            self.getImpl().run_tophat2_app(self.getContext(), invalidate_input_params)
+
+    def test_prefetch_reference(self):
+        with self.assertRaisesRegexp(ValueError, '"refs" parameter is required, but missing'):
+            self.getImpl().prefetch_reference(self.getContext(), {'refs': []})
+
+        params = {'refs': [self.assembly_ref, self.genome_ref],
+                  'workspace_name': self.getWsName(),
+                  'include_transcriptome_index': 1}
+        result = self.getImpl().prefetch_reference(self.getContext(), params)[0]
+
+        assembly_status, genome_status = result['reference_status']
+        self.assertIn(assembly_status['bowtie2_index_status'], ['fetched', 'cached'])
+        self.assertEqual(assembly_status['transcriptome_index_status'], 'skipped')
+        self.assertIn(genome_status['bowtie2_index_status'], ['fetched', 'cached'])
+        self.assertIn(genome_status['transcriptome_index_status'], ['fetched', 'cached'])
+
+        result = self.getImpl().prefetch_reference(self.getContext(), params)[0]
+
+        assembly_status, genome_status = result['reference_status']
+        self.assertEqual(assembly_status['bowtie2_index_status'], 'cached')
+        self.assertEqual(genome_status['bowtie2_index_status'], 'cached')
+        self.assertEqual(genome_status['transcriptome_index_status'], 'cached')
+
     def test_run_tophat2_app_se_reads(self):
         input_params = {
             'input_ref': self.se_reads_ref,
@@ -273,6 +378,88 @@ class kb_tophat2Test(unittest.TestCase):
         self.assertEqual(alignment_data.get('read_sample_id'), self.se_reads_ref)
         self.assertEqual(alignment_data.get('genome_id'), self.assembly_ref)
 
+    def test_run_tophat2_app_preview(self):
+        input_params = {
+            'input_ref': self.pe_reads_ref,
+            'assembly_or_genome_ref': self.assembly_ref,
+            'workspace_name': self.getWsName(),
+            'alignment_suffix': '_alignment',
+            'preview_fraction': 0.5,
+            'preview_reads': 100
+        }
+
+        result = self.getImpl().run_tophat2_app(self.getContext(), input_params)[0]
+
+        self.assertNotIn('reads_alignment_object_ref', result)
+        self.assertTrue('report_name' in result)
+        self.assertEqual(len(result['preview_results']), 1)
+        preview_result = result['preview_results'][0]
+        self.assertLessEqual(preview_result['sampled_reads'], 100)
+        self.assertLessEqual(preview_result['sampled_reads'], preview_result['total_reads'])
+        self.assertGreater(preview_result['estimated_run_seconds'],
+                           preview_result['preview_seconds'])
+        # fixed costs of the preview run are not scaled up with the reads
+        self.assertLess(preview_result['estimated_run_seconds'],
+                        preview_result['preview_seconds'] * preview_result['total_reads'] /
+                        float(preview_result['sampled_reads']))
+
+    def test_run_tophat2_app_resume(self):
+        input_params = {
+            'input_ref': self.se_reads_ref,
+            'assembly_or_genome_ref': self.assembly_ref,
+            'workspace_name': self.getWsName(),
+            'alignment_suffix': '_resumed_alignment',
+            'preset_options': 'b2-very-fast'
+        }
+
+        result = self.getImpl().run_tophat2_app(self.getContext(), input_params)[0]
+        self.assertIn('run_journal.json', os.listdir(result['result_directory']))
+
+        # everything was saved already, the resumed run reuses the Alignment
+        input_params['resume_from'] = os.path.basename(result['result_directory'])
+        resumed_result = self.getImpl().run_tophat2_app(self.getContext(), input_params)[0]
+        self.assertEqual(resumed_result['result_directory'], result['result_directory'])
+        self.assertEqual(resumed_result['reads_alignment_object_ref'],
+                         result['reads_alignment_object_ref'])
+
+        input_params['preset_options'] = 'b2-sensitive'
+        with self.assertRaisesRegexp(
+                ValueError, 'Can not resume a run with different params: preset_options'):
+            self.getImpl().run_tophat2_app(self.getContext(), input_params)
+
+    def test_run_tophat2_app_memoized(self):
+        input_params = {
+            'input_ref': self.pe_reads_ref,
+            'assembly_or_genome_ref': self.assembly_ref,
+            'workspace_name': self.getWsName(),
+            'alignment_suffix': '_memoized_alignment',
+            'min_intron_length': 60,
+            'force': 1
+        }
+
+        result = self.getImpl().run_tophat2_app(self.getContext(), input_params)[0]
+        alignment_ref = result['reads_alignment_object_ref']
+
+        # same inputs under another name, the cached Alignment is copied instead of realigned
+        input_params['force'] = 0
+        input_params['alignment_suffix'] = '_memoized_alignment_copy'
+        result = self.getImpl().run_tophat2_app(self.getContext(), input_params)[0]
+        self.assertFalse(any(re.match('tophat2_result_*', file)
+                             for file in os.listdir(result['result_directory'])))
+        self.assertNotEqual(result['reads_alignment_object_ref'], alignment_ref)
+        copy_info = self.ws.get_object_info3({'objects': [
+                                {'ref': result['reads_alignment_object_ref']}]})['infos'][0]
+        self.assertTrue(copy_info[1].endswith('_memoized_alignment_copy'))
+
+        # the report links the reused Alignment but no TopHat2 output files
+        report = self.ws.get_objects2({'objects': [
+                                {'ref': result['report_ref']}]})['data'][0]['data']
+        self.assertEqual(report['file_links'], [])
+        self.assertEqual([created['ref'] for created in report['objects_created']],
+                         [result['reads_alignment_object_ref']])
+        self.assertIn('Reused the Alignment', report['text_message'])
+        self.assertEqual(len(report['html_links']), 1)
+
     def test_run_tophat2_app_pe_reads(self):
         input_params = {
             'input_ref': self.pe_reads_ref,
@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+import gzip
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from kb_tophat2.Utils.FileLock import FileLock
+from kb_tophat2.Utils.ReadsPipeline import PipelineError, ReadsPipeline
+from kb_tophat2.Utils.ReadsSharder import ReadsSharder
+from kb_tophat2.Utils.ResourcePlanner import ResourcePlanner
+from kb_tophat2.Utils.ResultMerger import ResultMerger
+from kb_tophat2.Utils.RunJournal import RunJournal
+from kb_tophat2.Utils.TaskExecutor import TaskCancelledError, TaskError, TaskExecutor
+from kb_tophat2.Utils.TopHatUtil import TopHatUtil
+
+
+class TopHatUtilTest(unittest.TestCase):
+    """
+    Unit tests of the TopHatUtil logic that needs no KBase services
+    """
+
+    def test_estimate_run_seconds(self):
+        # 1s startup and 30s index checks, 4s going through 1/1000 of the reads
+        stage_seconds = {'checking': 30, 'preparing_reads': 1, 'mapping_genome': 2,
+                         'reporting': 1}
+        estimate = TopHatUtil._estimate_run_seconds(35, stage_seconds, 1000)
+        self.assertEqual(estimate, 31 + 4 * 1000)
+
+        # stage times never count more than the whole preview run
+        self.assertEqual(TopHatUtil._estimate_run_seconds(3, stage_seconds, 10), 30)
+
+        # without stage times all of the preview run is scaled
+        self.assertEqual(TopHatUtil._estimate_run_seconds(35, None, 1000), 35000)
+
+
+class ResultMergerTest(unittest.TestCase):
+    """
+    Unit tests of merging the outputs of TopHat2 runs on shards, without samtools as the
+    shards have no BAM files
+    """
+
+    PE_SUMMARY = """Left reads:
+          Input     :      {left_input:4d}
+           Mapped   :      {left_mapped:4d} (90.0% of input)
+            of these:        10 (11.1%) have multiple alignments (1 have >20)
+Right reads:
+          Input     :      {left_input:4d}
+           Mapped   :        80 (80.0% of input)
+            of these:         5 ( 6.2%) have multiple alignments (0 have >20)
+85.0% overall read mapping rate.
+
+Aligned pairs:        {pairs:2d}
+     of these:         4 ( 5.3%) have multiple alignments
+          and:         3 ( 4.0%) are discordant alignments
+72.0% concordant pair alignment rate.
+"""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.shard_dirs = [os.path.join(self.work_dir, 'shard{}'.format(shard))
+                           for shard in range(3)]
+        for shard_dir in self.shard_dirs:
+            os.makedirs(shard_dir)
+        self.merged_dir = os.path.join(self.work_dir, 'merged')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def write_file(self, shard, file_name, lines):
+        with open(os.path.join(self.shard_dirs[shard], file_name), 'w') as output:
+            output.write(''.join(line + '\n' for line in lines))
+
+    def read_merged(self, file_name):
+        with open(os.path.join(self.merged_dir, file_name)) as merged:
+            return [line.rstrip('\n').split('\t') for line in merged]
+
+    def test_merge_junctions(self):
+        track = 'track name=junctions description="TopHat junctions"'
+        # both shards found the intron 150-260 with different overhangs
+        self.write_file(0, 'junctions.bed', [
+            track,
+            'chr1\t100\t300\tJUNC00000001\t5\t+\t100\t300\t255,0,0\t2\t50,40\t0,160',
+            'chr2\t10\t100\tJUNC00000002\t1\t-\t10\t100\t255,0,0\t2\t20,20\t0,70'])
+        self.write_file(1, 'junctions.bed', [
+            track,
+            'chr1\t120\t310\tJUNC00000001\t2\t+\t120\t310\t255,0,0\t2\t30,50\t0,140'])
+        # the third shard has no outputs at all
+
+        ResultMerger().merge(self.shard_dirs, self.merged_dir)
+
+        merged = self.read_merged('junctions.bed')
+        self.assertEqual(merged[0], [track])
+        self.assertEqual(merged[1], ['chr1', '100', '310', 'JUNC00000001', '7', '+', '100',
+                                     '310', '255,0,0', '2', '50,50', '0,160'])
+        self.assertEqual(merged[2], ['chr2', '10', '100', 'JUNC00000002', '1', '-', '10',
+                                     '100', '255,0,0', '2', '20,20', '0,70'])
+        self.assertEqual(len(merged), 3)
+
+    def test_merge_indels(self):
+        self.write_file(0, 'insertions.bed', ['chr1\t500\t500\tA\t3',
+                                              'chr1\t700\t700\tGT\t1'])
+        self.write_file(2, 'insertions.bed', ['chr1\t500\t500\tA\t2',
+                                              'chr1\t500\t500\tC\t1'])
+
+        ResultMerger().merge(self.shard_dirs, self.merged_dir)
+
+        self.assertEqual(self.read_merged('insertions.bed'),
+                         [['chr1', '500', '500', 'A', '5'], ['chr1', '500', '500', 'C', '1'],
+                          ['chr1', '700', '700', 'GT', '1']])
+        # no shard found any deletions
+        self.assertEqual(self.read_merged('deletions.bed'), [])
+
+    def test_merge_paired_end_summaries(self):
+        self.write_file(0, 'align_summary.txt', self.PE_SUMMARY.format(
+                                    left_input=100, left_mapped=90, pairs=75).splitlines())
+        self.write_file(1, 'align_summary.txt', self.PE_SUMMARY.format(
+                                    left_input=100, left_mapped=70, pairs=55).splitlines())
+
+        ResultMerger().merge(self.shard_dirs, self.merged_dir)
+
+        sections, limit, pairs = ResultMerger._read_summary(
+                                        os.path.join(self.merged_dir, 'align_summary.txt'))
+        self.assertEqual(limit, 20)
+        self.assertEqual(sections,
+                         [('Left reads', {'input': 200, 'mapped': 160, 'multiple': 20,
+                                          'excess': 2}),
+                          ('Right reads', {'input': 200, 'mapped': 160, 'multiple': 10,
+                                           'excess': 0})])
+        self.assertEqual(pairs, {'aligned': 130, 'multiple': 8, 'discordant': 6})
+        with open(os.path.join(self.merged_dir, 'align_summary.txt')) as summary:
+            summary = summary.read()
+        self.assertIn('80.0% overall read mapping rate.', summary)
+        self.assertIn('62.0% concordant pair alignment rate.', summary)
+
+    def test_merge_single_summary_round_trip(self):
+        summary = self.PE_SUMMARY.format(left_input=100, left_mapped=90, pairs=75)
+        self.write_file(0, 'align_summary.txt', summary.splitlines())
+
+        ResultMerger().merge(self.shard_dirs, self.merged_dir)
+
+        with open(os.path.join(self.merged_dir, 'align_summary.txt')) as merged:
+            self.assertEqual(merged.read(), summary)
+
+
+class ReadsSharderTest(unittest.TestCase):
+    """
+    Unit tests of splitting, deinterleaving and subsampling FASTQ files
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    @staticmethod
+    def make_records(count, mate):
+        return ['@read{}/{}\nACGT\n+\nIIII\n'.format(number, mate) for number in range(count)]
+
+    def write_reads(self, file_name, records):
+        reads_file = os.path.join(self.work_dir, file_name)
+        open_file = gzip.open if file_name.endswith('.gz') else open
+        with open_file(reads_file, 'wb') as output:
+            output.write(''.join(records))
+        return reads_file
+
+    @staticmethod
+    def read_records(reads_file):
+        open_file = gzip.open if reads_file.endswith('.gz') else open
+        with open_file(reads_file, 'rb') as reads:
+            lines = reads.readlines()
+        return [''.join(lines[line:line + 4]) for line in range(0, len(lines), 4)]
+
+    def test_split_keeps_mates_paired(self):
+        fwd_records = self.make_records(25, 1)
+        rev_records = self.make_records(25, 2)
+        reads_files = [self.write_reads('reads_1.fastq.gz', fwd_records),
+                       self.write_reads('reads_2.fastq', rev_records)]
+
+        shards = ReadsSharder(3, block_records=4).split(reads_files,
+                                                        os.path.join(self.work_dir, 'shards'))
+
+        self.assertEqual(len(shards), 3)
+        shard_fwd = [self.read_records(shard[0]) for shard in shards]
+        shard_rev = [self.read_records(shard[1]) for shard in shards]
+        # blocks of 4 records dealt out in turn
+        self.assertEqual([len(records) for records in shard_fwd], [9, 8, 8])
+        self.assertEqual(shard_fwd[1][:4], fwd_records[4:8])
+        self.assertEqual(sorted(sum(shard_fwd, [])), sorted(fwd_records))
+        for fwd, rev in zip(shard_fwd, shard_rev):
+            self.assertEqual([record.split('/')[0] for record in fwd],
+                             [record.split('/')[0] for record in rev])
+
+    def test_split_drops_empty_shards(self):
+        reads_file = self.write_reads('reads.fastq', self.make_records(3, 1))
+
+        shards = ReadsSharder(4, block_records=2).split([reads_file],
+                                                        os.path.join(self.work_dir, 'shards'))
+
+        self.assertEqual(len(shards), 2)
+
+    def test_split_rejects_unequal_mates(self):
+        reads_files = [self.write_reads('reads_1.fastq', self.make_records(5, 1)),
+                       self.write_reads('reads_2.fastq', self.make_records(4, 2))]
+
+        with self.assertRaisesRegexp(ValueError, 'different numbers of records'):
+            ReadsSharder(2, block_records=1).split(reads_files,
+                                                   os.path.join(self.work_dir, 'shards'))
+
+    def test_deinterleave_round_trip(self):
+        fwd_records = self.make_records(10, 1)
+        rev_records = self.make_records(10, 2)
+        interleaved = [record for pair in zip(fwd_records, rev_records) for record in pair]
+        reads_file = self.write_reads('interleaved.fastq.gz', interleaved)
+        mate_files = [os.path.join(self.work_dir, 'mates', 'reads_1.fastq'),
+                      os.path.join(self.work_dir, 'mates', 'reads_2.fastq')]
+
+        pairs = ReadsSharder(1).deinterleave(reads_file, mate_files)
+
+        self.assertEqual(pairs, 10)
+        self.assertEqual(self.read_records(mate_files[0]), fwd_records)
+        self.assertEqual(self.read_records(mate_files[1]), rev_records)
+
+    def test_deinterleave_rejects_odd_records(self):
+        reads_file = self.write_reads('interleaved.fastq', self.make_records(5, 1))
+
+        with self.assertRaisesRegexp(ValueError, 'odd number of records'):
+            ReadsSharder(1).deinterleave(reads_file,
+                                         [os.path.join(self.work_dir, 'reads_1.fastq'),
+                                          os.path.join(self.work_dir, 'reads_2.fastq')])
+
+    def test_subsample_selects_same_records_of_mates(self):
+        reads_files = [self.write_reads('reads_1.fastq', self.make_records(100, 1)),
+                       self.write_reads('reads_2.fastq', self.make_records(100, 2))]
+
+        sample_files, total, sampled = ReadsSharder(1).subsample(
+                                                reads_files, os.path.join(self.work_dir, 'sample'),
+                                                fraction=0.25, max_records=20)
+
+        self.assertEqual((total, sampled), (100, 20))
+        fwd, rev = [self.read_records(sample_file) for sample_file in sample_files]
+        self.assertEqual(len(fwd), 20)
+        self.assertEqual([record.split('/')[0] for record in fwd],
+                         [record.split('/')[0] for record in rev])
+        # spread over the file, every 4th record up to the limit
+        self.assertEqual(fwd[1].split('/')[0], '@read7')
+
+
+class ResourcePlannerTest(unittest.TestCase):
+    """
+    Unit tests of admitting reads libraries against disk, memory and core budgets
+    """
+
+    def test_disk_admission_and_settle(self):
+        planner = ResourcePlanner(100)
+        planner.plan([('a', 'a', 60, 1), ('b', 'b', 60, 1), ('c', 'c', 40, 1)])
+
+        self.assertTrue(planner.try_admit('a', 60))
+        self.assertFalse(planner.try_admit('b', 60))
+        self.assertTrue(planner.try_admit('c', 40))
+        self.assertEqual(planner.reserved_disk(), 100)
+
+        # an aligned library only keeps its results
+        planner.settle('a', 10)
+        self.assertEqual(planner.reserved_disk(), 50)
+        self.assertFalse(planner.try_admit('b', 60))
+        planner.release('c')
+        self.assertTrue(planner.try_admit('b', 60))
+        self.assertEqual(planner.reserved_disk(), 70)
+
+    def test_disk_admission_of_oversized_library(self):
+        planner = ResourcePlanner(100)
+
+        self.assertTrue(planner.try_admit('a', 50))
+        self.assertFalse(planner.try_admit('big', 200))
+        planner.settle('a', 50)
+        # nothing in flight, so it runs alone
+        self.assertTrue(planner.try_admit('big', 200))
+
+    def test_core_allocation(self):
+        planner = ResourcePlanner(100, core_budget=8, max_concurrent=2)
+        planner.plan([('a', 'a', 0, 3), ('b', 'b', 0, 1), ('c', 'c', 0, 1)])
+
+        # a share by weight against the largest library starting alongside, one core kept
+        self.assertEqual(planner.acquire_cores('a'), 6)
+        # the last library to start alongside gets all that is left
+        self.assertEqual(planner.acquire_cores('b'), 2)
+
+        threads = []
+        waiting = threading.Thread(target=lambda: threads.append(planner.acquire_cores('c')))
+        waiting.daemon = True
+        waiting.start()
+        waiting.join(0.2)
+        self.assertEqual(threads, [])
+
+        # the cores of a finished library go to the next one
+        planner.release_cores('a')
+        waiting.join(5)
+        self.assertEqual(threads, [6])
+
+    def test_memory_admission(self):
+        planner = ResourcePlanner(100, memory_budget=10)
+        planner.acquire_memory('a', 6)
+
+        admitted = []
+
+        def acquire():
+            planner.acquire_memory('b', 6)
+            admitted.append('b')
+
+        waiting = threading.Thread(target=acquire)
+        waiting.daemon = True
+        waiting.start()
+        waiting.join(0.2)
+        self.assertEqual(admitted, [])
+
+        planner.release_memory('a')
+        waiting.join(5)
+        self.assertEqual(admitted, ['b'])
+
+        # a run that fits no budget still starts once it runs alone
+        planner.release_memory('b')
+        planner.acquire_memory('big', 50)
+        planner.release_memory('big')
+
+    def test_memory_admission_without_budget(self):
+        planner = ResourcePlanner(100)
+        planner.acquire_memory('a', 10 ** 12)
+        planner.acquire_memory('b', 10 ** 12)
+
+
+class TaskWorker:
+    """
+    TaskWorker: utility object built in TaskExecutor workers
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+    def scale(self, value):
+        return value * self.config['factor']
+
+    def fail(self, message):
+        raise KeyError(message)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+
+class TaskExecutorTest(unittest.TestCase):
+    """
+    Unit tests of running tasks in worker processes
+    """
+
+    def setUp(self):
+        self.executor = TaskExecutor(TaskWorker, {'factor': 3}, 2, poll_interval=0.1)
+
+    def tearDown(self):
+        self.executor.cancel()
+
+    def test_results(self):
+        self.assertEqual(self.executor.submit('scale', 2).get(), 6)
+        self.assertEqual(self.executor.map('scale', [(value,) for value in range(5)]),
+                         [0, 3, 6, 9, 12])
+
+    def test_error_propagation(self):
+        with self.assertRaises(TaskError) as context:
+            self.executor.submit('fail', 'broken index').get()
+        self.assertEqual(context.exception.task, 'fail')
+        self.assertEqual(context.exception.error_type, 'KeyError')
+        self.assertIn('broken index', context.exception.message)
+        self.assertIn('raise KeyError', context.exception.traceback_text)
+
+        # the worker goes on with the next task
+        self.assertEqual(self.executor.submit('scale', 1).get(), 3)
+
+    def test_map_cancels_on_first_failure(self):
+        start_time = time.time()
+        with self.assertRaises(TaskError) as context:
+            self.executor.map('sleep', [('not a number',), (30,), (30,)])
+        self.assertEqual(context.exception.error_type, 'TypeError')
+        self.assertTrue(self.executor.cancelled)
+        self.assertLess(time.time() - start_time, 10)
+
+    def test_cancel(self):
+        future = self.executor.submit('sleep', 30)
+        self.executor.cancel()
+        with self.assertRaises(TaskCancelledError):
+            future.get()
+
+
+class ReadsPipelineTest(unittest.TestCase):
+    """
+    Unit tests of the download, align and upload pipeline of sample set libraries
+    """
+
+    def test_results_in_item_order(self):
+        downloads = []
+
+        def download(items):
+            downloads.append(list(items))
+            return ['reads{}'.format(item) for item in items]
+
+        def align(item, reads):
+            # later items finish first
+            time.sleep(0.05 * (5 - item))
+            return reads + '.bam'
+
+        pipeline = ReadsPipeline(download, align, lambda item, aligned: aligned.upper(), 3,
+                                 prefetch_depth=2, batch_size=2, poll_interval=0.05)
+
+        results = pipeline.run(range(5))
+
+        self.assertEqual(results, ['READS{}.BAM'.format(item) for item in range(5)])
+        self.assertEqual(sum(downloads, []), range(5))
+        self.assertTrue(all(len(batch) <= 2 for batch in downloads))
+
+    def test_failed_batch_is_retried_item_by_item(self):
+        def download(items):
+            if len(items) > 1 or items[0] == 1:
+                raise IOError('download failed')
+            return items
+
+        pipeline = ReadsPipeline(download, lambda item, reads: reads,
+                                 lambda item, aligned: aligned, 2, batch_size=3,
+                                 poll_interval=0.05)
+
+        results = pipeline.run(range(3))
+
+        self.assertEqual(results[0], 0)
+        self.assertIsInstance(results[1], PipelineError)
+        self.assertEqual(results[1].stage, 'download')
+        self.assertEqual(results[2], 2)
+
+    def test_cancel_on_first_failure(self):
+        errors = []
+
+        def align(item, reads):
+            if item == 1:
+                raise ValueError('tophat failed')
+            return reads
+
+        pipeline = ReadsPipeline(lambda items: items, align, lambda item, aligned: aligned, 1,
+                                 prefetch_depth=0, cancel_on_error=True,
+                                 on_error=errors.append, poll_interval=0.05)
+
+        results = pipeline.run(range(5))
+
+        self.assertEqual(results[0], 0)
+        self.assertEqual(results[1].stage, 'alignment')
+        self.assertFalse(results[1].cancelled)
+        self.assertIn('tophat failed', results[1].message)
+        self.assertTrue(all(isinstance(result, PipelineError) and result.cancelled
+                            for result in results[2:]))
+        self.assertEqual(errors, [results[1]])
+
+
+def _hold_lock(lock_file, exclusive, locked, release):
+    lock = FileLock(lock_file)
+    lock.acquire(exclusive=exclusive)
+    locked.set()
+    release.wait(30)
+    lock.release()
+
+
+def _record_library(result_directory, key):
+    RunJournal(result_directory).record(key, 'downloaded', reads_files=[key + '.fastq'])
+
+
+class RunJournalTest(unittest.TestCase):
+    """
+    Unit tests of journaling and resuming runs, and of the file locks that keep the journal
+    consistent across processes
+    """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def hold_lock(self, lock_file, exclusive=True):
+        """
+        hold_lock: takes lock_file in another process
+
+        return process and the event that makes it release the lock
+        """
+        locked = multiprocessing.Event()
+        release = multiprocessing.Event()
+        process = multiprocessing.Process(target=_hold_lock,
+                                          args=(lock_file, exclusive, locked, release))
+        process.start()
+        self.assertTrue(locked.wait(10))
+
+        return process, release
+
+    def test_reached(self):
+        journal = RunJournal(self.work_dir)
+        self.assertFalse(journal.exists())
+        journal.start({'input_ref': '1/2/3'})
+        self.assertTrue(journal.exists())
+
+        self.assertFalse(journal.reached('1/4/1', 'downloaded'))
+        journal.record('1/4/1', 'downloaded', reads_files=['reads.fastq'])
+        journal.record('1/4/1', 'aligned', tophat_result_dir='tophat2_result')
+
+        self.assertTrue(journal.reached('1/4/1', 'downloaded'))
+        self.assertTrue(journal.reached('1/4/1', 'aligned'))
+        self.assertFalse(journal.reached('1/4/1', 'uploaded'))
+        record = journal.get('1/4/1')
+        self.assertEqual(record['reads_files'], ['reads.fastq'])
+        self.assertEqual(record['tophat_result_dir'], 'tophat2_result')
+
+        # records handed out are copies
+        record['reads_files'].append('other.fastq')
+        self.assertEqual(journal.get('1/4/1')['reads_files'], ['reads.fastq'])
+
+        with self.assertRaisesRegexp(ValueError, 'Unknown run stage: done'):
+            journal.record('1/4/1', 'done')
+
+    def test_resume(self):
+        params = {'input_ref': '1/2/3', 'preset_options': 'b2-fast', 'num_threads': 4}
+        RunJournal(self.work_dir).start(params)
+        RunJournal(self.work_dir).record('1/4/1', 'uploaded', alignment_ref='1/5/1')
+
+        resumed_params = dict(params, num_threads=8, resume_from=self.work_dir)
+        journal = RunJournal(self.work_dir)
+        journal.start(resumed_params)
+        self.assertEqual(journal.get('1/4/1')['alignment_ref'], '1/5/1')
+
+        changed_params = dict(params, preset_options='b2-sensitive', read_mismatches=3)
+        with self.assertRaisesRegexp(ValueError, 'different params: preset_options, '
+                                                 'read_mismatches'):
+            RunJournal(self.work_dir).start(changed_params)
+
+    def test_records_of_concurrent_processes(self):
+        RunJournal(self.work_dir).start({'input_ref': '1/2/3'})
+        keys = ['1/{}/1'.format(number) for number in range(4)]
+        processes = [multiprocessing.Process(target=_record_library, args=(self.work_dir, key))
+                     for key in keys]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+
+        journal = RunJournal(self.work_dir)
+        self.assertTrue(all(journal.reached(key, 'downloaded') for key in keys))
+
+    def test_file_lock_across_processes(self):
+        lock_file = os.path.join(self.work_dir, 'entry.lock')
+        process, release = self.hold_lock(lock_file)
+
+        lock = FileLock(lock_file)
+        self.assertFalse(lock.try_acquire())
+        self.assertFalse(lock.try_acquire(exclusive=False))
+        with self.assertRaisesRegexp(RuntimeError, 'Timed out'):
+            lock.acquire(timeout=0.2, poll_interval=0.1)
+
+        release.set()
+        process.join(10)
+        self.assertTrue(lock.try_acquire())
+        lock.release()
+
+    def test_shared_file_locks(self):
+        lock_file = os.path.join(self.work_dir, 'entry.lock')
+        process, release = self.hold_lock(lock_file, exclusive=False)
+
+        lock = FileLock(lock_file)
+        self.assertTrue(lock.try_acquire(exclusive=False))
+        lock.release()
+        self.assertFalse(lock.try_acquire())
+
+        # the kernel drops the lock of a process that is gone
+        process.terminate()
+        process.join(10)
+        self.assertTrue(lock.try_acquire())
+        lock.release()